@@ -2,6 +2,11 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with uvicorn to use live result streams (SYSMEX_LIVE_UPDATES=1):
+
+    uvicorn backend.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+Set REDIS_URL as well so results stored by listen_sysmex reach every worker.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
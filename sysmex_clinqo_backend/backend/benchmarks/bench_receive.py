@@ -0,0 +1,88 @@
+"""
+Receive-path microbenchmark: `data_block += data` vs ReceiveBuffer.recv_into
+
+Streams N MB of ASTM-shaped records through a local socketpair and times how
+long each strategy takes to receive (and, for ReceiveBuffer, split into
+records). Concatenation re-copies the whole block on every read, so its
+time grows quadratically; recv_into stays linear.
+
+    python benchmarks/bench_receive.py [--sizes 1,10,100] [--read-size 1024]
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.recvbuf import ReceiveBuffer  # noqa: E402
+
+RECORD = b'R|1|^^^^WBC^1|7.50|10*3/uL||N||||||20250710154953\r'
+MB = 1024 * 1024
+# Concatenation above this size takes minutes (16 MB: ~90s); it is reported as skipped
+CONCAT_LIMIT_MB = 4
+
+
+def send_payload(sock: socket.socket, size: int):
+    chunk = RECORD * (64 * 1024 // len(RECORD))
+    sent = 0
+    while sent < size:
+        part = chunk[:size - sent]
+        sock.sendall(part)
+        sent += len(part)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def receive_concat(sock: socket.socket, read_size: int) -> int:
+    data_block = b''
+    while True:
+        data = sock.recv(read_size)
+        if not data:
+            break
+        data_block += data
+    return len(data_block)
+
+
+def receive_buffer(sock: socket.socket, read_size: int) -> int:
+    buffer = ReceiveBuffer(read_size=read_size)
+    records = 0
+    while buffer.recv_into(sock):
+        for _ in buffer.split_records():
+            records += 1
+    return records
+
+
+def run(strategy, size: int, read_size: int) -> float:
+    left, right = socket.socketpair()
+    sender = threading.Thread(target=send_payload, args=(left, size))
+    started = time.perf_counter()
+    sender.start()
+    strategy(right, read_size)
+    elapsed = time.perf_counter() - started
+    sender.join()
+    left.close()
+    right.close()
+    return elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument('--sizes', default='1,4,16,64,100', help='Session sizes in MB')
+    arg_parser.add_argument('--read-size', type=int, default=1024, help='Bytes per recv call')
+    args = arg_parser.parse_args()
+
+    print(f"{'MB':>6} {'concat s':>10} {'recv_into s':>12} {'recv_into MB/s':>15} {'s per MB':>9}")
+    for size_mb in (int(s) for s in args.sizes.split(',')):
+        size = size_mb * MB
+        if size_mb <= CONCAT_LIMIT_MB:
+            concat = f"{run(receive_concat, size, args.read_size):10.3f}"
+        else:
+            concat = f"{'skipped':>10}"
+        buffered = run(receive_buffer, size, args.read_size)
+        print(f"{size_mb:>6} {concat} {buffered:12.3f} {size_mb / buffered:15.1f} {buffered / size_mb:9.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""
+Ingest benchmark suite
+
+Runs synthetic XN-style traffic (benchmarks/synthetic.py) through the hot
+paths and reports samples/s, MB/s and peak traced memory:
+
+  parser    parse_sysmex_data on a whole export, and the stream parser
+  specimen  extract_sample_id_from_field on typical O-record fields, with
+            and without the matcher's LRU cache
+  listener  AnalyzerServer over loopback with real E1381 framing and ACKs
+  upload    POST /api/upload/ against a throwaway test database
+
+Results are compared with benchmarks/baseline.json when it exists; a
+throughput drop or memory growth beyond --tolerance is reported as a
+regression. --save-baseline records the current run as the new baseline.
+
+    python benchmarks/run_benchmarks.py [--only parser,listener] [--messages 2000]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks import synthetic  # noqa: E402
+from core.astm import ACK  # noqa: E402
+from core.parser import SysmexStreamParser, parse_sysmex_data, parse_sysmex_file  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+SUITES = ('parser', 'specimen', 'listener', 'upload')
+# metric name suffix -> whether a bigger number is better
+HIGHER_IS_BETTER = {'samples_per_s': True, 'mb_per_s': True, 'calls_per_s': True, 'peak_mb': False,
+                    'retained_mb': False}
+
+
+@contextlib.contextmanager
+def quiet():
+    """Keep progress output of the code under test off the terminal"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def measure(func, repeat: int = 3, setup=None):
+    """Best wall time of repeat runs, then one traced run for peak memory
+
+    setup, when given, runs untimed before every run.
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def throughput(samples: int, size: int, seconds: float, peak: int = None):
+    metrics = {
+        'samples_per_s': round(samples / seconds, 1),
+        'mb_per_s': round(size / seconds / 1e6, 2),
+    }
+    if peak is not None:
+        metrics['peak_mb'] = round(peak / 1e6, 2)
+    return metrics
+
+
+def bench_parser(args):
+    data = synthetic.as_file(synthetic.generate_messages(
+        args.messages, samples_per_message=args.samples_per_message, fragment_ratio=0.05))
+    expected = args.messages * args.samples_per_message
+
+    def batch():
+        with quiet():
+            return len(parse_sysmex_data(data))
+
+    def stream():
+        chunk_size = 64 * 1024
+        parser = SysmexStreamParser()
+        count = 0
+        with quiet():
+            for i in range(0, len(data), chunk_size):
+                count += len(parser.feed(data[i:i + chunk_size]))
+            count += len(parser.close())
+        return count
+
+    results = {}
+    for name, func in (('batch', batch), ('stream', stream)):
+        seconds, peak, parsed = measure(func)
+        results[f'parser.{name}'] = dict(throughput(parsed, len(data), seconds, peak),
+                                         samples=parsed, expected=expected, bytes=len(data))
+
+    # What a batch of parsed samples costs to hold until it is written
+    tracemalloc.start()
+    held = parse_sysmex_data(data)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['parser.retained'] = {'retained_mb': round(retained / 1e6, 2), 'samples': len(held)}
+    return results
+
+
+def bench_specimen(args):
+    fields = ['7^10^               3615525^B', '7^10^3615525^B', '3616340',
+              '7^1^3616340^B', '7^8^   3615532^B', '^^^^WBC']
+    parser = parse_sysmex_file()
+    calls = 20000
+
+    def run():
+        for i in range(calls):
+            parser.extract_sample_id_from_field(fields[i % len(fields)])
+
+    def uncached():
+        for i in range(calls):
+            parser.matcher._match(fields[i % len(fields)])
+
+    results = {}
+    for name, func in (('extract', run), ('uncached', uncached)):
+        seconds, _, _ = measure(func)
+        results[f'specimen.{name}'] = {'calls_per_s': round(calls / seconds, 1)}
+    return results
+
+
+def bench_listener(args):
+    from core.server import AnalyzerServer
+
+    messages = [synthetic.as_frames(records)
+                for records in synthetic.generate_messages(args.listener_messages)]
+    size = sum(len(frame) for frames in messages for frame in frames)
+    stored = []
+    ready = threading.Event()
+    state = {}
+
+    def serve():
+        async def main():
+            server = AnalyzerServer(stored.extend, host='127.0.0.1', port=0, idle_timeout=None,
+                                    batch_interval=0.01)
+            await server.start()
+            state['port'] = server.server.sockets[0].getsockname()[1]
+            state['server'] = server
+            state['loop'] = asyncio.get_running_loop()
+            ready.set()
+            await server.stopping.wait()
+            await server.stop()
+        with quiet():
+            asyncio.run(main())
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    ready.wait()
+
+    def client(batch):
+        with socket.create_connection(('127.0.0.1', state['port'])) as conn:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for frames in batch:
+                for frame in frames:
+                    conn.sendall(frame)
+                    if frame[0] != 0x04:  # every byte but EOT is answered
+                        if conn.recv(1) != bytes([ACK]):
+                            raise RuntimeError('analyzer frame was not ACKed')
+
+    connections = max(1, args.connections)
+    batches = [messages[i::connections] for i in range(connections)]
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(batch,)) for batch in batches]
+    for worker in clients:
+        worker.start()
+    for worker in clients:
+        worker.join()
+    state['loop'].call_soon_threadsafe(state['server'].request_stop)
+    thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {'listener.loopback': dict(throughput(len(stored), size, elapsed),
+                                      samples=len(stored), connections=connections)}
+
+
+def bench_upload(args):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from core.dedup import deduplicator
+    from core.models import MessageFingerprint, Patient, Sample, TestResult
+
+    data = synthetic.as_file(synthetic.generate_messages(args.upload_messages))
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        patient = Patient.objects.create(patient_id='BENCH', name='Benchmark', age=1, sex='F',
+                                         state='-', district='-', address='-')
+        Sample.objects.bulk_create([Sample(sample_id=sample_id, patient=patient, test_details={})
+                                    for sample_id in synthetic.sample_ids(args.upload_messages)])
+        client = Client()
+
+        def reset():
+            # Every run stores the same export: forget the previous run's
+            # results and fingerprints, or dedup turns it into a no-op
+            MessageFingerprint.objects.all().delete()
+            TestResult.objects.all().delete()
+            Sample.objects.update(test_details={})
+            deduplicator.clear()
+
+        def upload():
+            with quiet():
+                response = client.post('/api/upload/', {
+                    'file': SimpleUploadedFile('export.txt', data, content_type='text/plain')})
+            if response.status_code != 200:
+                raise RuntimeError(f"upload failed: {response.status_code} {response.content[:200]}")
+            body = response.json()
+            if any(body['duplicates'].values()):
+                raise RuntimeError(f"upload skipped duplicates: {body['duplicates']}")
+            return body
+
+        seconds, peak, body = measure(upload, repeat=2, setup=reset)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    return {'upload.endpoint': dict(throughput(args.upload_messages, len(data), seconds, peak),
+                                    timings_ms=body.get('timings_ms'))}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get('results', {}).get(name, {})
+        for metric, higher_is_better in HIGHER_IS_BETTER.items():
+            if metric not in metrics or metric not in base or not base[metric]:
+                continue
+            change = (metrics[metric] - base[metric]) / base[metric]
+            worse = -change if higher_is_better else change
+            marker = ''
+            if worse > tolerance:
+                marker = '  <-- REGRESSION'
+                regressions.append(f"{name}.{metric}")
+            print(f"  {name:20} {metric:14} {base[metric]:>12} -> {metrics[metric]:>12} "
+                  f"({change:+.1%}){marker}")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Sysmex ingest benchmark suite')
+    arg_parser.add_argument('--only', default=','.join(SUITES),
+                            help=f"Comma separated suites to run ({', '.join(SUITES)})")
+    arg_parser.add_argument('--messages', type=int, default=2000, help='Messages for the parser suite')
+    arg_parser.add_argument('--samples-per-message', type=int, default=1)
+    arg_parser.add_argument('--listener-messages', type=int, default=300)
+    arg_parser.add_argument('--connections', type=int, default=4, help='Concurrent analyzer connections')
+    arg_parser.add_argument('--upload-messages', type=int, default=1000)
+    arg_parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    arg_parser.add_argument('--save-baseline', action='store_true')
+    arg_parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative slowdown/memory growth before flagging (0.2 = 20%%)')
+    args = arg_parser.parse_args()
+
+    suites = {'parser': bench_parser, 'specimen': bench_specimen,
+              'listener': bench_listener, 'upload': bench_upload}
+    results = {}
+    for name in args.only.split(','):
+        print(f"[BENCH] {name}...", file=sys.stderr)
+        results.update(suites[name](args))
+
+    print(json.dumps(results, indent=2))
+
+    if args.baseline.exists():
+        print(f"\nCompared with {args.baseline.name}:")
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {'results': {}}
+        baseline['results'].update(results)
+        baseline['machine'] = f"{platform.python_implementation()} {platform.python_version()} {platform.machine()}"
+        baseline['recorded'] = time.strftime('%Y-%m-%d')
+        args.baseline.write_text(json.dumps(baseline, indent=2) + '\n')
+        print(f"\nBaseline saved to {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Synthetic Sysmex XN-series ASTM traffic for benchmarks
+
+Produces H/P/O/R/C/L messages shaped like real analyzer output: caret
+padded specimen fields ("7^10^               3615525^B"), a full CBC/DIFF
+result panel, PNG scattergram/histogram attachment records, comments,
+and optionally R-only fragments as seen after a dropped connection.
+Output is deterministic for a given seed.
+"""
+import random
+from typing import Iterator, List
+
+from core.astm import ENQ, EOT, build_frame
+
+# (analyte, unit, low, high, decimals)
+CBC_PANEL = [
+    ('WBC', '10*3/uL', 3.5, 11.0, 2), ('RBC', '10*6/uL', 3.8, 5.9, 2),
+    ('HGB', 'g/dL', 11.0, 17.5, 1), ('HCT', '%', 34.0, 52.0, 1),
+    ('MCV', 'fL', 78.0, 100.0, 1), ('MCH', 'pg', 26.0, 34.0, 1),
+    ('MCHC', 'g/dL', 31.0, 36.0, 1), ('PLT', '10*3/uL', 140.0, 450.0, 0),
+    ('NEUT%', '%', 40.0, 75.0, 1), ('LYMPH%', '%', 18.0, 45.0, 1),
+    ('MONO%', '%', 2.0, 10.0, 1), ('EO%', '%', 0.0, 6.0, 1),
+    ('BASO%', '%', 0.0, 2.0, 1), ('NEUT#', '10*3/uL', 1.5, 7.5, 2),
+    ('LYMPH#', '10*3/uL', 1.0, 4.0, 2), ('MONO#', '10*3/uL', 0.1, 1.0, 2),
+    ('EO#', '10*3/uL', 0.0, 0.5, 2), ('BASO#', '10*3/uL', 0.0, 0.2, 2),
+    ('IG%', '%', 0.0, 1.0, 1), ('IG#', '10*3/uL', 0.0, 0.1, 2),
+    ('RDW-SD', 'fL', 37.0, 54.0, 1), ('RDW-CV', '%', 11.5, 14.5, 1),
+    ('PDW', 'fL', 9.0, 17.0, 1), ('MPV', 'fL', 9.0, 13.0, 1),
+    ('P-LCR', '%', 13.0, 43.0, 1), ('PCT', '%', 0.17, 0.35, 2),
+    ('NRBC#', '10*3/uL', 0.0, 0.01, 2), ('NRBC%', '/100WBC', 0.0, 0.2, 1),
+    ('RET%', '%', 0.5, 2.5, 2), ('RET#', '10*6/uL', 0.02, 0.1, 4),
+    ('IRF', '%', 1.5, 15.0, 1), ('RET-He', 'pg', 28.0, 36.0, 1),
+]
+IMAGES = ['WDF', 'WDF_FSC', 'RBC', 'PLT', 'RET', 'RET_EXT', 'PLT-F']
+HEADER = 'H|\\^&|||XN-550^00-26^12345^^^^11001||||||||E1394-97'
+
+
+def specimen_field(rng: random.Random, sample_id: str) -> str:
+    rack, position = rng.randint(1, 99), rng.randint(1, 10)
+    padding = ' ' * rng.choice((0, 3, 15))
+    return f"{rack}^{position}^{padding}{sample_id}^B"
+
+
+def result_records(rng: random.Random, sample_id: str, timestamp: str,
+                   with_images: bool = True) -> List[str]:
+    records = []
+    for seq, (analyte, unit, low, high, decimals) in enumerate(CBC_PANEL, 1):
+        value = rng.uniform(low * 0.8, high * 1.2)
+        flag = 'L' if value < low else 'H' if value > high else 'N'
+        text = '----' if rng.random() < 0.005 else f"{value:.{decimals}f}"
+        records.append(f"R|{seq}|^^^^{analyte}^1|{text}|{unit}||{flag}||||||{timestamp}")
+    if with_images:
+        stamp = f"{timestamp[:4]}_{timestamp[4:6]}_{timestamp[6:8]}_{timestamp[8:10]}_{timestamp[10:12]}"
+        for seq, image in enumerate(IMAGES, len(CBC_PANEL) + 1):
+            records.append(
+                f"R|{seq}|^^^^SCAT_{image}^^^^^|PNG&R&{timestamp[:8]}&R&{stamp}_{sample_id}_{image}.PNG"
+                f"|||N||||||{timestamp}")
+    return records
+
+
+def message_records(rng: random.Random, sample_ids: List[str], with_images: bool = True,
+                    fragmented: bool = False) -> List[str]:
+    """Records of one H..L message (or an R-only fragment) for sample_ids"""
+    timestamp = f"2025{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}" \
+                f"{rng.randint(0, 23):02d}{rng.randint(0, 59):02d}{rng.randint(0, 59):02d}"
+    if fragmented:
+        return result_records(rng, sample_ids[0], timestamp, with_images) + ['L|1|N']
+
+    records = [f"{HEADER}|{timestamp}", 'P|1|||||||||||||||||||||||||||||||']
+    for seq, sample_id in enumerate(sample_ids, 1):
+        records.append(f"O|{seq}||{specimen_field(rng, sample_id)}|^^^^WBC\\^^^^RBC\\^^^^DIFF|||||||N||||||||||||||F")
+        records.extend(result_records(rng, sample_id, timestamp, with_images))
+        if rng.random() < 0.2:
+            records.append('C|1||Sample aspirated in manual mode|G')
+    records.append('L|1|N')
+    return records
+
+
+def generate_messages(count: int, samples_per_message: int = 1, with_images: bool = True,
+                      fragment_ratio: float = 0.0, seed: int = 1234,
+                      first_sample_id: int = 3600000) -> Iterator[List[str]]:
+    """Yield the records of count messages, with unique 7-digit sample IDs"""
+    rng = random.Random(seed)
+    next_id = first_sample_id
+    for _ in range(count):
+        ids = [str(next_id + i) for i in range(samples_per_message)]
+        next_id += samples_per_message
+        fragmented = rng.random() < fragment_ratio
+        yield message_records(rng, ids[:1] if fragmented else ids, with_images, fragmented)
+
+
+def sample_ids(count: int, samples_per_message: int = 1, first_sample_id: int = 3600000) -> List[str]:
+    """The sample IDs generate_messages() will use, for registering them up front"""
+    return [str(first_sample_id + i) for i in range(count * samples_per_message)]
+
+
+def as_file(messages) -> bytes:
+    """Raw export format: CR-terminated records, as saved by the listener"""
+    return ''.join(''.join(record + '\r' for record in records) for records in messages).encode()
+
+
+def as_frames(records: List[str]) -> List[bytes]:
+    """One E1381 transmission (ENQ, one frame per record, EOT) for a message"""
+    frames = [bytes([ENQ])]
+    for number, record in enumerate(records, 1):
+        frames.append(build_frame(number, (record + '\r').encode()))
+    frames.append(bytes([EOT]))
+    return frames
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+        from .dedup import deduplicator
+        from .specimen import configure_matchers
+        from . import signals  # noqa: F401 (patient_cache invalidation)
+
+        configure_matchers(getattr(settings, 'SYSMEX_SPECIMEN_FORMATS', {}))
+        deduplicator.configure(enabled=getattr(settings, 'SYSMEX_DEDUP', True),
+                               capacity=getattr(settings, 'SYSMEX_DEDUP_LRU_SIZE', 100_000))
@@ -0,0 +1,306 @@
+from collections import deque
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# ASTM E1381 low-level control characters
+ENQ = 0x05
+ACK = 0x06
+NAK = 0x15
+EOT = 0x04
+STX = 0x02
+ETX = 0x03
+ETB = 0x17
+CR = 0x0D
+LF = 0x0A
+
+# A frame is STX FN <text> ETB|ETX C1 C2 CR LF; E1381 caps text at 240
+# bytes but Sysmex hosts can be configured for longer frames.
+MAX_FRAME_SIZE = 64 * 1024
+FRAME_TRAILER_SIZE = 4  # C1 C2 CR LF
+MAX_FRAME_TEXT = 240  # what we send, for any receiver
+MAX_RETRANSMISSIONS = 6
+
+
+def frame_checksum(body: bytes) -> bytes:
+    """Checksum of FN..ETB/ETX inclusive as two uppercase hex digits"""
+    return b'%02X' % (sum(body) & 0xFF)
+
+
+def build_frame(frame_number: int, text: bytes, final: bool = True) -> bytes:
+    """Build a single STX..CR LF frame around text"""
+    body = bytes([0x30 + frame_number % 8]) + text + bytes([ETX if final else ETB])
+    return bytes([STX]) + body + frame_checksum(body) + bytes([CR, LF])
+
+
+def build_frames(records: Iterable[str], max_text: int = MAX_FRAME_TEXT) -> List[bytes]:
+    """Frame one message: each record ends with CR and its own ETX frame,
+    longer records are split into ETB-continued frames. Frame numbers run
+    1..7, 0, 1, ... across the message."""
+    frames = []
+    for record in records:
+        text = record.encode('utf-8') + b'\r'
+        for offset in range(0, len(text), max_text):
+            final = offset + max_text >= len(text)
+            frames.append(build_frame(len(frames) + 1, text[offset:offset + max_text], final))
+    return frames
+
+
+class ASTMFrameReceiver:
+    """
+    Receiver side of the ASTM E1381 low-level protocol.
+
+    Bytes are fed exactly as read from the connection and feed() returns the
+    ACK/NAK bytes that must be written back. Valid frames are acknowledged,
+    frames with a bad checksum or out-of-sequence frame number are NAKed,
+    and retransmissions of the previous frame are ACKed but dropped. Text
+    from ETB-continued frames is joined and every complete record is passed
+    to record_handler as soon as its ETX frame arrives, so only the frame in
+    flight is ever buffered.
+
+    Bytes arriving outside of a transfer phase that are not control
+    characters are handed to raw_handler unchanged, which keeps analyzers
+    configured for unframed output working.
+    """
+
+    def __init__(self,
+                 record_handler: Optional[Callable[[str], None]] = None,
+                 raw_handler: Optional[Callable[[bytes], None]] = None):
+        self.record_handler = record_handler
+        self.raw_handler = raw_handler
+
+        self.in_transfer = False
+        self.in_frame = False
+        self.frame = bytearray()
+        self.expected_frame_number = 1
+        self.frames_in_transfer = 0  # accepted since the last ENQ
+        self.record_text = bytearray()
+
+        self.frames_received = 0
+        self.frames_rejected = 0
+        self.frames_duplicated = 0
+        self.records_received = 0
+
+    def feed(self, data: bytes, start: int = 0, end: Optional[int] = None) -> bytes:
+        """Consume raw bytes and return the reply bytes to send back.
+
+        start/end select a region of data (e.g. a ReceiveBuffer's array)
+        so callers don't need to slice it first.
+        """
+        reply = bytearray()
+        pos = start
+        size = len(data) if end is None else end
+
+        while pos < size:
+            if self.in_frame:
+                pos = self._consume_frame(data, pos, size, reply)
+                continue
+
+            byte = data[pos]
+            if byte == ENQ:
+                # Establishment phase: start a new transfer
+                self.in_transfer = True
+                self.expected_frame_number = 1
+                self.frames_in_transfer = 0
+                self.record_text.clear()
+                reply.append(ACK)
+                pos += 1
+            elif byte == STX and self.in_transfer:
+                self.in_frame = True
+                self.frame.clear()
+                pos += 1
+            elif byte == EOT:
+                # Termination phase: back to neutral, dropping any record
+                # whose ETB chain was aborted before its ETX frame
+                self.in_transfer = False
+                self.in_frame = False
+                self.record_text.clear()
+                pos += 1
+            elif self.in_transfer:
+                # Stray bytes between frames (e.g. a late LF) are ignored
+                pos += 1
+            else:
+                # Unframed traffic: forward everything up to the next ENQ
+                raw_end = data.find(bytes([ENQ]), pos, size)
+                if raw_end == -1:
+                    raw_end = size
+                if self.raw_handler:
+                    self.raw_handler(memoryview(data)[pos:raw_end])
+                pos = raw_end
+
+        return bytes(reply)
+
+    def _consume_frame(self, data: bytes, pos: int, size: int, reply: bytearray) -> int:
+        """Append bytes to the frame in flight, completing it if possible"""
+        frame = self.frame
+
+        while pos < size:
+            end = data.find(b'\n', pos, size)
+            if end == -1:
+                frame += data[pos:size]
+                pos = size
+            else:
+                frame += data[pos:end + 1]
+                pos = end + 1
+                if (len(frame) > FRAME_TRAILER_SIZE
+                        and frame[-FRAME_TRAILER_SIZE - 1] in (ETX, ETB)
+                        and frame[-2] == CR):
+                    self.in_frame = False
+                    reply.append(self._complete_frame(bytes(frame)))
+                    return pos
+            if len(frame) > MAX_FRAME_SIZE:
+                # Runaway frame: reject and wait for the sender to retry
+                self.in_frame = False
+                self.frames_rejected += 1
+                reply.append(NAK)
+                return pos
+
+        return pos
+
+    def _complete_frame(self, frame: bytes) -> int:
+        """Validate a full frame (without STX) and return ACK or NAK"""
+        body = frame[:-FRAME_TRAILER_SIZE]
+        checksum = frame[-FRAME_TRAILER_SIZE:-2]
+
+        if frame_checksum(body) != checksum.upper():
+            self.frames_rejected += 1
+            return NAK
+
+        frame_number = body[0] - 0x30
+        if self.frames_in_transfer and frame_number == (self.expected_frame_number - 1) % 8:
+            # Sender missed our ACK and retransmitted the previous frame;
+            # before the first frame there is none, so frame 0 is out of sequence
+            self.frames_duplicated += 1
+            return ACK
+        if frame_number != self.expected_frame_number:
+            self.frames_rejected += 1
+            return NAK
+
+        self.expected_frame_number = (self.expected_frame_number + 1) % 8
+        self.frames_in_transfer += 1
+        self.frames_received += 1
+        self.record_text += body[1:-1]
+        if body[-1] == ETX:
+            self._flush_record_text()
+        return ACK
+
+    def _flush_record_text(self):
+        """Pass every complete record collected so far to record_handler"""
+        if not self.record_text:
+            return
+
+        try:
+            text = self.record_text.decode('utf-8')
+        except UnicodeDecodeError:
+            text = self.record_text.decode('latin-1', errors='replace')
+        self.record_text.clear()
+        for record in text.split('\r'):
+            record = record.strip()
+            if record:
+                self.records_received += 1
+                if self.record_handler:
+                    self.record_handler(record)
+
+
+class ASTMFrameSender:
+    """
+    Sender side of the ASTM E1381 low-level protocol, for replies to the
+    analyzer (e.g. host query answers).
+
+    Messages are queued with send(); bid() returns the ENQ that asks the
+    analyzer for the line. Bytes read from the connection are passed to
+    feed() while the sender is active, which returns how far it consumed
+    them and the bytes to write back: the next frame on ACK, the same
+    frame again on NAK (up to MAX_RETRANSMISSIONS), EOT after the last
+    frame. An ENQ in answer to our ENQ is contention; the analyzer has
+    priority, so the sender backs off and leaves that ENQ to the receiver.
+    A NAK to our ENQ marks the bid as refused until the caller bids again.
+    """
+
+    IDLE, BIDDING, SENDING = 'idle', 'bidding', 'sending'
+
+    def __init__(self):
+        self.outbox: deque = deque()
+        self.state = self.IDLE
+        self.frame_index = 0
+        self.retransmissions = 0
+        self.refused = False
+
+        self.messages_sent = 0
+        self.messages_failed = 0
+
+    @property
+    def active(self) -> bool:
+        return self.state != self.IDLE
+
+    @property
+    def pending(self) -> int:
+        return len(self.outbox)
+
+    def send(self, records: Iterable[str]):
+        frames = build_frames(records)
+        if frames:
+            self.outbox.append(frames)
+
+    def bid(self) -> bytes:
+        """ENQ if there is something to send and no transfer is in progress"""
+        if self.active or not self.outbox:
+            return b''
+        self.state = self.BIDDING
+        self.refused = False
+        return bytes([ENQ])
+
+    def feed(self, data: bytes, start: int = 0, end: Optional[int] = None) -> Tuple[int, bytes]:
+        """Consume the analyzer's replies; returns (position reached, bytes to send)"""
+        reply = bytearray()
+        pos = start
+        size = len(data) if end is None else end
+
+        while pos < size and self.active:
+            byte = data[pos]
+            if self.state == self.BIDDING:
+                if byte == ENQ:
+                    # Contention: the analyzer's ENQ belongs to the receiver
+                    self.state = self.IDLE
+                    break
+                if byte == ACK:
+                    self.state = self.SENDING
+                    self.frame_index = 0
+                    self.retransmissions = 0
+                    reply += self.outbox[0][0]
+                elif byte == NAK:
+                    self.state = self.IDLE
+                    self.refused = True
+            elif byte in (ACK, EOT):
+                # EOT is a receiver interrupt request; the message is short,
+                # so it is finished rather than resumed later
+                self.frame_index += 1
+                self.retransmissions = 0
+                frames = self.outbox[0]
+                if self.frame_index < len(frames):
+                    reply += frames[self.frame_index]
+                else:
+                    self.messages_sent += 1
+                    reply += self._finish()
+            elif byte == NAK:
+                self.retransmissions += 1
+                if self.retransmissions > MAX_RETRANSMISSIONS:
+                    self.messages_failed += 1
+                    reply += self._finish()
+                else:
+                    reply += self.outbox[0][self.frame_index]
+            # Anything else while sending is line noise
+            pos += 1
+
+        return pos, bytes(reply)
+
+    def abort(self) -> bytes:
+        """Give up on the message in flight (no reply in time); returns EOT or nothing"""
+        if self.state == self.SENDING:
+            self.messages_failed += 1
+            return self._finish()
+        self.state = self.IDLE
+        return b''
+
+    def _finish(self) -> bytes:
+        self.outbox.popleft()
+        self.state = self.IDLE
+        return bytes([EOT])
@@ -0,0 +1,86 @@
+"""
+Content-hash deduplication of ASTM messages
+
+Analyzers retransmit whole messages after a dropped connection or a
+missing ACK, and operators re-upload exports. Every H..L message is
+fingerprinted by a hash of its records, and a duplicate is dropped at the
+first layer that recognizes it:
+
+  1. the parser checks an in-memory LRU of fingerprints known to be
+     stored, before the message is parsed
+  2. store_parsed_samples checks the MessageFingerprint table, before
+     any lookup or write for the message's samples
+
+Fingerprints are stored in the same transaction as the samples they
+produced, so a message whose write failed (or whose sample was not yet
+registered) is never mistaken for a duplicate. The parser side stays
+free of database access so it can run on the listener's event loop.
+"""
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Sequence
+
+DIGEST_SIZE = 16
+LRU_CAPACITY = 100_000
+
+
+def message_digest(lines: Sequence[str]) -> str:
+    """Fingerprint of one message's records (hex, 32 characters)"""
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for line in lines:
+        digest.update(line.encode('utf-8', 'surrogateescape'))
+        digest.update(b'\r')
+    return digest.hexdigest()
+
+
+class MessageDeduplicator:
+    """Thread-safe LRU of stored message fingerprints, with hit/miss counters"""
+
+    def __init__(self, enabled: bool = True, capacity: int = LRU_CAPACITY):
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.recent: 'OrderedDict[str, None]' = OrderedDict()
+        self.configure(enabled, capacity)
+
+    def configure(self, enabled: bool = True, capacity: int = LRU_CAPACITY):
+        self.enabled = enabled
+        self.capacity = capacity
+        with self.lock:
+            while len(self.recent) > capacity:
+                self.recent.popitem(last=False)
+
+    def seen(self, digest: str) -> bool:
+        """True when digest is known to be stored already (an LRU hit)"""
+        with self.lock:
+            if digest in self.recent:
+                self.recent.move_to_end(digest)
+                self.counters['lru_hits'] += 1
+                return True
+            self.counters['lru_misses'] += 1
+            return False
+
+    def remember(self, digests: Iterable[str]):
+        """Record digests whose messages are now stored"""
+        with self.lock:
+            for digest in digests:
+                self.recent[digest] = None
+                self.recent.move_to_end(digest)
+            while len(self.recent) > self.capacity:
+                self.recent.popitem(last=False)
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters, lru_size=len(self.recent))
+
+    def clear(self):
+        with self.lock:
+            self.recent.clear()
+            self.counters.clear()
+
+
+deduplicator = MessageDeduplicator()
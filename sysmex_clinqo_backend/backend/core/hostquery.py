@@ -0,0 +1,55 @@
+"""
+Answers to analyzer host queries (ASTM Q records)
+
+An analyzer that reads a barcode it has no order for asks the host with a
+Q record. HostQueryResponder turns the queried specimens into the records
+of the reply message: a P and O record per specimen found in the pending
+order index (core/orders.py), or a terminator with code I ("no
+information available") when none were. It never queries the database,
+so the reply goes out as soon as the analyzer has ended its transfer.
+
+Sample has no per-test order, so every specimen is ordered with the same
+test profile (SYSMEX_HOST_QUERY_TESTS).
+"""
+from typing import List, Sequence
+
+from .metrics import HOST_QUERIES
+from .orders import PendingOrderIndex
+from .records import QueryRecord
+
+TESTS = ('WBC', 'RBC', 'DIFF')
+HOST_NAME = 'CLINQO'
+
+SEXES = {'m': 'M', 'male': 'M', 'f': 'F', 'female': 'F'}
+
+
+def field(value: str) -> str:
+    """Keep delimiters out of a free text field"""
+    return ''.join(' ' if char in '|\\^&\r\n' else char for char in str(value or ''))
+
+
+class HostQueryResponder:
+    def __init__(self, index: PendingOrderIndex, tests: Sequence[str] = TESTS, host_name: str = HOST_NAME):
+        self.index = index
+        # Universal test IDs, ^^^^WBC, repeated
+        self.test_ids = '\\'.join(f'^^^^{test}' for test in tests)
+        self.host_name = host_name
+
+    def __call__(self, queries: List[QueryRecord]) -> List[str]:
+        """The records of the reply message to queries"""
+        records = [f'H|\\^&|||{self.host_name}|||||||P|E1394-97']
+        found = 0
+        for query in queries:
+            order = self.index.get(query.sample_id) if query.sample_id else None
+            if order is None:
+                HOST_QUERIES.inc('unknown')
+                continue
+            HOST_QUERIES.inc('found')
+            found += 1
+            # Same field positions parse_patient_record reads
+            records.append(f'P|{found}|{field(order.patient_id)}|||{field(order.patient_name)}'
+                           f'|||{SEXES.get(order.sex.strip().lower(), "U")}')
+            records.append(f'O|1|{query.specimen_field}||{self.test_ids}'
+                           f'|||||||N||||||||||||||O')
+        records.append('L|1|N' if found else 'L|1|I')
+        return records
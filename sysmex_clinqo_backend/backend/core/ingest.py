@@ -0,0 +1,217 @@
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import patient_cache
+from .dedup import deduplicator
+from .live import live_broker, result_event
+from .metrics import (DB_LOOKUP_SECONDS, DB_WRITE_SECONDS, DUPLICATE_SAMPLES, SAMPLES_UNMATCHED,
+                      SAMPLES_WRITTEN)
+from .models import MessageFingerprint, Sample, TestResult
+from .orders import pending_orders
+from .records import ParsedSample
+
+logger = logging.getLogger(__name__)
+
+# SQLite allows 999 bound parameters per statement
+LOOKUP_CHUNK_SIZE = 900
+WRITE_BATCH_SIZE = 500
+ANALYTE_LENGTH = TestResult._meta.get_field('analyte').max_length
+
+
+def store_parsed_samples(parsed_samples: List[ParsedSample],
+                         timings: Optional[Dict[str, float]] = None,
+                         stats: Optional[Dict[str, int]] = None) -> Tuple[List[str], List[str]]:
+    """
+    Write parsed test results onto the matching registered samples
+
+    All sample IDs are resolved with set-based sample_id__in lookups and the
+    matches are written with chunked bulk_update calls in one transaction,
+    together with their normalized TestResult rows. When a sample ID appears
+    more than once, the last parsed results win.
+
+    Samples from messages whose fingerprint is already stored are skipped
+    before any other query; the fingerprints of messages whose samples
+    were all written are stored in the same transaction. Cached detail
+    pages of the affected patients are invalidated, live result events
+    published (core/live.py) and the samples dropped from the pending
+    order index (core/orders.py), on commit.
+
+    Args:
+        parsed_samples: ParsedSample records from parse_sysmex_file.parse_data / the stream parser
+        timings: Optional dict that receives 'lookup' and 'write' seconds
+        stats: Optional dict that receives 'duplicate_samples' skipped
+
+    Returns:
+        (updated sample IDs, sample IDs with no registered Sample)
+    """
+    parsed_samples, duplicates = skip_stored_messages(parsed_samples)
+    if stats is not None:
+        stats['duplicate_samples'] = stats.get('duplicate_samples', 0) + duplicates
+    if duplicates:
+        DUPLICATE_SAMPLES.inc(amount=duplicates)
+
+    results_by_id = {}
+    for parsed in parsed_samples:
+        if parsed.sample_id:
+            results_by_id[parsed.sample_id] = parsed
+
+    started = time.perf_counter()
+    sample_ids = list(results_by_id)
+    samples = []
+    for i in range(0, len(sample_ids), LOOKUP_CHUNK_SIZE):
+        chunk = sample_ids[i:i + LOOKUP_CHUNK_SIZE]
+        samples.extend(Sample.objects.filter(sample_id__in=chunk).select_related('patient')
+                       .only('id', 'sample_id', 'patient__patient_id'))
+    looked_up = time.perf_counter()
+
+    test_results = []
+    for sample in samples:
+        # Records become plain dicts only here, for the test_details JSON
+        sample.test_details = results_by_id[sample.sample_id].test_details()
+        test_results.extend(build_test_results(sample, sample.test_details))
+    found = {sample.sample_id for sample in samples}
+    fingerprints = stored_message_digests(parsed_samples, found)
+    with transaction.atomic():
+        Sample.objects.bulk_update(samples, ['test_details'], batch_size=WRITE_BATCH_SIZE)
+        replace_test_results(samples, test_results)
+        # bulk_update sends no post_save, so cached patient pages are dropped here
+        patient_cache.invalidate(sample.patient.patient_id for sample in samples)
+        pending_orders.results_stored(found)
+        events = [result_event(sample.sample_id, sample.patient.patient_id, results_by_id[sample.sample_id])
+                  for sample in samples]
+        transaction.on_commit(lambda: live_broker.publish(events))
+        if fingerprints:
+            MessageFingerprint.objects.bulk_create(
+                [MessageFingerprint(digest=digest) for digest in fingerprints],
+                batch_size=WRITE_BATCH_SIZE, ignore_conflicts=True)
+            transaction.on_commit(lambda: deduplicator.remember(fingerprints))
+    written = time.perf_counter()
+
+    if timings is not None:
+        timings['lookup'] = looked_up - started
+        timings['write'] = written - looked_up
+
+    updated_samples = [sample_id for sample_id in sample_ids if sample_id in found]
+    not_found_samples = [sample_id for sample_id in sample_ids if sample_id not in found]
+    if sample_ids:
+        DB_LOOKUP_SECONDS.observe(looked_up - started)
+        DB_WRITE_SECONDS.observe(written - looked_up)
+    SAMPLES_WRITTEN.inc(amount=len(updated_samples))
+    SAMPLES_UNMATCHED.inc(amount=len(not_found_samples))
+    return updated_samples, not_found_samples
+
+
+
+def skip_stored_messages(parsed_samples: List[ParsedSample]) -> Tuple[List[ParsedSample], int]:
+    """Drop samples of messages already in MessageFingerprint, return (rest, dropped)"""
+    digests = list({parsed.digest for parsed in parsed_samples if parsed.digest})
+    if not digests:
+        return parsed_samples, 0
+
+    stored = set()
+    for i in range(0, len(digests), LOOKUP_CHUNK_SIZE):
+        stored.update(MessageFingerprint.objects.filter(digest__in=digests[i:i + LOOKUP_CHUNK_SIZE])
+                      .values_list('digest', flat=True))
+    deduplicator.count('store_hits', len(stored))
+    deduplicator.count('store_misses', len(digests) - len(stored))
+    if not stored:
+        return parsed_samples, 0
+
+    deduplicator.remember(stored)
+    remaining = [parsed for parsed in parsed_samples if parsed.digest not in stored]
+    return remaining, len(parsed_samples) - len(remaining)
+
+
+def stored_message_digests(parsed_samples: List[ParsedSample], found) -> List[str]:
+    """Digests of messages whose samples are all registered, i.e. fully stored"""
+    complete = {}
+    for parsed in parsed_samples:
+        if parsed.digest:
+            complete[parsed.digest] = complete.get(parsed.digest, True) and parsed.sample_id in found
+    return [digest for digest, stored in complete.items() if stored]
+
+
+def store_listener_batch(parsed_samples: List[ParsedSample]):
+    """
+    store_parsed_samples for long-lived writer threads (listener, replay)
+
+    Outside the request cycle Django never recycles connections, so this
+    applies CONN_MAX_AGE / CONN_HEALTH_CHECKS before each batch: a dropped
+    or expired connection is replaced instead of failing every later write.
+    """
+    close_old_connections()
+    return store_parsed_samples(parsed_samples)
+
+def parse_instrument_timestamp(value: str) -> Optional[datetime]:
+    """Convert an ASTM YYYYMMDD[HHMMSS] timestamp to an aware datetime"""
+    value = (value or '').strip()
+    for fmt, length in (('%Y%m%d%H%M%S', 14), ('%Y%m%d', 8)):
+        if len(value) >= length:
+            try:
+                return timezone.make_aware(datetime.strptime(value[:length], fmt))
+            except ValueError:
+                continue
+    return None
+
+
+def build_test_results(sample: Sample, test_details: Dict[str, Any]) -> List[TestResult]:
+    """
+    Normalize a Sample.test_details dict into unsaved TestResult rows
+
+    Accepts both the parser format ({'WBC': {'value': 7.5, 'unit': ..., ...}})
+    and manually entered {'Parameter': 'Result'} dicts. Analyte names are cut
+    to the column width; a name that only differs from an earlier one past
+    that width is skipped (it stays in test_details). NaN and infinite
+    values are kept as raw_value only.
+    """
+    rows = []
+    analytes = set()
+    for analyte, result in (test_details or {}).items():
+        name = str(analyte)[:ANALYTE_LENGTH]
+        if name in analytes:
+            logger.warning("Sample pk %s: analyte %r collides with %r when truncated, skipped",
+                           sample.pk, analyte, name)
+            continue
+        analytes.add(name)
+
+        if isinstance(result, dict):
+            value = result.get('value')
+            unit = result.get('unit') or ''
+            flag = result.get('status') or ''
+            measured_at = parse_instrument_timestamp(result.get('timestamp'))
+        else:
+            value, unit, flag, measured_at = result, '', '', None
+
+        numeric = None
+        if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+            try:
+                numeric = float(value)
+            except (ValueError, OverflowError):
+                pass
+        if numeric is not None and not math.isfinite(numeric):
+            numeric = None
+
+        rows.append(TestResult(
+            sample=sample,
+            analyte=name,
+            value=numeric,
+            raw_value='' if value is None else str(value)[:255],
+            unit=str(unit)[:30],
+            flag=str(flag)[:10],
+            measured_at=measured_at,
+        ))
+    return rows
+
+
+def replace_test_results(samples: List[Sample], test_results: List[TestResult]):
+    """Swap the TestResult rows of samples for test_results (call inside a transaction)"""
+    sample_pks = [sample.pk for sample in samples]
+    for i in range(0, len(sample_pks), LOOKUP_CHUNK_SIZE):
+        TestResult.objects.filter(sample_id__in=sample_pks[i:i + LOOKUP_CHUNK_SIZE]).delete()
+    TestResult.objects.bulk_create(test_results, batch_size=WRITE_BATCH_SIZE)
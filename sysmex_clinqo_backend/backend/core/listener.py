@@ -1,40 +1,28 @@
-import socket
+import logging
 import os
 import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 django.setup()
 
-from core.parser import parse_sysmex_data_block, parse_sysmex_file
+from core.ingest import store_listener_batch
+from core.recvbuf import READ_SIZE
+from core.server import HOST, PORT, run_server
+from core.uploads import ingest_chunks
 
-HOST = '0.0.0.0'
-PORT = 6000
+logger = logging.getLogger(__name__)
 
 def start_tcp_listener():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((HOST, PORT))
-        s.listen(1)
-        print(f"[TCP] Listening on port {PORT}...")
-
-        conn, addr = s.accept()
-        print(f"[TCP] Connected by {addr}")
-
-        data_block = b""
-        with conn:
-            while True:
-                data = conn.recv(1024)
-                if not data:
-                    break
-                data_block += data
-
-        parse_sysmex_data_block(data_block)
+    # Keeps accepting analyzers until interrupted
+    run_server(store_listener_batch, host=HOST, port=PORT)
 
 
 def upload_file_and_parse(path: str):
     if not os.path.exists(path):
-        print(f"[FILE] File not found: {path}")
+        logger.error("File not found: %s", path)
         return
-    parse_sysmex_file(path)
+    with open(path, 'rb') as f:
+        ingest_chunks(iter(lambda: f.read(READ_SIZE), b''), total_bytes=os.path.getsize(path))
 
 
 if __name__ == "__main__":
@@ -46,4 +34,4 @@ if __name__ == "__main__":
         file_path = input("Enter full path to .txt file: ").strip()
         upload_file_and_parse(file_path)
     else:
-        print("Invalid mode. Use 'tcp' or 'file'.")
+        logger.error("Invalid mode %r. Use 'tcp' or 'file'.", mode)
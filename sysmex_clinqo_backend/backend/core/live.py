@@ -0,0 +1,195 @@
+"""
+Live "results arrived" events for dashboards, as Server-Sent Events
+
+store_parsed_samples publishes one small event per updated sample once
+its transaction commits. Each web process runs one LiveBroker on its
+ASGI event loop; it indexes subscriptions by patient and analyzer,
+encodes every event once and hands the same bytes to each matching
+client's queue, so an open dashboard costs a queue and a coroutine but
+no database queries.
+
+Without REDIS_URL events only reach clients of the process that stored
+the samples (uploads through the API). With it, every publisher sends
+its events to a Redis channel and each web process relays them to its
+own clients, which is what brings listen_sysmex results to dashboards.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from django.conf import settings
+
+from .records import analyzer_name
+from .metrics import LIVE_SUBSCRIBERS
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'sysmex-live'
+QUEUE_SIZE = 256  # events buffered per client before it is disconnected
+HEARTBEAT = 15.0  # seconds between keep-alive comments
+RELAY_RETRY = 5.0
+
+
+def result_event(sample_id: str, patient_id: str, parsed) -> Dict[str, Any]:
+    """The delta pushed for one updated sample (parsed is a ParsedSample)"""
+    header = parsed.header
+    return {
+        'sample_id': sample_id,
+        'patient_id': patient_id,
+        'analyzer': header.analyzer if header else '',
+        'tests': list(parsed.results),
+        'received_at': datetime.fromtimestamp(header.received_at).isoformat() if header else None,
+    }
+
+
+def encode(event: Dict[str, Any]) -> bytes:
+    return f"event: result\ndata: {json.dumps(event, separators=(',', ':'))}\n\n".encode()
+
+
+class Subscription:
+    __slots__ = ('patients', 'analyzers', 'queue')
+
+    def __init__(self, patients: Iterable[str], analyzers: Iterable[str]):
+        self.patients = frozenset(patients)
+        self.analyzers = frozenset(analyzer_name(name) for name in analyzers)
+        # None in the queue ends the stream
+        self.queue: 'asyncio.Queue[Optional[bytes]]' = asyncio.Queue(QUEUE_SIZE)
+
+
+class LiveBroker:
+    """Fan-out of result events to the SSE clients of this process"""
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.everything: Set[Subscription] = set()
+        self.by_patient: Dict[str, Set[Subscription]] = defaultdict(set)
+        self.by_analyzer: Dict[str, Set[Subscription]] = defaultdict(set)
+        # Every open subscription; only its size is read off the loop (metrics)
+        self.subscriptions: Set[Subscription] = set()
+        self.relay: Optional[asyncio.Task] = None
+        self.redis = None
+        self.dropped = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        """Safe from any thread, unlike the indexes"""
+        return len(self.subscriptions)
+
+    # Event loop side
+
+    def subscribe(self, patients: Iterable[str] = (), analyzers: Iterable[str] = ()) -> Subscription:
+        """Register a client; no filters means every event (call on the event loop)"""
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop, self.relay = loop, None
+        if self.relay is None and redis_url():
+            self.relay = loop.create_task(self.relay_from_redis())
+
+        subscription = Subscription(patients, analyzers)
+        self.subscriptions.add(subscription)
+        if not subscription.patients and not subscription.analyzers:
+            self.everything.add(subscription)
+        for patient_id in subscription.patients:
+            self.by_patient[patient_id].add(subscription)
+        for analyzer in subscription.analyzers:
+            self.by_analyzer[analyzer].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+        self.everything.discard(subscription)
+        for index, keys in ((self.by_patient, subscription.patients),
+                            (self.by_analyzer, subscription.analyzers)):
+            for key in keys:
+                subscriptions = index.get(key)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del index[key]
+
+    def dispatch(self, events: List[Dict[str, Any]]):
+        for event in events:
+            targets = set(self.everything)
+            targets.update(self.by_patient.get(event['patient_id'], ()))
+            targets.update(self.by_analyzer.get(event['analyzer'], ()))
+            if not targets:
+                continue
+            message = encode(event)
+            for subscription in targets:
+                try:
+                    subscription.queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # A client this far behind reconnects (EventSource does so
+                    # itself) rather than holding the broker back
+                    self.drop(subscription)
+
+    def drop(self, subscription: Subscription):
+        self.dropped += 1
+        self.unsubscribe(subscription)
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    async def stream(self, subscription: Subscription):
+        """SSE body for one client; unsubscribes when the client goes away"""
+        try:
+            yield b'retry: 3000\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b': keep-alive\n\n'
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+    async def relay_from_redis(self):
+        import redis.asyncio as aioredis
+
+        while True:
+            try:
+                async with aioredis.from_url(redis_url()) as client, client.pubsub() as pubsub:
+                    await pubsub.subscribe(CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.dispatch(json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("[LIVE] Redis relay failed, retrying: %s", e)
+                await asyncio.sleep(RELAY_RETRY)
+
+    # Publisher side, any thread or process
+
+    def publish(self, events: List[Dict[str, Any]]):
+        """Deliver events to subscribers; never raises into the caller"""
+        if not events:
+            return
+        try:
+            if redis_url():
+                self.publish_to_redis(events)
+            elif self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.dispatch, events)
+        except Exception as e:
+            logger.warning("[LIVE] Dropped %d events: %s", len(events), e)
+
+    def publish_to_redis(self, events: List[Dict[str, Any]]):
+        if self.redis is None:
+            import redis
+
+            self.redis = redis.Redis.from_url(redis_url())
+        self.redis.publish(CHANNEL, json.dumps(events, separators=(',', ':')))
+
+
+def redis_url() -> Optional[str]:
+    return getattr(settings, 'SYSMEX_LIVE_REDIS_URL', None)
+
+
+live_broker = LiveBroker()
+LIVE_SUBSCRIBERS.set_function(lambda: {(): live_broker.subscriber_count})
@@ -0,0 +1,97 @@
+import json
+import mmap
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.ingest import store_parsed_samples
+from core.parallel import RANGE_SIZE, map_in_order, message_ranges, parse_file_range, parse_pool
+
+CHECKPOINT_NAME = '.backfill-checkpoint.json'
+
+
+def load_checkpoint(path: Path):
+    try:
+        state = json.loads(path.read_text())
+        return state['file'], int(state['offset'])
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def save_checkpoint(path: Path, name: str, offset: int):
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    tmp.write_text(json.dumps({'file': name, 'offset': offset}) + '\n')
+    os.replace(tmp, path)
+
+
+class Command(BaseCommand):
+    help = 'Parse a directory of raw analyzer captures in parallel and store the samples'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', type=Path)
+        parser.add_argument('--pattern', default='**/*.txt',
+                            help='Glob of capture files under directory, processed in sorted order')
+        parser.add_argument('--workers', type=int, default=settings.SYSMEX_PARSE_WORKERS,
+                            help='Parser processes (default: one per core)')
+        parser.add_argument('--range-size', type=int, default=RANGE_SIZE,
+                            help='Bytes per work unit; ranges are cut at H record boundaries')
+        parser.add_argument('--checkpoint', type=Path,
+                            help=f"Resume file (default: DIRECTORY/{CHECKPOINT_NAME})")
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        directory = options['directory'].resolve()
+        if not directory.is_dir():
+            raise CommandError(f"{directory} is not a directory")
+        checkpoint = options['checkpoint'] or directory / CHECKPOINT_NAME
+
+        files = sorted(str(path.relative_to(directory)) for path in directory.glob(options['pattern'])
+                       if path.is_file() and path.stat().st_size)
+        resume = None if options['restart'] else load_checkpoint(checkpoint)
+        if resume:
+            # Everything sorting before the checkpointed file is done
+            files = [name for name in files if name >= resume[0]]
+            self.stdout.write(f"[BACKFILL] Resuming at {resume[0]} offset {resume[1]}")
+        self.stdout.write(f"[BACKFILL] {len(files)} capture files in {directory}")
+
+        totals = {'files': 0, 'bytes': 0, 'samples': 0, 'updated': 0, 'not_found': 0, 'failed': 0,
+                  'duplicate_samples': 0}
+
+        def work_units():
+            for name in files:
+                start = resume[1] if resume and name == resume[0] else 0
+                with open(directory / name, 'rb') as f, \
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    ranges = list(message_ranges(mm, options['range_size'], start))
+                for range_start, range_end in ranges:
+                    yield str(directory / name), range_start, range_end
+
+        with parse_pool(options['workers'], settings.SYSMEX_SPECIMEN_FORMATS,
+                        settings.SYSMEX_DEDUP) as pool:
+            for result in map_in_order(pool, parse_file_range, work_units()):
+                name = str(Path(result['name']).relative_to(directory))
+                if result['error']:
+                    totals['failed'] += 1
+                    self.stderr.write(f"[BACKFILL] {name} {result['start']}-{result['end']}: {result['error']}")
+                else:
+                    updated, not_found = store_parsed_samples(result['samples'], stats=totals)
+                    totals['samples'] += len(result['samples'])
+                    totals['updated'] += len(updated)
+                    totals['not_found'] += len(not_found)
+                totals['bytes'] += result['end'] - result['start']
+
+                # Ranges complete in order, so this is a safe restart point
+                save_checkpoint(checkpoint, name, result['end'])
+                if result['end'] == (directory / name).stat().st_size:
+                    totals['files'] += 1
+                self.stdout.write(
+                    f"[BACKFILL] {name} @ {result['end']}: {totals['samples']} samples, "
+                    f"{totals['updated']} updated, {totals['bytes'] / 1e6:.1f} MB "
+                    f"({result['seconds']:.2f}s parse)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"[BACKFILL] Done: {totals['files']} files, {totals['bytes'] / 1e6:.1f} MB, "
+            f"{totals['samples']} samples parsed, {totals['updated']} updated, "
+            f"{totals['not_found']} not found, {totals['duplicate_samples']} already stored, "
+            f"{totals['failed']} ranges failed"))
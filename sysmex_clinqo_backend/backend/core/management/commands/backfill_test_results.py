@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.ingest import build_test_results, replace_test_results
+from core.models import Sample
+
+class Command(BaseCommand):
+    help = 'Populate the TestResult table from existing Sample.test_details JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Samples loaded and written per transaction')
+        parser.add_argument('--start-after', type=int, default=0,
+                            help='Resume after this Sample primary key')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = options['start_after']
+        samples_done = 0
+        results_done = 0
+
+        # Keyset pagination over the primary key keeps every chunk an index range scan
+        while True:
+            chunk = list(
+                Sample.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'test_details')[:chunk_size]
+            )
+            if not chunk:
+                break
+
+            test_results = []
+            for sample in chunk:
+                test_results.extend(build_test_results(sample, sample.test_details))
+            with transaction.atomic():
+                replace_test_results(chunk, test_results)
+
+            last_pk = chunk[-1].pk
+            samples_done += len(chunk)
+            results_done += len(test_results)
+            self.stdout.write(f"[BACKFILL] {samples_done} samples, {results_done} results (last pk {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"[BACKFILL] Done: {samples_done} samples, {results_done} test results"))
@@ -1,30 +1,92 @@
-import socket
+import logging
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from core.parser import parse_sysmex_data_block
+from core.hostquery import HostQueryResponder
+from core.ingest import store_listener_batch
+from core.orders import PendingOrderSync, pending_orders
+from core.pipeline import BATCH_INTERVAL, BATCH_SIZE, MAX_QUEUE
+from core.recvbuf import READ_SIZE
+from core.server import HOST, PORT, IDLE_TIMEOUT, run_server
+from core.spool import COMMIT_INTERVAL, SEGMENT_SIZE, RawSpool
 
 class Command(BaseCommand):
     help = 'Start TCP listener to receive Sysmex data and store it by sample_id'
 
-    def handle(self, *args, **kwargs):
-        HOST = '0.0.0.0'
-        PORT = 6000
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=HOST)
+        parser.add_argument('--port', type=int, default=PORT)
+        parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                            help='Seconds of silence before a connection is closed (0 disables)')
+        parser.add_argument('--read-size', type=int, default=READ_SIZE,
+                            help='Bytes requested per socket read')
+        parser.add_argument('--spool-dir', default=settings.SYSMEX_SPOOL_DIR,
+                            help='Directory for the raw traffic write-ahead spool')
+        parser.add_argument('--no-spool', action='store_true',
+                            help='Do not spool raw traffic before acknowledging it')
+        parser.add_argument('--commit-interval', type=float, default=COMMIT_INTERVAL,
+                            help='Least seconds between spool fsyncs (0 syncs as soon as the last one is done)')
+        parser.add_argument('--segment-size', type=int, default=SEGMENT_SIZE,
+                            help='Spool segment size in bytes before rotating')
+        parser.add_argument('--max-queue', type=int, default=MAX_QUEUE,
+                            help='Sample groups queued for the DB writer before ACKs are delayed')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Samples per database write')
+        parser.add_argument('--batch-interval', type=float, default=BATCH_INTERVAL,
+                            help='Max seconds a sample waits for its batch to fill')
+        parser.add_argument('--metrics-port', type=int, default=settings.SYSMEX_LISTENER_METRICS_PORT,
+                            help='Serve Prometheus metrics over HTTP on this port (0 disables)')
+        parser.add_argument('--profile', action='store_true',
+                            help='Profile analyzer sessions, one at a time, into SYSMEX_PROFILE_DIR')
+        parser.add_argument('--no-host-query', action='store_true',
+                            help='Ignore analyzer host queries (Q records) instead of answering them')
+
+    def handle(self, *args, **options):
+        if options['verbosity'] >= 1:
+            # Connection events are logged at INFO, below the default core level
+            server_logger = logging.getLogger('core.server')
+            server_logger.setLevel(min(server_logger.getEffectiveLevel(), logging.INFO))
 
-        self.stdout.write(self.style.SUCCESS(f"[TCP] Listening on {PORT}..."))
+        spool = None
+        if not options['no_spool']:
+            spool = RawSpool(options['spool_dir'],
+                             segment_size=options['segment_size'],
+                             commit_interval=options['commit_interval'])
+            self.stdout.write(f"[SPOOL] Writing raw traffic to {spool.directory}")
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((HOST, PORT))
-            s.listen(1)
+        if settings.SYSMEX_LIVE_UPDATES and not settings.SYSMEX_LIVE_REDIS_URL:
+            self.stdout.write(self.style.WARNING(
+                "[LIVE] REDIS_URL is not set: results stored here will not reach live dashboards"))
 
-            conn, addr = s.accept()
-            self.stdout.write(self.style.SUCCESS(f"[TCP] Connected by {addr}"))
+        host_query = None
+        order_sync = None
+        if settings.SYSMEX_HOST_QUERY and not options['no_host_query']:
+            pending_orders.window_days = settings.SYSMEX_ORDER_WINDOW_DAYS
+            pending_orders.load()
+            order_sync = PendingOrderSync(pending_orders)
+            order_sync.start()
+            host_query = HostQueryResponder(pending_orders, tests=settings.SYSMEX_HOST_QUERY_TESTS,
+                                            host_name=settings.SYSMEX_HOST_NAME)
+            self.stdout.write(f"[ORDERS] Answering host queries from {len(pending_orders)} pending orders")
 
-            data_block = b''
-            with conn:
-                while True:
-                    data = conn.recv(1024)
-                    if not data:
-                        break
-                    data_block += data
+        self.stdout.write(self.style.SUCCESS(f"[TCP] Listening on {options['port']}..."))
 
-            parse_sysmex_data_block(data_block)
-            self.stdout.write(self.style.SUCCESS(f"[TCP] Finished parsing Sysmex data."))
+        # Serves any number of analyzers until SIGINT/SIGTERM
+        run_server(
+            store_listener_batch,
+            host=options['host'],
+            port=options['port'],
+            idle_timeout=options['idle_timeout'] or None,
+            read_size=options['read_size'],
+            spool=spool,
+            max_queue=options['max_queue'],
+            batch_size=options['batch_size'],
+            batch_interval=options['batch_interval'],
+            metrics_port=options['metrics_port'] or None,
+            profile_dir=settings.SYSMEX_PROFILE_DIR if options['profile'] else None,
+            profile_keep=settings.SYSMEX_PROFILE_KEEP,
+            host_query=host_query,
+        )
+        if order_sync:
+            order_sync.stop()
+        self.stdout.write(self.style.SUCCESS("[TCP] Listener stopped."))
@@ -0,0 +1,269 @@
+"""
+Prometheus metrics for the ingest and API hot paths, without a client library
+
+Counters and histograms are updated in place under a per-metric lock (a
+dict lookup and an addition). State owned elsewhere (ingest queue depth,
+open analyzer connections, dedup and trace counters) is exposed through
+callbacks that only run when the metrics are scraped. registry.render()
+produces the Prometheus text format served at /api/metrics/ and, for the
+listener, on --metrics-port.
+
+Every process has its own registry, so the web server and the listener
+are scraped separately (as is each worker when running several).
+"""
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .dedup import deduplicator
+from .trace import tracer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+PARSE_BUCKETS = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1)
+
+Labels = Tuple[str, ...]
+
+
+def format_labels(names: Sequence[str], values: Labels, extra: str = '') -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, 'Metric'] = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: 'Metric'):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # A failing callback must not take the whole scrape down
+                logger.warning("Metric %s failed to render: %s", metric.name, e)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = registry):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}',
+                *self.samples()]
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A monotonically increasing value per label set"""
+
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Labels, float] = {}
+        self.function: Optional[Callable[[], Dict[Labels, float]]] = None
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set_function(self, function: Optional[Callable[[], Dict[Labels, float]]]):
+        """Read values from function at scrape time instead ({labels: value})"""
+        self.function = function
+
+    def get(self, *labels: str) -> float:
+        return self.current().get(labels, 0)
+
+    def current(self) -> Dict[Labels, float]:
+        if self.function is not None:
+            return self.function()
+        with self.lock:
+            return dict(self.values)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.current().items()):
+            yield f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+
+
+class Gauge(Counter):
+    """A value that goes up and down, usually read through set_function"""
+
+    type = 'gauge'
+
+    def set(self, *labels: str, value: float):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, per label set"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(name, documentation, labelnames, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        with self.lock:
+            state = self.values.get(labels)
+            return sum(state[0]) if state else 0
+
+    def samples(self) -> Iterable[str]:
+        with self.lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self.values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = format_labels(self.labelnames, labels, f'le="{format_value(bound)}"')
+                yield f'{self.name}_bucket{le} {cumulative}'
+            label_text = format_labels(self.labelnames, labels)
+            yield f'{self.name}_sum{label_text} {format_value(total)}'
+            yield f'{self.name}_count{label_text} {cumulative}'
+
+
+# Parser
+MESSAGES_PARSED = Counter('sysmex_messages_parsed_total', 'ASTM messages parsed, by analyzer series',
+                          ['analyzer'])
+RECORDS_PARSED = Counter('sysmex_records_parsed_total', 'ASTM records parsed')
+SAMPLES_PARSED = Counter('sysmex_samples_parsed_total', 'Samples completed by the parser')
+PARSE_SECONDS = Histogram('sysmex_parse_message_seconds', 'Parse time per ASTM message',
+                          buckets=PARSE_BUCKETS)
+
+# Database writes (store_parsed_samples)
+SAMPLES_WRITTEN = Counter('sysmex_samples_written_total', 'Samples whose results were stored')
+SAMPLES_UNMATCHED = Counter('sysmex_samples_unmatched_total',
+                            'Parsed sample IDs with no registered Sample')
+DUPLICATE_SAMPLES = Counter('sysmex_duplicate_samples_total',
+                            'Samples skipped because their message was already stored')
+DB_LOOKUP_SECONDS = Histogram('sysmex_db_lookup_seconds', 'Sample lookup time per ingest batch')
+DB_WRITE_SECONDS = Histogram('sysmex_db_write_seconds', 'Database write time per ingest batch')
+
+# HTTP API (core.middleware.MetricsMiddleware)
+REQUEST_SECONDS = Histogram('sysmex_http_request_seconds', 'API request latency by view',
+                            ['view', 'method', 'status'])
+
+# Listener (set up by AnalyzerServer)
+ANALYZER_CONNECTIONS = Gauge('sysmex_analyzer_connections', 'Open analyzer connections by series',
+                             ['analyzer'])
+INGEST_QUEUE_DEPTH = Gauge('sysmex_ingest_queue_depth', 'Sample groups waiting for the DB writer')
+INGEST_QUEUE_CAPACITY = Gauge('sysmex_ingest_queue_capacity', 'Sample groups the ingest queue holds')
+INGEST_BATCHES = Counter('sysmex_ingest_batches_total', 'Listener write batches by outcome',
+                         ['outcome'])
+
+# Host queries (core/hostquery.py, core/orders.py)
+HOST_QUERIES = Counter('sysmex_host_queries_total', 'Queried specimens by whether an order was found',
+                       ['result'])
+PENDING_ORDERS = Gauge('sysmex_pending_orders', 'Pending orders held in the host query index')
+
+# Read from the deduplicator, tracer and live broker when scraped
+DEDUP_LOOKUPS = Counter('sysmex_dedup_lookups_total', 'Message fingerprint lookups by layer and result',
+                        ['layer', 'result'])
+DEDUP_LRU_SIZE = Gauge('sysmex_dedup_lru_size', 'Fingerprints held in the in-memory LRU')
+TRACE_EVENTS = Counter('sysmex_trace_events_total', 'Trace events recorded while tracing is on',
+                       ['event'])
+LIVE_SUBSCRIBERS = Gauge('sysmex_live_subscribers', 'Open live result streams')
+
+DEDUP_COUNTERS = {
+    'lru_hits': ('lru', 'hit'),
+    'lru_misses': ('lru', 'miss'),
+    'store_hits': ('store', 'hit'),
+    'store_misses': ('store', 'miss'),
+}
+
+
+def dedup_lookups() -> Dict[Labels, float]:
+    counters = deduplicator.snapshot()
+    return {labels: counters.get(name, 0) for name, labels in DEDUP_COUNTERS.items()}
+
+
+DEDUP_LOOKUPS.set_function(dedup_lookups)
+DEDUP_LRU_SIZE.set_function(lambda: {(): deduplicator.snapshot()['lru_size']})
+TRACE_EVENTS.set_function(lambda: {(name,): count for name, count in tracer.snapshot().items()})
+
+
+async def serve_metrics(host: str, port: int, registry: Registry = registry) -> asyncio.AbstractServer:
+    """A minimal HTTP endpoint for registry, for processes without Django's server"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            parts = request.split(b' ', 2)
+            path = parts[1].split(b'?')[0] if len(parts) > 2 else b''
+            if path in (b'/', b'/metrics'):
+                status, body = '200 OK', registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port, reuse_address=True)
@@ -0,0 +1,44 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import REQUEST_SECONDS
+
+
+class MetricsMiddleware:
+    """
+    Request latency per view into sysmex_http_request_seconds
+
+    Views are labelled by URL name, so the label set stays bounded however
+    many patient IDs are requested. Works under WSGI and ASGI without
+    forcing async views (the live stream) onto a thread. For streaming
+    responses the time is to the first byte, not the end of the stream.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    def observe(self, request, response, started: float):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, view, request.method,
+                                str(response.status_code))
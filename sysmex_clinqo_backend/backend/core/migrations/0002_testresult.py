@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-17 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('analyte', models.CharField(max_length=50)),
+                ('value', models.FloatField(blank=True, null=True)),
+                ('raw_value', models.CharField(blank=True, max_length=255)),
+                ('unit', models.CharField(blank=True, max_length=30)),
+                ('flag', models.CharField(blank=True, max_length=10)),
+                ('measured_at', models.DateTimeField(blank=True, null=True)),
+                ('sample', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='core.sample')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['analyte', 'measured_at'], name='testresult_analyte_time_idx')],
+                'constraints': [models.UniqueConstraint(fields=('sample', 'analyte'), name='testresult_sample_analyte_uniq')],
+            },
+        ),
+    ]
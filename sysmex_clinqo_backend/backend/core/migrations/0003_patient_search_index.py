@@ -0,0 +1,72 @@
+# Generated by Django 5.2.4 on 2026-10-17 10:03
+
+from django.db import migrations
+
+POSTGRESQL_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # UPPER() matches the SQL Django generates for icontains
+    "CREATE INDEX IF NOT EXISTS core_patient_name_trgm ON core_patient USING gin (UPPER(name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS core_patient_patient_id_trgm ON core_patient USING gin (UPPER(patient_id) gin_trgm_ops)",
+]
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX IF EXISTS core_patient_patient_id_trgm",
+    "DROP INDEX IF EXISTS core_patient_name_trgm",
+]
+
+# External-content FTS5 table kept in sync with core_patient by triggers.
+# The trigram tokenizer (SQLite >= 3.34) makes quoted phrases match substrings.
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS core_patient_fts USING fts5(
+        name, patient_id, content='core_patient', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS core_patient_fts_ai AFTER INSERT ON core_patient BEGIN
+        INSERT INTO core_patient_fts(rowid, name, patient_id) VALUES (new.id, new.name, new.patient_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS core_patient_fts_ad AFTER DELETE ON core_patient BEGIN
+        INSERT INTO core_patient_fts(core_patient_fts, rowid, name, patient_id)
+        VALUES ('delete', old.id, old.name, old.patient_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS core_patient_fts_au AFTER UPDATE OF name, patient_id ON core_patient BEGIN
+        INSERT INTO core_patient_fts(core_patient_fts, rowid, name, patient_id)
+        VALUES ('delete', old.id, old.name, old.patient_id);
+        INSERT INTO core_patient_fts(rowid, name, patient_id) VALUES (new.id, new.name, new.patient_id);
+    END""",
+    "INSERT INTO core_patient_fts(core_patient_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS core_patient_fts_au",
+    "DROP TRIGGER IF EXISTS core_patient_fts_ad",
+    "DROP TRIGGER IF EXISTS core_patient_fts_ai",
+    "DROP TABLE IF EXISTS core_patient_fts",
+]
+
+
+def sqlite_has_trigram_tokenizer():
+    import sqlite3
+    return sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def run_statements(statements_by_vendor):
+    def run(apps, schema_editor):
+        connection = schema_editor.connection
+        statements = statements_by_vendor.get(connection.vendor, [])
+        if connection.vendor == 'sqlite' and not sqlite_has_trigram_tokenizer():
+            # core.search falls back to a LIKE scan without the FTS table
+            statements = []
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_testresult'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'postgresql': POSTGRESQL_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run_statements({'postgresql': POSTGRESQL_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
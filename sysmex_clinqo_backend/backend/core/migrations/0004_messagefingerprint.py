@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-17 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_patient_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageFingerprint',
+            fields=[
+                ('digest', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
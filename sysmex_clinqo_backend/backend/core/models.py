@@ -23,3 +23,33 @@ class Sample(models.Model):
 
     def __str__(self):
         return f"Sample {self.sample_id} for {self.patient.name}"
+
+class TestResult(models.Model):
+    """One analyte of a sample, normalized out of Sample.test_details for querying"""
+    sample = models.ForeignKey(Sample, on_delete=models.CASCADE, related_name='results')
+    analyte = models.CharField(max_length=50)
+    value = models.FloatField(null=True, blank=True)
+    raw_value = models.CharField(max_length=255, blank=True)
+    unit = models.CharField(max_length=30, blank=True)
+    flag = models.CharField(max_length=10, blank=True)
+    measured_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sample', 'analyte'], name='testresult_sample_analyte_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['analyte', 'measured_at'], name='testresult_analyte_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.analyte}={self.raw_value} for sample {self.sample_id}"
+
+
+class MessageFingerprint(models.Model):
+    """Content hash of an ASTM message whose samples were stored (see core/dedup.py)"""
+    digest = models.CharField(max_length=32, primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.digest
@@ -0,0 +1,171 @@
+"""
+In-memory index of pending orders, for answering host queries
+
+A registered Sample whose test_details are still empty is an order waiting
+for its results. The listener keeps those of the last window_days in a
+dict keyed by sample_id, so answering an analyzer's Q record is a dict
+lookup on the event loop instead of a database round trip.
+
+The index is kept in sync incrementally: store_parsed_samples drops
+samples as their results are written (on commit), and a PendingOrderSync
+thread picks up newly registered samples, which are usually created by
+another process (the API), with one indexed id > high_water query every
+sync interval. A periodic full reload reconciles whatever incremental
+sync cannot see: deleted samples, results uploaded through the API and
+rows committed out of id order.
+
+Both queries run outside the index lock, so a sample whose results are
+stored meanwhile could be read as pending after its discard. Discards made
+while a query runs are recorded and applied to its result.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Set
+
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .metrics import PENDING_ORDERS
+from .models import Sample
+
+logger = logging.getLogger(__name__)
+
+WINDOW_DAYS = 7  # older samples without results are not offered to analyzers
+SYNC_INTERVAL = 2.0  # seconds between catch-up queries for new samples
+RECONCILE_INTERVAL = 300.0  # seconds between full reloads
+
+ORDER_FIELDS = ('id', 'sample_id', 'patient__patient_id', 'patient__name', 'patient__sex')
+
+
+class PendingOrder:
+    __slots__ = ('sample_id', 'patient_id', 'patient_name', 'sex')
+
+    def __init__(self, sample_id: str, patient_id: str, patient_name: str = '', sex: str = ''):
+        self.sample_id = sample_id
+        self.patient_id = patient_id
+        self.patient_name = patient_name
+        self.sex = sex
+
+
+class PendingOrderIndex:
+    """sample_id -> PendingOrder; reads take no lock, writers share one"""
+
+    def __init__(self, window_days: float = WINDOW_DAYS):
+        self.window_days = window_days
+        self.orders: Dict[str, PendingOrder] = {}
+        self.lock = threading.Lock()
+        self.high_water = 0  # highest Sample id seen by load() / catch_up()
+        self.loaded = False
+        # id(set) -> set per query in flight, collecting the discards made meanwhile
+        self.discards_during_query: Dict[int, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def get(self, sample_id: str) -> Optional[PendingOrder]:
+        return self.orders.get(sample_id)
+
+    def pending_samples(self):
+        since = timezone.now() - timedelta(days=self.window_days)
+        return Sample.objects.filter(test_details={}, created_at__gte=since).values_list(*ORDER_FIELDS)
+
+    def load(self):
+        """(Re)build the index from the database"""
+        discarded = self._track_discards()
+        try:
+            high_water = Sample.objects.aggregate(top=Max('id'))['top'] or 0
+            orders = {row[1]: PendingOrder(*row[1:]) for row in self.pending_samples()}
+        except BaseException:
+            self._untrack_discards(discarded)
+            raise
+        with self.lock:
+            del self.discards_during_query[id(discarded)]
+            for sample_id in discarded:
+                orders.pop(sample_id, None)
+            self.orders = orders
+            self.high_water = max(self.high_water, high_water)
+            self.loaded = True
+
+    def catch_up(self) -> int:
+        """Add samples registered since the last load / catch-up; returns how many"""
+        discarded = self._track_discards()
+        try:
+            rows = list(self.pending_samples().filter(id__gt=self.high_water).order_by('id'))
+        except BaseException:
+            self._untrack_discards(discarded)
+            raise
+        with self.lock:
+            del self.discards_during_query[id(discarded)]
+            for row in rows:
+                if row[1] not in discarded:
+                    self.orders[row[1]] = PendingOrder(*row[1:])
+            if rows:
+                self.high_water = max(self.high_water, rows[-1][0])
+        return len(rows)
+
+    def _track_discards(self) -> Set[str]:
+        discarded = set()
+        with self.lock:
+            self.discards_during_query[id(discarded)] = discarded
+        return discarded
+
+    def _untrack_discards(self, discarded: Set[str]):
+        with self.lock:
+            del self.discards_during_query[id(discarded)]
+
+    def discard(self, sample_ids: Iterable[str]):
+        with self.lock:
+            for sample_id in sample_ids:
+                self.orders.pop(sample_id, None)
+                for discarded in self.discards_during_query.values():
+                    discarded.add(sample_id)
+
+    def results_stored(self, sample_ids: Iterable[str]):
+        """Drop samples once the current transaction commits (no-op unless loaded)"""
+        if self.loaded:
+            sample_ids = list(sample_ids)
+            if sample_ids:
+                transaction.on_commit(lambda: self.discard(sample_ids))
+
+
+pending_orders = PendingOrderIndex()
+PENDING_ORDERS.set_function(lambda: {(): len(pending_orders)})
+
+
+class PendingOrderSync:
+    """Background thread running index.catch_up(), and a full load() every reconcile_interval"""
+
+    def __init__(self, index: PendingOrderIndex = pending_orders, interval: float = SYNC_INTERVAL,
+                 reconcile_interval: float = RECONCILE_INTERVAL):
+        self.index = index
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='order-sync', daemon=True)
+        self.failures = 0
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def _run(self):
+        next_reconcile = time.monotonic() + self.reconcile_interval
+        while not self.stopping.wait(self.interval):
+            try:
+                if time.monotonic() >= next_reconcile:
+                    self.index.load()
+                    next_reconcile = time.monotonic() + self.reconcile_interval
+                else:
+                    self.index.catch_up()
+            except DatabaseError as e:
+                # Answers keep coming from the last good state meanwhile
+                self.failures += 1
+                logger.warning("Pending order sync failed: %s", e)
+            finally:
+                close_old_connections()
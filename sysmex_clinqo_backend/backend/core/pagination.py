@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PatientCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the patient primary key.
+
+    Each page is a single indexed range scan (WHERE id < cursor ORDER BY id
+    DESC LIMIT n), so the cost of a page does not grow with table size or
+    with how deep the client has paged, unlike OFFSET pagination.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-id'
@@ -0,0 +1,128 @@
+"""
+Parsing across worker processes
+
+Parsing is pure CPU work in Python, so batch uploads and backfills fan
+it out to a process pool. This module stays free of Django: workers are
+spawned (not forked from a threaded server) and only import the parser.
+"""
+import mmap
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, Optional, Tuple
+
+from .parser import SysmexStreamParser, parse_sysmex_file
+from .dedup import deduplicator
+from .specimen import configure_matchers
+
+
+def parse_export(name: str, data: bytes) -> Dict[str, Any]:
+    """Parse one export in a worker; errors are reported, not raised"""
+    started = time.perf_counter()
+    try:
+        samples = parse_sysmex_file().parse_data(data)
+        error = None
+    except Exception as e:
+        samples, error = [], f"{type(e).__name__}: {e}"
+    return {
+        'name': name,
+        'bytes': len(data),
+        'samples': samples,
+        'seconds': time.perf_counter() - started,
+        'error': error,
+    }
+
+
+# Start of an H record: after a record separator, optionally inside a
+# logged b'...' line
+MESSAGE_START = re.compile(rb"[\r\n](?:b')?H\|")
+RANGE_SIZE = 8 * 1024 * 1024
+
+
+def parse_file_range(path: str, start: int, end: int) -> Dict[str, Any]:
+    """Parse bytes [start, end) of a capture file in a worker"""
+    started = time.perf_counter()
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            stream = SysmexStreamParser()
+            samples = stream.feed(mm[start:end])
+            samples.extend(stream.close())
+        error = None
+    except Exception as e:
+        samples, error = [], f"{type(e).__name__}: {e}"
+    return {
+        'name': path,
+        'start': start,
+        'end': end,
+        'samples': samples,
+        'seconds': time.perf_counter() - started,
+        'error': error,
+    }
+
+
+def message_ranges(mm, range_size: int = RANGE_SIZE, start: int = 0) -> Iterator[Tuple[int, int]]:
+    """
+    Split a mapped capture into byte ranges of roughly range_size
+
+    Every range but the first starts at an H record, so each one parses
+    on its own. The boundaries are found with a regex search over the
+    mapping; nothing is decoded and only the pages searched are read.
+    """
+    size = len(mm)
+    while start < size:
+        end = size
+        if start + range_size < size:
+            found = MESSAGE_START.search(mm, start + range_size)
+            if found:
+                end = found.start() + 1
+        yield start, end
+        start = end
+
+
+def _init_worker(specimen_formats: Dict[str, dict], dedup: bool):
+    configure_matchers(specimen_formats)
+    deduplicator.configure(enabled=dedup)
+
+
+def parse_pool(workers: Optional[int] = None, specimen_formats: Optional[Dict[str, dict]] = None,
+               dedup: bool = True) -> ProcessPoolExecutor:
+    """
+    A spawn-based parser pool
+
+    Workers use the given per-analyzer specimen formats and, with dedup,
+    fingerprint each message so already stored ones are skipped on write.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(specimen_formats or {}, dedup),
+    )
+
+
+def parse_in_pool(pool: ProcessPoolExecutor, exports: Iterable[Tuple[str, bytes]],
+                  in_flight: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Parse (name, data) exports across pool, yielding results in input order
+
+    At most in_flight exports (twice the core count by default) are handed
+    to the workers at a time, so a large archive is never held in memory
+    all at once.
+    """
+    yield from map_in_order(pool, parse_export, exports, in_flight)
+
+
+def map_in_order(pool: ProcessPoolExecutor, func: Callable, arguments: Iterable[Tuple],
+                 in_flight: Optional[int] = None) -> Iterator[Any]:
+    """pool.map with bounded look-ahead: arguments are consumed lazily"""
+    in_flight = in_flight or 2 * (os.cpu_count() or 1)
+    pending: Deque[Future] = deque()
+    for args in arguments:
+        pending.append(pool.submit(func, *args))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
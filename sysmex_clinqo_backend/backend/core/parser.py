@@ -1,84 +1,106 @@
 import re
-import json
-from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple
+import logging
+import time
+from typing import List, Optional, Any, Tuple, Iterable, Iterator
+
+from .dedup import MessageDeduplicator, deduplicator, message_digest
+from .metrics import MESSAGES_PARSED, PARSE_SECONDS, RECORDS_PARSED, SAMPLES_PARSED
+from .records import (HeaderRecord, OrderRecord, ParsedSample, PatientRecord, QueryRecord, ResultRecord,
+                      analyzer_label)
+from .recvbuf import ReceiveBuffer
+from .specimen import SpecimenIdMatcher, default_matcher, first_specimen_id, matcher_for
+from .trace import tracer
+
+logger = logging.getLogger(__name__)
 
 class parse_sysmex_file:
     """
     Parser for Sysmex LIS data following ASTM E1394-97 standard
     """
     
-    def __init__(self):
+    def __init__(self, matcher: Optional[SpecimenIdMatcher] = None,
+                 dedup: Optional[MessageDeduplicator] = deduplicator,
+                 collect_queries: bool = False):
+        # A fixed matcher, or None to pick one per analyzer from each H record
+        self.fixed_matcher = matcher
+        self.matcher = matcher or default_matcher
+        # Skips messages already stored; None (or a disabled one) parses everything
+        self.dedup = dedup if dedup is not None and dedup.enabled else None
+        self.duplicates_skipped = 0
+        # Q records are kept (in parsed_queries) only for a host query responder
+        self.collect_queries = collect_queries
+        self.parsed_queries: List[QueryRecord] = []
         self.reset_state()
         self.parsed_samples = []
         
     def reset_state(self):
         """Reset all state variables"""
         self.current_message_id = None
-        self.current_patient_info = {}
+        self.current_patient_info = None
         self.current_sample_id = None
-        self.current_sample_info = {}
+        self.current_sample_info = None
         self.current_test_results = {}
         self.current_sequence = None
+        self.current_digest = None
+        self.message_records = 0
         
-    def parse_header_record(self, line: str) -> Dict[str, Any]:
+    def parse_header_record(self, line: str) -> HeaderRecord:
         """Parse H (Header) record - contains system information"""
         parts = line.split('|')
-        header_info = {
-            'record_type': 'H',
-            'sender_name': parts[4] if len(parts) > 4 else '',
-            'sender_id': parts[5] if len(parts) > 5 else '',
-            'receiver_id': parts[6] if len(parts) > 6 else '',
-            'processing_id': parts[11] if len(parts) > 11 else '',
-            'version': parts[13] if len(parts) > 13 else '',
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        # Print extracted header data
-        print("=" * 60)
-        print("📋 HEADER RECORD EXTRACTED:")
-        print("=" * 60)
-        print(f"   Record Type: {header_info['record_type']}")
-        print(f"   Sender Name: {header_info['sender_name']}")
-        print(f"   Sender ID: {header_info['sender_id']}")
-        print(f"   Receiver ID: {header_info['receiver_id']}")
-        print(f"   Processing ID: {header_info['processing_id']}")
-        print(f"   Version: {header_info['version']}")
-        print(f"   Timestamp: {header_info['timestamp']}")
-        print("=" * 60)
+        header_info = HeaderRecord(
+            sender_name=parts[4] if len(parts) > 4 else '',
+            sender_id=parts[5] if len(parts) > 5 else '',
+            receiver_id=parts[6] if len(parts) > 6 else '',
+            processing_id=parts[11] if len(parts) > 11 else '',
+            version=parts[13] if len(parts) > 13 else '',
+        )
+        
+        if self.fixed_matcher is None:
+            self.matcher = matcher_for(header_info.sender_name)
+        
+        if tracer.enabled:
+            tracer.event('astm.header', **header_info.to_dict())
         
         return header_info
     
-    def parse_patient_record(self, line: str) -> Dict[str, Any]:
+    def parse_patient_record(self, line: str) -> PatientRecord:
         """Parse P (Patient) record - contains patient information"""
         parts = line.split('|')
-        patient_info = {
-            'record_type': 'P',
-            'practice_id': parts[1] if len(parts) > 1 else '',
-            'patient_id': parts[2] if len(parts) > 2 else '',
-            'patient_name': parts[5] if len(parts) > 5 else '',
-            'birth_date': parts[7] if len(parts) > 7 else '',
-            'sex': parts[8] if len(parts) > 8 else '',
-        }
-        
-        # Print extracted patient data
-        print("👤 PATIENT RECORD EXTRACTED:")
-        print("-" * 40)
-        print(f"   Record Type: {patient_info['record_type']}")
-        print(f"   Practice ID: {patient_info['practice_id']}")
-        print(f"   Patient ID: {patient_info['patient_id']}")
-        print(f"   Patient Name: {patient_info['patient_name']}")
-        print(f"   Birth Date: {patient_info['birth_date']}")
-        print(f"   Sex: {patient_info['sex']}")
-        print("-" * 40)
+        patient_info = PatientRecord(
+            practice_id=parts[1] if len(parts) > 1 else '',
+            patient_id=parts[2] if len(parts) > 2 else '',
+            patient_name=parts[5] if len(parts) > 5 else '',
+            birth_date=parts[7] if len(parts) > 7 else '',
+            sex=parts[8] if len(parts) > 8 else '',
+        )
+        
+        if tracer.enabled:
+            tracer.event('astm.patient', **patient_info.to_dict())
         
         return patient_info
     
-    def parse_order_record(self, line: str) -> Tuple[Optional[str], Dict[str, Any]]:
+    def parse_query_record(self, line: str) -> List[QueryRecord]:
+        """Parse Q (Request Information) record - one entry per requested specimen"""
+        parts = line.split('|')
+        status = parts[12].strip() if len(parts) > 12 else ''
+        queries = []
+        # Starting range ID field, with one repeat per specimen
+        for specimen_field in (parts[2] if len(parts) > 2 else '').split('\\'):
+            specimen_field = specimen_field.strip()
+            if specimen_field:
+                queries.append(QueryRecord(self.extract_sample_id_from_field(specimen_field),
+                                           specimen_field, status))
+        
+        if tracer.enabled:
+            tracer.event('astm.query', specimens=[query.to_dict() for query in queries])
+        
+        return queries
+    
+    def parse_order_record(self, line: str) -> Tuple[Optional[str], Optional[OrderRecord]]:
         """Parse O (Order) record - contains sample/specimen information"""
         parts = line.split('|')
         if len(parts) < 3:
-            return None, {}
+            return None, None
     
         # Try to extract sample ID from specimen ID field (index 2)
         specimen_field = parts[2].strip() if len(parts) > 2 else ''
@@ -88,108 +110,42 @@ class parse_sysmex_file:
         if not sample_id and len(parts) > 3:
             instrument_field = parts[3].strip()
             sample_id = self.extract_sample_id_from_field(instrument_field)
-            if sample_id:
-                print(f"🔍 Extracted sample ID from instrument field: {sample_id}")
+            if sample_id and tracer.enabled:
+                tracer.event('astm.sample_id_from_instrument_field', sample_id=sample_id)
     
         # If still not found, log a warning
         if not sample_id:
-            print(f"⚠️ Could not extract sample ID from order record: {line[:50]}")
+            logger.warning("Could not extract sample ID from order record: %s", line[:50])
     
-        sample_info = {
-            'record_type': 'O',
-            'sample_id': sample_id,
-            'specimen_field': specimen_field,
-            'test_ordered': parts[4] if len(parts) > 4 else '',
-            'priority': parts[5] if len(parts) > 5 else '',
-            'collection_date': parts[6] if len(parts) > 6 else '',
-            'collection_time': parts[7] if len(parts) > 7 else '',
-            'volume': parts[9] if len(parts) > 9 else '',
-            'collector_id': parts[10] if len(parts) > 10 else '',
-        }
+        sample_info = OrderRecord(
+            sample_id=sample_id,
+            specimen_field=specimen_field,
+            test_ordered=parts[4] if len(parts) > 4 else '',
+            priority=parts[5] if len(parts) > 5 else '',
+            collection_date=parts[6] if len(parts) > 6 else '',
+            collection_time=parts[7] if len(parts) > 7 else '',
+            volume=parts[9] if len(parts) > 9 else '',
+            collector_id=parts[10] if len(parts) > 10 else '',
+        )
     
-        # Print extracted order/sample data
-        print("🧪 ORDER/SAMPLE RECORD EXTRACTED:")
-        print("-" * 40)
-        print(f"   Record Type: {sample_info['record_type']}")
-        print(f"   Sample ID: {sample_info['sample_id']}")
-        print(f"   Specimen Field: {sample_info['specimen_field']}")
-        print(f"   Test Ordered: {sample_info['test_ordered']}")
-        print(f"   Priority: {sample_info['priority']}")
-        print(f"   Collection Date: {sample_info['collection_date']}")
-        print(f"   Collection Time: {sample_info['collection_time']}")
-        print(f"   Volume: {sample_info['volume']}")
-        print(f"   Collector ID: {sample_info['collector_id']}")
-        print("-" * 40)
+        if tracer.enabled:
+            tracer.event('astm.order', **sample_info.to_dict())
     
         return sample_id, sample_info
     
     def extract_sample_id_from_field(self, field: str) -> Optional[str]:
-        """Enhanced sample ID extraction from specimen field"""
-        if not field:
-            return None
-            
-        print(f"🔍 Extracting sample ID from field: '{field}'")
-        print(f"🔍 Field length: {len(field)}")
-        print(f"🔍 Field repr: {repr(field)}")
-        
-        # Strategy 1: Direct number (e.g., "3616340")
-        if field.isdigit():
-            print(f"✅ Strategy 1 - Direct number: {field}")
-            return field
-        
-        # Strategy 2: Caret-separated values with flexible whitespace
-        # Handle formats like: "7^10^               3615525^B" or "7^10^3615525^B"
-        if '^' in field:
-            caret_parts = field.split('^')
-            print(f"🔍 Caret parts count: {len(caret_parts)}")
-            print(f"🔍 Caret parts: {caret_parts}")
-            
-            for i, part in enumerate(caret_parts):
-                cleaned = part.strip()
-                print(f"   Part {i}: '{part}' (len={len(part)}) -> cleaned: '{cleaned}' (len={len(cleaned)})")
-                
-                # Skip empty parts and single character flags
-                if not cleaned or len(cleaned) <= 1:
-                    print(f"   -> Skipping part {i} (empty or single char)")
-                    continue
-                    
-                # Check if it's a valid sample ID (6+ digits)
-                if cleaned.isdigit() and len(cleaned) >= 6:
-                    print(f"✅ Strategy 2 - Caret-separated: {cleaned}")
-                    return cleaned
-                elif cleaned.isdigit():
-                    print(f"   -> Part {i} is numeric but too short: '{cleaned}' (len={len(cleaned)})")
-                else:
-                    print(f"   -> Part {i} is not numeric: '{cleaned}'")
-        
-        # Strategy 3: Regex patterns for various formats
-        patterns = [
-            # Pattern for the specific format: "7^10^               3615525^B"
-            r'^7\^10\^\s*(\d{6,})\^B',
-            # Pattern for spaces followed by digits and ^B (most specific first)
-            r'\^\d+\^\s*(\d{6,})\^[A-Z]',
-            # Pattern for any sequence of 6+ digits
-            r'(\d{6,})',
-            # Pattern for whitespace followed by digits
-            r'\s+(\d{6,})',
-            # Pattern for caret followed by digits
-            r'\^(\d{6,})',
-        ]
-
-        for i, pattern in enumerate(patterns):
-            print(f"🔍 Trying pattern {i+1}: '{pattern}'")
-            match = re.search(pattern, field)
-            if match:
-                extracted_id = match.group(1)
-                print(f"✅ Strategy 3.{i+1} - Regex pattern '{pattern}': {extracted_id}")
-                return extracted_id
+        """Sample ID from a specimen field, using the current analyzer's matcher"""
+        found = self.matcher.match(field)
+        
+        if tracer.enabled:
+            if found:
+                tracer.event('specimen.extracted', field=field, strategy=found[1], sample_id=found[0])
             else:
-                print(f"   -> Pattern {i+1} no match")
+                tracer.event('specimen.not_found', field=field)
         
-        print(f"⚠️ Could not extract sample ID from field: '{field}'")
-        return None
+        return found[0] if found else None
     
-    def parse_result_record(self, line: str) -> Optional[Dict[str, Any]]:
+    def parse_result_record(self, line: str) -> Optional[ResultRecord]:
         """Parse R (Result) record - contains test results"""
         parts = line.split('|')
         if len(parts) < 4:
@@ -214,57 +170,23 @@ class parse_sysmex_file:
         else:
             value = self.process_value(value_field)
         
-        result = {
-            'test_name': test_name,
-            'value': value,
-            'unit': unit,
-            'status': status,
-            'timestamp': timestamp
-        }
-        
-        # Print extracted result data
-        print(f"   🔬 RESULT EXTRACTED:")
-        print(f"       Test Name: {result['test_name']}")
-        print(f"       Value: {result['value']}")
-        print(f"       Unit: {result['unit']}")
-        print(f"       Status: {result['status']}")
-        print(f"       Timestamp: {result['timestamp']}")
-        print("       " + "-" * 30)
+        result = ResultRecord(test_name, value, unit, status, timestamp)
+        
+        if tracer.enabled:
+            tracer.event('astm.result', **result.to_dict())
         
         return result
     
     def extract_sample_id_from_results(self, lines: List[str]) -> Optional[str]:
-        """Extract sample ID from R or O records with improved patterns"""
-        
-        # 1. Check PNG filenames in R records
-        for line in lines:
-            if line.startswith('R|') and '.PNG' in line.upper():
-                # Match "2025_07_10_15_49_3616340_WDF.PNG"
-                match = re.search(r'_(\d{7})_[A-Z_]+\.PNG', line, re.IGNORECASE)
-                if match:
-                    extracted_id = match.group(1)
-                    print(f"🔍 SAMPLE ID EXTRACTED FROM PNG: {extracted_id}")
-                    return extracted_id
-        
-        # 2. Check sample ID in O records with flexible patterns
-        for line in lines:
-            if line.startswith('O|'):
-                parts = line.split('|')
-                if len(parts) > 2:
-                    specimen_field = parts[2].strip() if len(parts) > 2 else ''
-                    sample_id = self.extract_sample_id_from_field(specimen_field)
-                    if not sample_id and len(parts) > 3:
-                        instrument_field = parts[3].strip()
-                        sample_id = self.extract_sample_id_from_field(instrument_field)
-                        if sample_id:
-                            print(f"🔍 Extracted sample ID from instrument field: {sample_id}")
-                    if sample_id:
-                        print(f"🔍 SAMPLE ID EXTRACTED FROM O RECORD: {sample_id}")
-                        return sample_id
-        
-        # 3. Could not extract sample ID
-        print("⚠️ Could not extract sample ID from lines.")
-        return None
+        """Sample ID of a fragmented message: a PNG attachment name, else an O record"""
+        found = first_specimen_id(lines, self.matcher)
+        if not found:
+            logger.warning("Could not extract sample ID from %d fragmented lines", len(lines))
+            return None
+        
+        if tracer.enabled:
+            tracer.event(f'specimen.extracted_from_{found[1]}', sample_id=found[0])
+        return found[0]
     
     def extract_test_name(self, test_field: str) -> Optional[str]:
         """Extract test name from various formats"""
@@ -302,160 +224,188 @@ class parse_sysmex_file:
     def save_current_sample(self):
         """Save current sample data to parsed samples"""
         if not self.current_sample_id:
-            print("⚠️  No sample ID found, skipping save")
+            if tracer.enabled:
+                tracer.event('astm.sample_skipped', reason='no_sample_id')
             return
             
         if not self.current_test_results:
-            print("⚠️  No test results found, skipping save")
+            if tracer.enabled:
+                tracer.event('astm.sample_skipped', reason='no_results',
+                             sample_id=self.current_sample_id)
             return
             
-        sample_data = {
-            'message_id': self.current_message_id,
-            'patient_info': self.current_patient_info,
-            'sample_info': self.current_sample_info,
-            'test_results': self.current_test_results,
-            'parsed_timestamp': datetime.now().isoformat()
-        }
+        sample_data = ParsedSample(
+            self.current_sample_info,
+            self.current_test_results,
+            header=self.current_message_id,
+            patient=self.current_patient_info,
+            digest=self.current_digest,
+        )
         
         self.parsed_samples.append(sample_data)
+        SAMPLES_PARSED.inc()
         
-        # Print complete sample data
-        print("\n" + "=" * 60)
-        print("💾 COMPLETE SAMPLE DATA SAVED:")
-        print("=" * 60)
-        print(f"Sample ID: {self.current_sample_id}")
-        print(f"Number of Test Results: {len(self.current_test_results)}")
-        print(f"Parsed Timestamp: {sample_data['parsed_timestamp']}")
-        
-        print("\n📋 MESSAGE INFO:")
-        if self.current_message_id:
-            for key, value in self.current_message_id.items():
-                print(f"   {key}: {value}")
-        
-        print("\n👤 PATIENT INFO:")
-        for key, value in self.current_patient_info.items():
-            print(f"   {key}: {value}")
-        
-        print("\n🧪 SAMPLE INFO:")
-        for key, value in self.current_sample_info.items():
-            print(f"   {key}: {value}")
-        
-        print("\n🔬 ALL TEST RESULTS:")
-        for test_name, result in self.current_test_results.items():
-            print(f"   {test_name}:")
-            print(f"      Value: {result['value']}")
-            print(f"      Unit: {result['unit']}")
-            print(f"      Status: {result['status']}")
-            print(f"      Timestamp: {result['timestamp']}")
-        
-        print("=" * 60)
+        if tracer.enabled:
+            tracer.event('astm.sample_saved', sample_id=self.current_sample_id,
+                         patient_id=getattr(self.current_patient_info, 'patient_id', None),
+                         results=len(self.current_test_results),
+                         tests=list(self.current_test_results))
         
         # Reset sample-specific state
         self.current_sample_id = None
-        self.current_sample_info = {}
+        self.current_sample_info = None
         self.current_test_results = {}
     
+    def parse_record(self, line: str) -> bool:
+        """Parse a single ASTM record into the current message state.
+
+        Returns True once the L (terminator) record has been handled.
+        """
+        line = line.strip()
+        if not line:
+            return False
+
+        record_type = line[0]
+        self.message_records += 1
+
+        try:
+            if record_type == 'H':
+                self.current_message_id = self.parse_header_record(line)
+
+            elif record_type == 'P':
+                self.current_patient_info = self.parse_patient_record(line)
+
+            elif record_type == 'O':
+                # Save previous sample if exists
+                if self.current_sample_id:
+                    self.save_current_sample()
+
+                sample_id, sample_info = self.parse_order_record(line)
+                if sample_id:
+                    self.current_sample_id = sample_id
+                    self.current_sample_info = sample_info
+
+            elif record_type == 'R':
+                if self.current_sample_id:
+                    result = self.parse_result_record(line)
+                    if result:
+                        self.current_test_results[result.test_name] = result
+                    elif tracer.enabled:
+                        tracer.event('astm.result_unparsed', line=line[:50])
+                elif tracer.enabled:
+                    tracer.event('astm.result_without_sample', line=line[:50])
+
+            elif record_type == 'Q':
+                if self.collect_queries:
+                    self.parsed_queries.extend(self.parse_query_record(line))
+
+            elif record_type == 'L':
+                self.save_current_sample()
+                header = self.current_message_id
+                MESSAGES_PARSED.inc(analyzer_label(header.sender_name if header else None))
+                RECORDS_PARSED.inc(amount=self.message_records)
+                if tracer.enabled:
+                    tracer.event('astm.message_end')
+                return True
+
+        except Exception as e:
+            logger.warning("Error parsing line: %s (%s)", e, line[:100])
+
+        return False
+
     def parse_message(self, message_lines: List[str]):
         """Parse a complete ASTM message (H to L records)"""
         self.reset_state()
         
-        print(f"\n🔎 PARSING MESSAGE WITH {len(message_lines)} LINES")
-        print("=" * 60)
+        if self.dedup is not None:
+            digest = message_digest(message_lines)
+            if self.dedup.seen(digest):
+                self.duplicates_skipped += 1
+                if tracer.enabled:
+                    tracer.event('astm.duplicate', digest=digest, lines=len(message_lines))
+                return
+            self.current_digest = digest
         
+        if tracer.enabled:
+            tracer.event('astm.message_start', lines=len(message_lines))
+        
+        started = time.perf_counter()
         for line in message_lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            record_type = line[0]
-            
-            try:
-                if record_type == 'H':
-                    self.current_message_id = self.parse_header_record(line)
-                    
-                elif record_type == 'P':
-                    self.current_patient_info = self.parse_patient_record(line)
-                    
-                elif record_type == 'O':
-                    # Save previous sample if exists
-                    if self.current_sample_id:
-                        self.save_current_sample()
-                        
-                    sample_id, sample_info = self.parse_order_record(line)
-                    if sample_id:
-                        self.current_sample_id = sample_id
-                        self.current_sample_info = sample_info
-                    else:
-                        print(f"⚠️  Could not extract sample ID from: {line[:50]}")
-                    
-                elif record_type == 'R':
-                    if self.current_sample_id:
-                        result = self.parse_result_record(line)
-                        if result:
-                            test_name = result['test_name']
-                            self.current_test_results[test_name] = result
-                        else:
-                            print(f"⚠️  Could not parse result: {line[:50]}")
-                    else:
-                        print(f"⚠️  Result without active sample: {line[:50]}")
-                    
-                elif record_type == 'L':
-                    self.save_current_sample()
-                    print(f"🔚 END OF MESSAGE")
-                    break
-                    
-            except Exception as e:
-                print(f"⚠️  Error parsing line: {e}")
-                print(f"   Line: {line[:100]}")
+            if self.parse_record(line):
+                break
+        PARSE_SECONDS.observe(time.perf_counter() - started)
+
+    def unwrap_byte_string_line(self, line: str) -> List[str]:
+        """Split a logged b'...' byte string line back into ASTM records"""
+        # Remove b' prefix and ' suffix, then handle escape sequences
+        content = line[2:-1]
+        # Replace escape sequences
+        content = content.replace('\\r', '\r').replace('\\n', '\n').replace('\\\\', '\\')
+        # Split by \r to get individual records
+        records = []
+        for sub_line in content.split('\r'):
+            sub_line = sub_line.strip()
+            if sub_line:
+                records.append(sub_line)
+        return records
+
+    def build_fragment_message(self, lines: List[str]) -> List[str]:
+        """Wrap a fragmented (R/C-only) stream in a synthetic H/P/O envelope"""
+        # Extract sample ID from PNG filenames
+        sample_id = self.extract_sample_id_from_results(lines)
+        if not sample_id:
+            sample_id = "UNKNOWN"
+        
+        if tracer.enabled:
+            tracer.event('astm.fragment', sample_id=sample_id, lines=len(lines))
+        
+        # Create complete message with dummy headers
+        complete_message = [
+            'H|\\^&|||Sysmex|||||||P|1|20250710154953',
+            'P|1|||||||||||||||||||||||||||||||',
+            f'O|1|^1^{sample_id}^B|^^^^|ALL|||||||||||||||||||||||||||'
+        ]
+        complete_message.extend(lines)
+        
+        # Add terminator if missing
+        if not any(line.startswith('L|') for line in complete_message):
+            complete_message.append('L|1|N')
+
+        return complete_message
     
-    def parse_data(self, data) -> List[Dict[str, Any]]:
+    def parse_data(self, data) -> List[ParsedSample]:
         """Main parsing method for byte data or list of byte chunks"""
-        print("\n" + "=" * 80)
-        print("🚀 STARTING SYSMEX DATA PARSING")
-        print("=" * 80)
-        
         # Handle both single bytes object and list of bytes
         if isinstance(data, list):
             # Concatenate all byte chunks
             combined_data = b''.join(data)
-            print(f"📦 Concatenated {len(data)} byte chunks")
         else:
             combined_data = data
-            print(f"📦 Processing single byte object")
+        
+        if tracer.enabled:
+            tracer.event('parse.start', bytes=len(combined_data),
+                         chunks=len(data) if isinstance(data, list) else 1)
         
         try:
             # Decode bytes to string with error handling
             decoded_data = combined_data.decode('utf-8', errors='replace')
-            print("✅ Successfully decoded data as UTF-8")
         except UnicodeDecodeError:
             # Try with latin-1 encoding as fallback
             decoded_data = combined_data.decode('latin-1', errors='replace')
-            print("✅ Successfully decoded data as Latin-1 (fallback)")
         
         # Handle special case where data contains byte string representations
         # Check if the data contains lines that start with "b'" indicating byte string format
         if "b'" in decoded_data:
-            print("🔧 DETECTED BYTE STRING FORMAT - Processing special format")
             # Extract actual content from byte string representations
             actual_lines = []
             for line in decoded_data.split('\n'):
                 line = line.strip()
                 if line.startswith("b'") and line.endswith("'"):
-                    # Remove b' prefix and ' suffix, then handle escape sequences
-                    content = line[2:-1]
-                    # Replace escape sequences
-                    content = content.replace('\\r', '\r').replace('\\n', '\n').replace('\\\\', '\\')
-                    # Split by \r to get individual records
-                    sub_lines = content.split('\r')
-                    for sub_line in sub_lines:
-                        sub_line = sub_line.strip()
-                        if sub_line:
-                            actual_lines.append(sub_line)
+                    actual_lines.extend(self.unwrap_byte_string_line(line))
                 elif line and not line.startswith("b'"):
                     actual_lines.append(line)
             
             lines = actual_lines
-            print(f"📄 Extracted {len(lines)} actual lines from byte string format")
         else:
             # Original processing for normal format
             lines = []
@@ -463,36 +413,10 @@ class parse_sysmex_file:
                 line = line.strip()
                 if line:
                     lines.append(line)
-            print(f"📄 Processing {len(lines)} lines")
-        
-        print(f"🔍 First few lines: {lines[:3]}")
-        print(f"🔍 Last few lines: {lines[-3:]}")
         
         # For fragmented data (only R records), create a complete message
         if lines and all(line.startswith('R|') or line.startswith('C|') or line.startswith('L|') for line in lines):
-            print("🔧 DETECTED FRAGMENTED DATA - Creating complete message")
-            
-            # Extract sample ID from PNG filenames
-            sample_id = self.extract_sample_id_from_results(lines)
-            if not sample_id:
-                sample_id = "UNKNOWN"
-            
-            print(f"🔍 Using sample ID: {sample_id}")
-            
-            # Create complete message with dummy headers
-            complete_message = [
-                'H|\\^&|||Sysmex|||||||P|1|20250710154953',
-                'P|1|||||||||||||||||||||||||||||||',
-                f'O|1|^1^{sample_id}^B|^^^^|ALL|||||||||||||||||||||||||||'
-            ]
-            complete_message.extend(lines)
-            
-            # Add terminator if missing
-            if not any(line.startswith('L|') for line in complete_message):
-                complete_message.append('L|1|N')
-            
-            # Parse the complete message
-            print(f"🔎 Processing complete message with {len(complete_message)} lines")
+            complete_message = self.build_fragment_message(lines)
             self.parse_message(complete_message)
             
         else:
@@ -520,29 +444,16 @@ class parse_sysmex_file:
                 messages.append(current_message)
             
             # Parse each message
-            for i, message_lines in enumerate(messages):
-                print(f"\n🔎 Processing message {i+1}/{len(messages)}")
+            for message_lines in messages:
                 self.parse_message(message_lines)
         
-        # Print final summary
-        print("\n" + "=" * 80)
-        print("✅ PARSING COMPLETE - FINAL SUMMARY")
-        print("=" * 80)
-        print(f"Total Samples Parsed: {len(self.parsed_samples)}")
-        
-        for i, sample in enumerate(self.parsed_samples, 1):
-            print(f"\nSample {i}:")
-            print(f"  Sample ID: {sample['sample_info'].get('sample_id', 'Unknown')}")
-            print(f"  Patient ID: {sample['patient_info'].get('patient_id', 'Unknown')}")
-            print(f"  Test Results: {len(sample['test_results'])}")
-            print(f"  Tests: {', '.join(sample['test_results'].keys())}")
-        
-        print("=" * 80)
+        if tracer.enabled:
+            tracer.event('parse.done', lines=len(lines), samples=len(self.parsed_samples))
         
         return self.parsed_samples
 
 
-def parse_sysmex_data(data) -> List[Dict[str, Any]]:
+def parse_sysmex_data(data) -> List[ParsedSample]:
     """
     Parse Sysmex LIS data in ASTM E1394-97 format
     
@@ -556,31 +467,183 @@ def parse_sysmex_data(data) -> List[Dict[str, Any]]:
     return parser.parse_data(data)
 
 
-def test_sample_id_extraction():
-    """Test function to debug sample ID extraction"""
-    parser = parse_sysmex_file()
-    
-    # Test cases
-    test_cases = [
-        "7^10^               3615525^B",
-        "7^10^3615525^B",
-        "3616340",
-        "7^1^3616340^B",
-        "7^8^               3615532^B"
-    ]
-    
-    print("=" * 60)
-    print("🧪 TESTING SAMPLE ID EXTRACTION")
-    print("=" * 60)
-    
-    for i, test_case in enumerate(test_cases, 1):
-        print(f"\n--- Test Case {i} ---")
-        result = parser.extract_sample_id_from_field(test_case)
-        print(f"Input: '{test_case}'")
-        print(f"Result: {result}")
-        print(f"Success: {'✅' if result else '❌'}")
-    
-    print("=" * 60)
 
-# Uncomment the line below to run the test
-# test_sample_id_extraction()
\ No newline at end of file
+class SysmexStreamParser:
+    """
+    Push-style incremental parser for Sysmex ASTM traffic.
+
+    Byte chunks are fed as they arrive (socket reads, upload chunks) and
+    every sample is returned as soon as it is complete, i.e. when the next
+    O record or the L terminator is seen. Only the current partial record
+    and the records of one fragmented (R/C-only) message are buffered, so
+    memory stays bounded no matter how long the session runs. Callers that
+    read with recv_into() can hand their ReceiveBuffer to feed_buffer()
+    instead, so records are parsed in place.
+
+    With deduplication enabled the records of the current message are
+    buffered until its L record, so a retransmitted message can be
+    recognized by its fingerprint and dropped before it is parsed.
+    """
+
+    FRAGMENT_RECORDS = ('R|', 'C|')
+
+    def __init__(self, parser: Optional[parse_sysmex_file] = None):
+        self.parser = parser or parse_sysmex_file()
+        self.buffer = ReceiveBuffer(read_size=4096)
+        self.in_message = False
+        self.fragment_lines: List[str] = []
+        self.message_lines: List[str] = []
+        self.records_seen = 0
+        # Without dedup a message is parsed record by record as it arrives,
+        # so its parse time is summed up until the L record
+        self.parse_seconds = 0.0
+
+    @property
+    def duplicates_skipped(self) -> int:
+        return self.parser.duplicates_skipped
+
+    @property
+    def idle(self) -> bool:
+        """Nothing buffered: every record fed so far ended up in a drained sample"""
+        return not (self.in_message or self.fragment_lines or len(self.buffer))
+
+    def feed(self, chunk: bytes) -> List[ParsedSample]:
+        """Consume a chunk of raw bytes and return the samples it completed"""
+        if not chunk:
+            return []
+
+        self.buffer.write(chunk)
+        return self.feed_buffer(self.buffer)
+
+    def feed_buffer(self, buffer: ReceiveBuffer) -> List[ParsedSample]:
+        """Consume complete records already received into a ReceiveBuffer.
+
+        Records are decoded straight from the buffer without copying; an
+        unterminated trailing record stays in the buffer for the next read.
+        """
+        for raw_line in buffer.split_records():
+            self.feed_line(self.decode_line(raw_line))
+
+        return self.drain()
+
+    def close(self) -> List[ParsedSample]:
+        """Flush buffered state at end of stream and return the last samples"""
+        if len(self.buffer):
+            self.feed_line(self.decode_line(self.buffer.pending()))
+            self.buffer.consume(len(self.buffer))
+
+        if self.in_message:
+            # Last message did not end with L|, terminate it ourselves
+            self.end_message('L|1|N')
+
+        self.flush_fragment()
+        return self.drain()
+
+    def decode_line(self, raw_line) -> str:
+        """Decode one raw record, falling back to Latin-1 like parse_data"""
+        try:
+            return str(raw_line, 'utf-8')
+        except UnicodeDecodeError:
+            return str(raw_line, 'latin-1', 'replace')
+
+    def feed_line(self, line: str):
+        """Route one decoded line, unwrapping logged b'...' lines first"""
+        line = line.strip()
+        if not line:
+            return
+
+        if line.startswith("b'") and line.endswith("'"):
+            for record in self.parser.unwrap_byte_string_line(line):
+                self.feed_record(record)
+        else:
+            self.feed_record(line)
+
+    def feed_record(self, line: str):
+        """Advance the message state machine by one ASTM record"""
+        self.records_seen += 1
+
+        if line.startswith('H|'):
+            if self.in_message:
+                # Previous message never saw its L record
+                self.end_message('L|1|N')
+            self.flush_fragment()
+            self.in_message = True
+            if self.parser.dedup is not None:
+                self.message_lines = [line]
+            else:
+                self.parser.reset_state()
+                self.parse_seconds = 0.0
+                self.parse_streamed(line)
+
+        elif self.in_message:
+            if self.parser.dedup is not None:
+                if line.startswith('L|'):
+                    self.end_message(line)
+                else:
+                    self.message_lines.append(line)
+            elif self.parse_streamed(line):
+                self.in_message = False
+
+        elif line.startswith(self.FRAGMENT_RECORDS):
+            # Results without a header, e.g. an R-only retransmission
+            self.fragment_lines.append(line)
+
+        elif line.startswith('L|') and self.fragment_lines:
+            self.fragment_lines.append(line)
+            self.flush_fragment()
+
+    def end_message(self, terminator: str):
+        """Finish the current message with its (or a synthetic) L record"""
+        self.in_message = False
+        if self.parser.dedup is not None:
+            self.message_lines.append(terminator)
+            lines, self.message_lines = self.message_lines, []
+            self.parser.parse_message(lines)
+        else:
+            self.parse_streamed(terminator)
+
+    def parse_streamed(self, line: str) -> bool:
+        """parse_record() for the no-dedup path, timing the message it belongs to"""
+        started = time.perf_counter()
+        ended = self.parser.parse_record(line)
+        self.parse_seconds += time.perf_counter() - started
+        if ended:
+            PARSE_SECONDS.observe(self.parse_seconds)
+        return ended
+
+    def flush_fragment(self):
+        """Parse buffered R/C records as one synthetic message"""
+        if not self.fragment_lines:
+            return
+
+        complete_message = self.parser.build_fragment_message(self.fragment_lines)
+        self.fragment_lines = []
+        self.parser.parse_message(complete_message)
+
+    def drain(self) -> List[ParsedSample]:
+        """Hand over the samples completed so far"""
+        completed = self.parser.parsed_samples
+        self.parser.parsed_samples = []
+        return completed
+
+    def drain_queries(self) -> List[QueryRecord]:
+        """Hand over the Q record specimens parsed so far (see collect_queries)"""
+        queries = self.parser.parsed_queries
+        self.parser.parsed_queries = []
+        return queries
+
+
+def iter_sysmex_samples(chunks: Iterable[bytes]) -> Iterator[ParsedSample]:
+    """
+    Lazily parse Sysmex ASTM data from an iterable of byte chunks
+
+    Args:
+        chunks: Iterable of raw byte chunks (socket reads, upload chunks, ...)
+
+    Yields:
+        Parsed samples in the same format as parse_sysmex_data, one by one
+    """
+    stream = SysmexStreamParser()
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
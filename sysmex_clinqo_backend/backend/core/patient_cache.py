@@ -0,0 +1,66 @@
+"""
+Serialized PatientDetailView payloads, cached per patient
+
+Every patient has a version token in the cache; payloads are stored under
+(patient_id, version) and the version doubles as the response ETag. A
+change to the patient or any of its samples replaces the version once the
+transaction commits, which orphans the old payload and ETag. A conditional
+GET therefore needs one cache read and no database query to answer 304.
+Tokens expire like payloads, and are only created for patients that exist.
+"""
+import uuid
+from typing import Any, Iterable, Optional
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'patient-version:{}'
+PAYLOAD_KEY = 'patient-detail:{}:{}'
+PAYLOAD_TTL = 24 * 3600
+VERSION_TTL = PAYLOAD_TTL  # an expired token only costs one fresh 200
+
+
+def current_version(patient_id: str, create: bool = True) -> Optional[str]:
+    """The patient's version token, creating one on first use or after eviction
+
+    With create=False a missing token is returned as None, so callers can
+    check the patient exists before one is stored for it.
+    """
+    key = VERSION_KEY.format(patient_id)
+    version = cache.get(key)
+    if version is None and create:
+        version = uuid.uuid4().hex[:16]
+        # add() so concurrent first readers agree on one token
+        if not cache.add(key, version, VERSION_TTL):
+            version = cache.get(key, version)
+    return version
+
+
+def etag_for(version: str) -> str:
+    return f'"{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header lists etag or is '*' (weak comparison)"""
+    for tag in (if_none_match or '').split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag or tag == '*':
+            return True
+    return False
+
+
+def get_payload(patient_id: str, version: str) -> Optional[Any]:
+    return cache.get(PAYLOAD_KEY.format(patient_id, version))
+
+
+def set_payload(patient_id: str, version: str, payload: Any):
+    cache.set(PAYLOAD_KEY.format(patient_id, version), payload, PAYLOAD_TTL)
+
+
+def invalidate(patient_ids: Iterable[str]):
+    """Replace the version of patient_ids once the current transaction commits"""
+    patient_ids = list(set(patient_ids))
+    if patient_ids:
+        transaction.on_commit(lambda: cache.delete_many([VERSION_KEY.format(pid) for pid in patient_ids]))
@@ -0,0 +1,121 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from .records import ParsedSample
+
+logger = logging.getLogger(__name__)
+
+MAX_QUEUE = 1000  # queued sample groups before producers are pushed back
+BATCH_SIZE = 200  # samples per database write
+BATCH_INTERVAL = 0.5  # seconds the first queued sample may wait for a batch
+
+SampleWriter = Callable[[List[ParsedSample]], Any]
+Confirmation = Callable[[bool], Any]  # called with whether the samples were stored
+
+_STOP = object()
+
+
+class IngestPipeline:
+    """
+    Bounded hand-off between the receive/parse side and the database.
+
+    Producers offer() groups of parsed samples without blocking; when the
+    queue is full offer() returns False and the producer is expected to hold
+    its analyzer back (the server delays the ACK) and retry. A dedicated
+    writer thread drains the queue and calls writer once per batch, when
+    either batch_size samples are collected or batch_interval has passed
+    since the first sample of the batch arrived.
+
+    A failed batch is logged and reported to the done callbacks of its
+    groups, so the listener keeps the spooled traffic for replay_spool.
+    """
+
+    def __init__(self, writer: SampleWriter, max_queue: int = MAX_QUEUE,
+                 batch_size: int = BATCH_SIZE, batch_interval: float = BATCH_INTERVAL):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+
+        self.samples_written = 0
+        self.batches_written = 0
+        self.batches_failed = 0
+        self.rejected_offers = 0
+
+    @property
+    def depth(self) -> int:
+        """Sample groups waiting for the writer"""
+        return self.queue.qsize()
+
+    @property
+    def capacity(self) -> int:
+        return self.queue.maxsize
+
+    def start(self):
+        self.thread.start()
+
+    def offer(self, samples: List[ParsedSample], done: Optional[Confirmation] = None) -> bool:
+        """Queue samples if there is room, never blocks
+
+        done is called from the writer thread once the batch holding the
+        samples was written (True) or failed (False).
+        """
+        try:
+            self.queue.put_nowait((samples, done))
+            return True
+        except queue.Full:
+            self.rejected_offers += 1
+            return False
+
+    def close(self):
+        """Write everything still queued and stop the writer (blocking)"""
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = list(item[0])
+            confirmations = [item[1]]
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.extend(item[0])
+                confirmations.append(item[1])
+            self._write(batch, confirmations)
+
+    def _write(self, batch: List[ParsedSample], confirmations: List[Optional[Confirmation]] = ()):
+        try:
+            self.writer(batch)
+            self.samples_written += len(batch)
+            self.batches_written += 1
+            stored = True
+        except Exception:
+            # The analyzer has its ACK already: done(False) tells the owner
+            # to keep the spooled traffic for replay_spool
+            self.batches_failed += 1
+            stored = False
+            logger.exception("Failed to store batch of %d samples (%s)", len(batch),
+                             ', '.join(sorted({sample.sample_id or '?' for sample in batch}))[:200])
+        for done in confirmations:
+            if done is not None:
+                try:
+                    done(stored)
+                except Exception:
+                    logger.exception("Ingest confirmation callback failed")
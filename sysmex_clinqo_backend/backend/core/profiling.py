@@ -0,0 +1,219 @@
+"""
+Opt-in sampling profiles of uploads and listener sessions
+
+A profiled operation runs as usual while a background thread samples the
+stacks of the threads doing its work every few milliseconds. Nothing is
+instrumented, so an operation that is not profiled pays nothing and one
+that is pays a stack walk per interval. Each profile is saved as two
+artifacts in the profile directory:
+
+  <id>.json    metadata, exact per-phase wall times from the caller and
+               the sampled share of every stage (decode, unwrap, specimen
+               extraction, parse, ORM, ...)
+  <id>.folded  collapsed stacks ("frame;frame;frame count"), for
+               flamegraph.pl or speedscope
+
+Only one profile runs at a time per process and the directory keeps the
+newest `keep` profiles, so leaving profiling available in production
+costs a bounded amount of disk.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+INTERVAL = 0.005  # seconds between stack samples
+MAX_SECONDS = 300  # sampling stops after this, the operation does not
+KEEP = 20
+PROFILE_ID = re.compile(r'^\d{8}T\d{6}-[0-9a-f]{8}$')
+
+_active = threading.Lock()
+
+
+def stage_of(stack: Sequence) -> str:
+    """The pipeline stage of a sampled stack (code objects, innermost first)"""
+    for code in stack:
+        name, filename = code.co_name, code.co_filename
+        if name == 'decode_line':
+            return 'decode'
+        if name == 'unwrap_byte_string_line':
+            return 'unwrap'
+        if filename.endswith('specimen.py'):
+            return 'specimen'
+        if filename.endswith('dedup.py'):
+            return 'dedup'
+        if filename.endswith(('astm.py', 'recvbuf.py')):
+            return 'framing'
+        if filename.endswith('spool.py'):
+            return 'spool'
+        if filename.endswith(('parser.py', 'records.py')):
+            return 'parse'
+        if f'{os.sep}django{os.sep}db{os.sep}' in filename:
+            return 'orm'
+        if filename.endswith('multipartparser.py'):
+            return 'multipart'
+        if filename.endswith('selectors.py') or (
+                filename.endswith(('threading.py', 'queue.py')) and name in ('wait', 'get')):
+            return 'idle'
+    return 'other'
+
+
+def frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    """
+    One profiled operation
+
+    Use as a context manager around the work, or start() / stop(); then
+    save() with the caller's own phase timings. thread_ids are the threads
+    to sample, the calling thread by default.
+    """
+
+    def __init__(self, kind: str, label: str = '', thread_ids: Optional[Iterable[int]] = None,
+                 interval: float = INTERVAL, max_seconds: float = MAX_SECONDS):
+        now = datetime.now()
+        self.id = f"{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.kind = kind
+        self.label = label
+        self.created_at = now.isoformat()
+        self.thread_ids = set(thread_ids) if thread_ids is not None else {threading.get_ident()}
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks: Counter = Counter()
+        self.stages: Counter = Counter()
+        self.samples = 0
+        self.wall = 0.0
+        self.started = None
+        self.holds_slot = False
+        self.stopping = threading.Event()
+        self.sampler = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    @classmethod
+    def try_start(cls, *args, **kwargs) -> Optional['Profile']:
+        """A started Profile, or None while another one is running"""
+        if not _active.acquire(blocking=False):
+            return None
+        try:
+            profile = cls(*args, **kwargs)
+            profile.holds_slot = True
+            profile.start()
+        except Exception:
+            _active.release()
+            raise
+        return profile
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.sampler.start()
+
+    def stop(self):
+        if self.stopping.is_set():
+            return
+        self.wall = time.perf_counter() - self.started
+        self.stopping.set()
+        self.sampler.join()
+        if self.holds_slot:
+            self.holds_slot = False
+            _active.release()
+
+    def __enter__(self):
+        if self.started is None:
+            self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self.stopping.wait(self.interval) and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.record(frame)
+            del frames
+
+    def record(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        self.samples += 1
+        self.stacks[tuple(stack)] += 1
+        self.stages[stage_of(stack)] += 1
+
+    def folded(self) -> str:
+        lines = Counter()
+        for stack, count in self.stacks.items():
+            lines[';'.join(frame_name(code) for code in reversed(stack))] += count
+        return ''.join(f"{line} {count}\n" for line, count in lines.most_common())
+
+    def summary(self, timings: Optional[Dict[str, float]] = None, **meta: Any) -> Dict[str, Any]:
+        samples = self.samples or 1
+        # Samples cover every sampled thread, so shares are per thread-second
+        sampled_seconds = self.wall * len(self.thread_ids)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'label': self.label,
+            'created_at': self.created_at,
+            'wall_ms': round(self.wall * 1000, 2),
+            'stack_samples': self.samples,
+            'interval_ms': self.interval * 1000,
+            'threads': len(self.thread_ids),
+            'timings_ms': {phase: round(seconds * 1000, 2) for phase, seconds in (timings or {}).items()},
+            'stages': {
+                stage: {'samples': count, 'share': round(count / samples, 4),
+                        'est_ms': round(count / samples * sampled_seconds * 1000, 2)}
+                for stage, count in self.stages.most_common()
+            },
+            **meta,
+        }
+
+    def save(self, directory, timings: Optional[Dict[str, float]] = None, keep: int = KEEP,
+             **meta: Any) -> Dict[str, Any]:
+        """Stop sampling, write both artifacts and prune old profiles; returns the summary"""
+        self.stop()
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        summary = self.summary(timings, **meta)
+        (directory / f"{self.id}.folded").write_text(self.folded())
+        (directory / f"{self.id}.json").write_text(json.dumps(summary, indent=2, default=str))
+        prune_profiles(directory, keep)
+        return summary
+
+
+def prune_profiles(directory, keep: int = KEEP):
+    """Delete all but the newest keep profiles (IDs sort by creation time)"""
+    for path in sorted(Path(directory).glob('*.json'))[:-keep or None]:
+        path.unlink(missing_ok=True)
+        path.with_suffix('.folded').unlink(missing_ok=True)
+
+
+def list_profiles(directory) -> List[Dict[str, Any]]:
+    """Summaries of the saved profiles, newest first"""
+    profiles = []
+    for path in sorted(Path(directory).glob('*.json'), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(directory, profile_id: str, suffix: str) -> Optional[Path]:
+    """Path of a saved artifact, or None for unknown or malformed IDs"""
+    if not PROFILE_ID.match(profile_id or ''):
+        return None
+    path = Path(directory) / f"{profile_id}{suffix}"
+    return path if path.is_file() else None
@@ -0,0 +1,179 @@
+"""
+Compact record types produced by the ASTM parser
+
+A CBC with images is ~40 R records per sample, so these use __slots__
+instead of per-record dicts, share one HeaderRecord/PatientRecord between
+the samples of a message, and intern the strings that repeat on every
+record (analyte names, units, timestamps). Conversion to the dict shapes stored in
+Sample.test_details happens only at the boundary, through to_dict().
+"""
+import re
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+# Sysmex series that get their own metric label; any other sender is 'other'
+ANALYZER_SERIES = frozenset({'XN', 'XS', 'XT', 'XE', 'XP', 'XQ', 'XR', 'XW', 'CA', 'CN', 'CS', 'UF', 'UN'})
+SERIES = re.compile(r'[A-Z]+')
+
+
+def analyzer_name(sender_name: Optional[str]) -> str:
+    """'XN-550^00-26' -> 'XN-550', the analyzer model of an H record sender"""
+    return (sender_name or '').split('^')[0].strip().upper()
+
+
+def analyzer_label(sender_name: Optional[str]) -> str:
+    """'XN-550^00-26' -> 'XN', a metric label from a fixed set
+
+    The sender name is whatever the peer sends, so metrics are labelled
+    with its series, or 'unknown' / 'other', never with the raw name.
+    """
+    model = analyzer_name(sender_name)
+    if not model:
+        return 'unknown'
+    series = SERIES.match(model)
+    return series.group() if series and series.group() in ANALYZER_SERIES else 'other'
+
+
+class Record:
+    __slots__ = ()
+    record_type = ''
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {'record_type': self.record_type}
+        for name in self.__slots__:
+            data[name] = getattr(self, name)
+        return data
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class HeaderRecord(Record):
+    __slots__ = ('sender_name', 'sender_id', 'receiver_id', 'processing_id', 'version', 'received_at')
+    record_type = 'H'
+
+    def __init__(self, sender_name='', sender_id='', receiver_id='', processing_id='',
+                 version='', received_at: Optional[float] = None):
+        self.sender_name = sender_name
+        self.sender_id = sender_id
+        self.receiver_id = receiver_id
+        self.processing_id = processing_id
+        self.version = version
+        self.received_at = time.time() if received_at is None else received_at
+
+    @property
+    def analyzer(self) -> str:
+        return analyzer_name(self.sender_name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = super().to_dict()
+        data['timestamp'] = datetime.fromtimestamp(data.pop('received_at')).isoformat()
+        return data
+
+
+class PatientRecord(Record):
+    __slots__ = ('practice_id', 'patient_id', 'patient_name', 'birth_date', 'sex')
+    record_type = 'P'
+
+    def __init__(self, practice_id='', patient_id='', patient_name='', birth_date='', sex=''):
+        self.practice_id = practice_id
+        self.patient_id = patient_id
+        self.patient_name = patient_name
+        self.birth_date = birth_date
+        self.sex = sex
+
+
+class OrderRecord(Record):
+    __slots__ = ('sample_id', 'specimen_field', 'test_ordered', 'priority', 'collection_date',
+                 'collection_time', 'volume', 'collector_id')
+    record_type = 'O'
+
+    def __init__(self, sample_id: Optional[str] = None, specimen_field='', test_ordered='',
+                 priority='', collection_date='', collection_time='', volume='', collector_id=''):
+        self.sample_id = sample_id
+        self.specimen_field = specimen_field
+        self.test_ordered = test_ordered
+        self.priority = priority
+        self.collection_date = collection_date
+        self.collection_time = collection_time
+        self.volume = volume
+        self.collector_id = collector_id
+
+
+class ResultRecord(Record):
+    __slots__ = ('test_name', 'value', 'unit', 'status', 'timestamp')
+    record_type = 'R'
+
+    def __init__(self, test_name: str, value: Any = None, unit='', status='', timestamp=''):
+        self.test_name = sys.intern(test_name)
+        self.value = value
+        self.unit = sys.intern(unit)
+        self.status = status
+        self.timestamp = sys.intern(timestamp)
+
+    def to_dict(self) -> Dict[str, Any]:
+        # The Sample.test_details shape, which has no record_type
+        return {
+            'test_name': self.test_name,
+            'value': self.value,
+            'unit': self.unit,
+            'status': self.status,
+            'timestamp': self.timestamp,
+        }
+
+
+class QueryRecord(Record):
+    """One specimen of a Q (host query) record; sample_id is None when none was found"""
+
+    __slots__ = ('sample_id', 'specimen_field', 'status')
+    record_type = 'Q'
+
+    def __init__(self, sample_id: Optional[str], specimen_field='', status=''):
+        self.sample_id = sample_id
+        self.specimen_field = specimen_field
+        self.status = status
+
+
+class ParsedSample:
+    """One completed sample: its order, results and the message it came in"""
+
+    __slots__ = ('header', 'patient', 'order', 'results', 'parsed_at', 'digest')
+
+    def __init__(self, order: OrderRecord, results: Dict[str, ResultRecord],
+                 header: Optional[HeaderRecord] = None, patient: Optional[PatientRecord] = None,
+                 parsed_at: Optional[float] = None, digest: Optional[str] = None):
+        self.header = header
+        self.patient = patient
+        self.order = order
+        self.results = results
+        self.parsed_at = time.time() if parsed_at is None else parsed_at
+        # Fingerprint of the message the sample came in (see core/dedup.py)
+        self.digest = digest
+
+    @property
+    def sample_id(self) -> Optional[str]:
+        return self.order.sample_id
+
+    def test_details(self) -> Dict[str, Dict[str, Any]]:
+        """Results in the Sample.test_details JSON shape"""
+        return {name: result.to_dict() for name, result in self.results.items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'message_id': self.header.to_dict() if self.header else None,
+            'patient_info': self.patient.to_dict() if self.patient else {},
+            'sample_info': self.order.to_dict(),
+            'test_results': self.test_details(),
+            'parsed_timestamp': datetime.fromtimestamp(self.parsed_at).isoformat(),
+        }
+
+    def __repr__(self):
+        return f"ParsedSample(sample_id={self.sample_id!r}, results={len(self.results)})"
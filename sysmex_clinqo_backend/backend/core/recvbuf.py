@@ -0,0 +1,97 @@
+import re
+from typing import Iterator
+
+READ_SIZE = 64 * 1024
+
+RECORD_BOUNDARY = re.compile(rb'[\r\n]')
+
+
+class ReceiveBuffer:
+    """
+    Growable receive buffer filled in place with recv_into().
+
+    Data lives in one preallocated bytearray between a read and a write
+    position. Sockets and asyncio.BufferedProtocol write directly into the
+    free tail returned by get_buffer(); consumers read memoryview slices of
+    the unread region, so received bytes are never concatenated or copied
+    per read. Space is reclaimed by moving only the unread remainder to the
+    front, and the array doubles when a single record outgrows it, which
+    keeps total work linear in the session size.
+
+    Slices handed out by pending() and split_records() are only valid until
+    the next get_buffer()/write() call.
+    """
+
+    def __init__(self, read_size: int = READ_SIZE, initial_size: int = 0):
+        self.read_size = read_size
+        self.data = bytearray(max(initial_size, read_size * 2))
+        self.start = 0
+        self.end = 0
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """Writable view of at least read_size (or sizehint) free bytes"""
+        wanted = max(sizehint, self.read_size)
+        if len(self.data) - self.end < wanted:
+            self._make_room(wanted)
+        return memoryview(self.data)[self.end:]
+
+    def commit(self, nbytes: int):
+        """Mark nbytes written into the last get_buffer() view as received"""
+        self.end += nbytes
+
+    def write(self, chunk) -> None:
+        """Copy an externally owned chunk in (for callers without recv_into)"""
+        size = len(chunk)
+        self.get_buffer(size)[:size] = chunk
+        self.end += size
+
+    def recv_into(self, sock) -> int:
+        """Receive straight from a socket, returns 0 when the peer closed"""
+        nbytes = sock.recv_into(self.get_buffer(), self.read_size)
+        self.end += nbytes
+        return nbytes
+
+    def pending(self) -> memoryview:
+        """The unread bytes, without copying"""
+        return memoryview(self.data)[self.start:self.end]
+
+    def consume(self, nbytes: int):
+        self.start += nbytes
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def split_records(self) -> Iterator[memoryview]:
+        """Yield complete CR/LF terminated records and consume them.
+
+        The trailing partial record stays buffered for the next read.
+        """
+        view = memoryview(self.data)
+        search = RECORD_BOUNDARY.search
+        while self.start < self.end:
+            match = search(self.data, self.start, self.end)
+            if not match:
+                break
+            boundary = match.start()
+            record = view[self.start:boundary]
+            self.consume(boundary + 1 - self.start)
+            if record:
+                yield record
+
+    def _make_room(self, wanted: int):
+        unread = self.end - self.start
+        if unread <= len(self.data) // 2 and len(self.data) - unread >= wanted:
+            # Plenty of space once the unread tail moves to the front
+            self.data[:unread] = self.data[self.start:self.end]
+        else:
+            size = len(self.data) * 2
+            while size - unread < wanted:
+                size *= 2
+            grown = bytearray(size)
+            grown[:unread] = self.data[self.start:self.end]
+            # Outstanding slices keep the old array alive, never resize it
+            self.data = grown
+        self.start = 0
+        self.end = unread
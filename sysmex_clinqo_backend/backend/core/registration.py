@@ -0,0 +1,166 @@
+"""
+Bulk registration of patients and their samples, e.g. the morning order
+list from the HIS
+
+Rows are validated one by one without touching the database. Existing
+patients and samples are then resolved with chunked __in lookups, and the
+new ones are inserted with bulk_create, one transaction per chunk. A bad
+row is reported with its index and never fails the rest of the batch;
+existing patients are reused as they are, like get_or_create.
+"""
+import csv
+import io
+import json
+from typing import Any, Dict, List, Tuple
+
+from django.db import DatabaseError, transaction
+
+from . import patient_cache
+from .ingest import LOOKUP_CHUNK_SIZE, WRITE_BATCH_SIZE, build_test_results
+from .models import Patient, Sample, TestResult
+from .serializers import BulkRegistrationRowSerializer
+
+PATIENT_FIELDS = ('name', 'age', 'sex', 'mobile', 'land_line', 'state', 'district', 'address')
+
+Row = Tuple[int, Dict[str, Any]]
+
+
+def rows_from_csv(text: str) -> List[Dict[str, Any]]:
+    """Rows of a CSV with a header of field names; test_details is a JSON column"""
+    rows = []
+    for record in csv.DictReader(io.StringIO(text)):
+        # Surplus values land under a None key and are dropped
+        row = {key.strip(): (value or '').strip() for key, value in record.items() if key}
+        details = row.pop('test_details', '')
+        if details:
+            try:
+                row['test_details'] = json.loads(details)
+            except ValueError:
+                row['test_details'] = details  # reported by the serializer
+        rows.append(row)
+    return rows
+
+
+def row_error(index: int, row: Any, errors) -> Dict[str, Any]:
+    if not isinstance(errors, dict):
+        errors = {'non_field_errors': errors if isinstance(errors, list) else [str(errors)]}
+    return {'row': index, 'sample_id': row.get('sample_id') if isinstance(row, dict) else None,
+            'errors': errors}
+
+
+def register_rows(rows: List[Any]) -> Dict[str, Any]:
+    """
+    Validate and store rows of patient + sample fields
+
+    Returns:
+        {'rows': count, 'created_patients': n, 'created_samples': n,
+         'errors': [{'row': index, 'sample_id': ..., 'errors': {field: [...]}}]}
+    """
+    errors: List[Dict[str, Any]] = []
+    valid: List[Row] = []
+    batch_sample_ids = set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append(row_error(index, row, ['Expected an object of patient and sample fields.']))
+            continue
+        serializer = BulkRegistrationRowSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append(row_error(index, row, serializer.errors))
+            continue
+        data = serializer.validated_data
+        if data['sample_id'] in batch_sample_ids:
+            errors.append(row_error(index, row, {'sample_id': [
+                f"Sample with ID '{data['sample_id']}' appears more than once in this batch."]}))
+            continue
+        batch_sample_ids.add(data['sample_id'])
+        valid.append((index, data))
+
+    existing_samples = set()
+    sample_ids = [data['sample_id'] for _, data in valid]
+    for i in range(0, len(sample_ids), LOOKUP_CHUNK_SIZE):
+        existing_samples.update(Sample.objects.filter(sample_id__in=sample_ids[i:i + LOOKUP_CHUNK_SIZE])
+                                .values_list('sample_id', flat=True))
+    new_rows = []
+    for index, data in valid:
+        if data['sample_id'] in existing_samples:
+            errors.append(row_error(index, data, {'sample_id': [
+                f"Sample with ID '{data['sample_id']}' already exists."]}))
+        else:
+            new_rows.append((index, data))
+
+    patients: Dict[str, int] = {}
+    patient_ids = list({data['patient_id'] for _, data in new_rows})
+    for i in range(0, len(patient_ids), LOOKUP_CHUNK_SIZE):
+        patients.update(Patient.objects.filter(patient_id__in=patient_ids[i:i + LOOKUP_CHUNK_SIZE])
+                        .values_list('patient_id', 'id'))
+
+    totals = {'created_patients': 0, 'created_samples': 0}
+    for i in range(0, len(new_rows), WRITE_BATCH_SIZE):
+        chunk = new_rows[i:i + WRITE_BATCH_SIZE]
+        try:
+            create_rows(chunk, patients, totals)
+        except DatabaseError:
+            # Usually a sample registered concurrently; retry row by row so
+            # only the offending rows are reported
+            for index, data in chunk:
+                try:
+                    create_rows([(index, data)], patients, totals)
+                except DatabaseError as e:
+                    errors.append(row_error(index, data, [f"Could not be saved: {e}"]))
+
+    errors.sort(key=lambda error: error['row'])
+    return {'rows': len(rows), **totals, 'errors': errors}
+
+
+def create_rows(rows: List[Row], patients: Dict[str, int], totals: Dict[str, int]):
+    """Insert one chunk of rows in a transaction; patients maps patient_id -> pk"""
+    new_patients = {}
+    created = []
+    for _, data in rows:
+        if data['patient_id'] not in patients and data['patient_id'] not in new_patients:
+            new_patients[data['patient_id']] = Patient(
+                patient_id=data['patient_id'], **{field: data.get(field, '') for field in PATIENT_FIELDS})
+
+    known = dict(patients)
+    try:
+        with transaction.atomic():
+            if new_patients:
+                # Patients registered since the lookup are reused, not counted;
+                # ignore_conflicts covers the ones that still race this insert
+                patients.update(Patient.objects.filter(patient_id__in=list(new_patients))
+                                .values_list('patient_id', 'id'))
+                Patient.objects.bulk_create([patient for patient_id, patient in new_patients.items()
+                                             if patient_id not in patients], ignore_conflicts=True)
+                created = [patient_id for patient_id in new_patients if patient_id not in patients]
+                patients.update(Patient.objects.filter(patient_id__in=created)
+                                .values_list('patient_id', 'id'))
+
+            samples = Sample.objects.bulk_create([
+                Sample(sample_id=data['sample_id'], patient_id=patients[data['patient_id']],
+                       test_details=data.get('test_details') or {})
+                for _, data in rows
+            ])
+
+            with_results = [sample for sample in samples if sample.test_details]
+            if with_results:
+                if any(sample.pk is None for sample in with_results):
+                    # Backends without RETURNING do not set pks on bulk_create
+                    pks = dict(Sample.objects.filter(sample_id__in=[s.sample_id for s in with_results])
+                               .values_list('sample_id', 'id'))
+                    for sample in with_results:
+                        sample.pk = pks[sample.sample_id]
+                test_results = []
+                for sample in with_results:
+                    test_results.extend(build_test_results(sample, sample.test_details))
+                TestResult.objects.bulk_create(test_results, batch_size=WRITE_BATCH_SIZE)
+
+            # bulk_create sends no post_save, so cached patient pages are dropped here
+            patient_cache.invalidate(data['patient_id'] for _, data in rows)
+    except DatabaseError:
+        # The patients of a rolled back chunk do not exist
+        patients.clear()
+        patients.update(known)
+        raise
+
+    totals['created_patients'] += len(created)
+    totals['created_samples'] += len(samples)
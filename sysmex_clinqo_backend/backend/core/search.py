@@ -0,0 +1,158 @@
+from typing import Dict, List, Sequence
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Patient
+
+SEARCH_FIELDS = ('name', 'patient_id')
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 200
+# Trigram indexes cannot answer anything shorter than one trigram
+MIN_TRIGRAM_LENGTH = 3
+# pg_trgm similarity() threshold for fuzzy matches
+FUZZY_THRESHOLD = 0.3
+
+FTS_TABLE = 'core_patient_fts'
+# SQLite ranks at most this many FTS candidates per query. Ranking every
+# row that shares a trigram with a common name costs ~300 ms at 1M rows;
+# capped, p99 stays under ~25 ms.
+SUBSTRING_CANDIDATES = 1000
+FUZZY_CANDIDATES = 5000
+
+
+def search_patient_ids(query: str, fields: Sequence[str] = SEARCH_FIELDS,
+                       limit: int = DEFAULT_LIMIT, fuzzy: bool = True) -> List[int]:
+    """
+    Ranked Patient primary keys matching query in any of fields
+
+    Substring matches come first (prefix matches ahead of infix ones),
+    followed by fuzzy matches when fuzzy is set. Backed by pg_trgm GIN
+    indexes on PostgreSQL and an FTS5 trigram table on SQLite (see
+    migration 0003); other backends fall back to a LIKE scan.
+    """
+    query = (query or '').strip()
+    fields = [field for field in fields if field in SEARCH_FIELDS]
+    if not query or not fields:
+        return []
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    if len(query) >= MIN_TRIGRAM_LENGTH:
+        if connection.vendor == 'postgresql':
+            return _search_postgresql(query, fields, limit, fuzzy)
+        if connection.vendor == 'sqlite' and _sqlite_fts_available():
+            return _search_sqlite(query, fields, limit, fuzzy)
+    return _search_scan(query, fields, limit)
+
+
+def filter_patients(queryset, field: str, query: str):
+    """
+    Restrict a Patient queryset to rows whose field contains query
+
+    Unlike search_patient_ids this is unranked and unbounded, for list
+    views that paginate the result themselves. On PostgreSQL icontains is
+    answered by the UPPER(field) trigram index; on SQLite the FTS5 table is
+    used as a subquery.
+    """
+    query = (query or '').strip()
+    if not query or field not in SEARCH_FIELDS:
+        return queryset
+    if (connection.vendor == 'sqlite' and len(query) >= MIN_TRIGRAM_LENGTH
+            and _sqlite_fts_available()):
+        match = RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+            [f"{field} : {_fts_phrase(query)}"],
+        )
+        return queryset.filter(pk__in=match)
+    return queryset.filter(**{f"{field}__icontains": query})
+
+
+def _like_escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _search_postgresql(query: str, fields: Sequence[str], limit: int, fuzzy: bool) -> List[int]:
+    # Indexed expressions are UPPER(field), matching what icontains generates
+    contains = f"%{_like_escape(query)}%"
+    prefix = f"{_like_escape(query)}%"
+    matches = [f"UPPER({field}) LIKE UPPER(%s)" for field in fields]
+    params = [contains] * len(fields)
+    if fuzzy:
+        # '%%' is pg_trgm's similarity operator, answered by the same GIN index
+        matches += [f"UPPER({field}) %% UPPER(%s)" for field in fields]
+        params += [query] * len(fields)
+    is_prefix = ' OR '.join(f"UPPER({field}) LIKE UPPER(%s)" for field in fields)
+    is_substring = ' OR '.join(f"UPPER({field}) LIKE UPPER(%s)" for field in fields)
+    similarity = ', '.join(f"similarity(UPPER({field}), UPPER(%s))" for field in fields)
+    sql = (
+        f"SELECT id FROM core_patient WHERE {' OR '.join(matches)} "
+        f"ORDER BY ({is_prefix}) DESC, ({is_substring}) DESC, "
+        f"GREATEST({similarity}, 0) DESC, id DESC LIMIT %s"
+    )
+    params += [prefix] * len(fields) + [contains] * len(fields) + [query] * len(fields) + [limit]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, false)",
+                       [str(FUZZY_THRESHOLD)])
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fts_phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _search_sqlite(query: str, fields: Sequence[str], limit: int, fuzzy: bool) -> List[int]:
+    columns = '{' + ' '.join(fields) + '}'
+    # The trigram tokenizer turns a quoted phrase into a substring match
+    match = f"{columns} : {_fts_phrase(query)}"
+    prefix = f"{_like_escape(query)}%"
+    is_prefix = ' OR '.join(f"{field} LIKE %s ESCAPE '\\'" for field in fields)
+    ranked = (
+        f"SELECT rowid FROM (SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s{{}} "
+        f"LIMIT %s) ORDER BY rank LIMIT %s"
+    )
+
+    with connection.cursor() as cursor:
+        # Prefix matches first, with their own candidate cap: among the
+        # substring candidates they could be cut off by infix matches
+        cursor.execute(ranked.format(f" AND ({is_prefix})"),
+                       [match, *[prefix] * len(fields), SUBSTRING_CANDIDATES, limit])
+        ids = [row[0] for row in cursor.fetchall()]
+
+        if len(ids) < limit:
+            cursor.execute(ranked.format(f" AND NOT ({is_prefix})"),
+                           [match, *[prefix] * len(fields), SUBSTRING_CANDIDATES, limit - len(ids)])
+            ids.extend(row[0] for row in cursor.fetchall())
+
+        if fuzzy and len(ids) < limit:
+            # Any shared trigram matches; bm25 ranks rows sharing most trigrams first
+            trigrams = {query[i:i + 3] for i in range(len(query) - 2)}
+            fuzzy_query = ' OR '.join(_fts_phrase(trigram) for trigram in sorted(trigrams))
+            cursor.execute(ranked.format(''), [f"{columns} : ({fuzzy_query})", FUZZY_CANDIDATES,
+                                               limit + len(ids)])
+            seen = set(ids)
+            for (rowid,) in cursor.fetchall():
+                if rowid not in seen and len(ids) < limit:
+                    ids.append(rowid)
+                    seen.add(rowid)
+    return ids
+
+
+# Connection alias -> whether migration 0003 created the FTS table there
+_fts_available: Dict[str, bool] = {}
+
+
+def _sqlite_fts_available() -> bool:
+    available = _fts_available.get(connection.alias)
+    if available is None:
+        available = _fts_available[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+    return available
+
+
+def _search_scan(query: str, fields: Sequence[str], limit: int) -> List[int]:
+    """Unindexed fallback for short queries and other database backends"""
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f"{field}__icontains": query})
+    return list(Patient.objects.filter(condition).order_by('-id').values_list('id', flat=True)[:limit])
@@ -63,6 +63,20 @@ class PatientCreateSerializer(serializers.Serializer):
 
         return patient
 
+class BulkRegistrationRowSerializer(PatientCreateSerializer):
+    """One row of a bulk registration, saved by core.registration rather than create()"""
+    # Lengths are checked here, so one long value cannot fail a whole chunk of inserts
+    patient_id = serializers.CharField(max_length=20)
+    sample_id = serializers.CharField(max_length=30)
+    name = serializers.CharField(max_length=100)
+    age = serializers.IntegerField(min_value=0)
+    sex = serializers.CharField(max_length=10)
+    mobile = serializers.CharField(max_length=15, required=False, allow_blank=True)
+    land_line = serializers.CharField(max_length=15, required=False, allow_blank=True)
+    state = serializers.CharField(max_length=100)
+    district = serializers.CharField(max_length=100)
+
+
 class SampleDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Sample
@@ -77,3 +91,24 @@ class PatientDetailSerializer(serializers.ModelSerializer):
             'patient_id', 'name', 'age', 'sex', 'mobile',
             'land_line', 'state', 'district', 'address', 'samples'
         ]
+
+
+class SampleSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Sample
+        fields = ['sample_id', 'created_at']
+
+
+class PatientListSerializer(serializers.ModelSerializer):
+    """Slim patient row for list pages; test_details JSON is never included"""
+
+    class Meta:
+        model = Patient
+        fields = ['patient_id', 'name', 'age', 'sex', 'mobile', 'land_line', 'state', 'district']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Only present when the view prefetched recent samples
+        if hasattr(instance, 'recent_samples'):
+            data['recent_samples'] = SampleSummarySerializer(instance.recent_samples, many=True).data
+        return data
@@ -0,0 +1,403 @@
+import asyncio
+import logging
+import signal
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .metrics import (ANALYZER_CONNECTIONS, INGEST_BATCHES, INGEST_QUEUE_CAPACITY,
+                      INGEST_QUEUE_DEPTH, serve_metrics)
+from .pipeline import BATCH_INTERVAL, BATCH_SIZE, MAX_QUEUE, Confirmation, IngestPipeline, SampleWriter
+from .profiling import KEEP, Profile
+from .records import ParsedSample, QueryRecord, analyzer_label
+from .recvbuf import READ_SIZE
+from .session import AnalyzerSession
+from .spool import RawSpool
+
+logger = logging.getLogger(__name__)
+
+HOST = '0.0.0.0'
+PORT = 6000
+IDLE_TIMEOUT = 300  # seconds without traffic before a connection is dropped
+RETRY_INTERVAL = 0.05  # seconds between attempts to hand held samples over
+SENDER_TIMEOUT = 15  # E1381: seconds to wait for the analyzer to answer our ENQ or frame
+BID_RETRY = 10  # E1381: seconds before bidding again after the analyzer refused
+
+
+class AnalyzerProtocol(asyncio.BufferedProtocol):
+    """One analyzer connection: framing, parsing and ACKs stay on the loop,
+    completed samples are handed to the server's ingest pipeline. The loop
+    receives straight into the session's buffer (recv_into).
+
+    When the pipeline is full, samples are held here together with the
+    ACK of the frame that completed them, and reading is paused. The
+    analyzer cannot send its next frame without that ACK, so backpressure
+    reaches the instrument without dropping anything.
+
+    Host query replies (the session's own messages) are written as soon
+    as the session has them, with a timer for the E1381 timeouts."""
+
+    def __init__(self, server: 'AnalyzerServer'):
+        self.server = server
+        self.transport = None
+        self.peer = None
+        self.session = None
+        self.idle_handle = None
+        self.backlog: List[Tuple[List[ParsedSample], Optional[Confirmation]]] = []
+        self.held_reply = bytearray()
+        self.retry_handle = None
+        self.sender_handle = None
+        self.profile = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+        self.session = AnalyzerSession(sample_handler=self.queue_samples,
+                                       read_size=self.server.read_size,
+                                       spool=self.server.spool,
+                                       query_handler=self.server.host_query)
+        self.server.connections.add(self)
+        self.reset_idle_timer()
+        logger.info("Connected by %s (%d open)", self.peer, len(self.server.connections))
+        if self.server.profile_dir:
+            self.profile = Profile.try_start('listener', str(self.peer),
+                                             thread_ids=self.server.profiled_threads())
+            if self.profile:
+                self.session.timings = {}
+                logger.info("Profiling %s as %s", self.peer, self.profile.id)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.session.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes: int):
+        self.reset_idle_timer()
+        reply = self.session.buffer_updated(nbytes)
+        if reply:
+            if self.backlog:
+                # Delay the ACK until the pipeline has taken our samples
+                self.held_reply += reply
+            else:
+                self.server.acknowledge(self.transport, reply)
+        if self.server.host_query:
+            self.send_outgoing()
+
+    def send_outgoing(self):
+        outgoing = self.session.take_outgoing()
+        if outgoing and not self.transport.is_closing():
+            self.transport.write(outgoing)
+        self.reset_sender_timer()
+
+    def reset_sender_timer(self):
+        if self.sender_handle:
+            self.sender_handle.cancel()
+            self.sender_handle = None
+        sender = self.session.sender
+        if sender.active or sender.pending:
+            loop = asyncio.get_running_loop()
+            delay = SENDER_TIMEOUT if sender.active else BID_RETRY
+            self.sender_handle = loop.call_later(delay, self.sender_timed_out)
+
+    def sender_timed_out(self):
+        self.sender_handle = None
+        if self.session.sender.active:
+            self.session.outgoing += self.session.sender_timed_out()
+            logger.warning("%s did not answer our host query reply, gave up", self.peer)
+        else:
+            self.session.outgoing += self.session.bid()
+        self.send_outgoing()
+
+    def queue_samples(self, samples: List[ParsedSample]):
+        done = self.server.spool_confirmation(self.session.spool_segment)
+        if self.backlog or not self.server.pipeline.offer(samples, done):
+            self.backlog.append((samples, done))
+            self.hold()
+
+    def hold(self):
+        if self.retry_handle:
+            return
+        if self.idle_handle:
+            # The analyzer is waiting on us, it is not idle
+            self.idle_handle.cancel()
+            self.idle_handle = None
+        if not self.transport.is_closing():
+            self.transport.pause_reading()
+        loop = asyncio.get_running_loop()
+        self.retry_handle = loop.call_later(self.server.retry_interval, self.retry_backlog)
+
+    def retry_backlog(self):
+        self.retry_handle = None
+        while self.backlog and self.server.pipeline.offer(*self.backlog[0]):
+            self.backlog.pop(0)
+        if self.backlog:
+            self.hold()
+            return
+
+        self.server.backlog_drained(self)
+        if self.transport.is_closing():
+            return
+        if self.held_reply:
+            reply, self.held_reply = bytes(self.held_reply), bytearray()
+            self.server.acknowledge(self.transport, reply)
+        self.transport.resume_reading()
+        self.reset_idle_timer()
+
+    def eof_received(self):
+        # Let the transport close itself; connection_lost does the flushing
+        return False
+
+    def connection_lost(self, exc):
+        if self.idle_handle:
+            self.idle_handle.cancel()
+        if self.sender_handle:
+            self.sender_handle.cancel()
+        self.session.close()
+        self.server.connections.discard(self)
+        if self.backlog:
+            # Keep retrying after disconnect so held samples are not lost
+            self.server.backlogged.add(self)
+        logger.info("%s disconnected after %d bytes, %d samples, %d duplicate messages "
+                    "(ingest queue depth %d/%d)", self.peer, self.session.bytes_received,
+                    self.session.samples_completed, self.session.stream.duplicates_skipped,
+                    self.server.pipeline.depth, self.server.pipeline.capacity)
+        if self.profile:
+            asyncio.get_running_loop().run_in_executor(None, self.server.save_profile, self)
+
+    def reset_idle_timer(self):
+        if self.idle_handle:
+            self.idle_handle.cancel()
+            self.idle_handle = None
+        if self.server.idle_timeout and not self.retry_handle:
+            loop = asyncio.get_running_loop()
+            self.idle_handle = loop.call_later(self.server.idle_timeout, self.idle_timed_out)
+
+    def idle_timed_out(self):
+        logger.info("%s idle for %ss, closing", self.peer, self.server.idle_timeout)
+        self.transport.close()
+
+
+class AnalyzerServer:
+    """
+    Long-running TCP server for any number of analyzers.
+
+    Every connection gets its own AnalyzerSession, so parser and framing
+    state never leak between instruments. Completed samples go through a
+    bounded IngestPipeline whose writer thread commits them in batches, so
+    a slow database never runs on the loop that talks to the analyzers.
+
+    With a RawSpool, ACKs are only sent once the bytes they acknowledge have
+    been fsynced. fsyncs run on their own thread: the first ACK waiting
+    starts one and the ACKs of every connection that arrive meanwhile
+    wait for the next (group commit), so a slow disk delays ACKs but never
+    the loop. A spool commit_interval spaces fsync starts at least that
+    far apart. Spool segments
+    of this run are deleted once every sample parsed from them is stored;
+    a failed write keeps its segment for replay_spool.
+
+    With a metrics_port, Prometheus metrics (core/metrics.py) are served
+    over HTTP on the same loop. With a profile_dir, analyzer sessions are
+    profiled (core/profiling.py), one at a time, and saved there. With a
+    host_query handler (core/hostquery.py), Q records are answered.
+    """
+
+    def __init__(self, sample_writer: SampleWriter, host: str = HOST, port: int = PORT,
+                 idle_timeout: Optional[float] = IDLE_TIMEOUT, read_size: int = READ_SIZE,
+                 spool: Optional[RawSpool] = None, max_queue: int = MAX_QUEUE,
+                 batch_size: int = BATCH_SIZE, batch_interval: float = BATCH_INTERVAL,
+                 metrics_port: Optional[int] = None, profile_dir=None, profile_keep: int = KEEP,
+                 host_query: Optional[Callable[[List[QueryRecord]], List[str]]] = None):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.read_size = read_size
+        self.spool = spool
+        self.pipeline = IngestPipeline(sample_writer, max_queue=max_queue,
+                                       batch_size=batch_size, batch_interval=batch_interval)
+        self.retry_interval = RETRY_INTERVAL
+        self.connections: Set[AnalyzerProtocol] = set()
+        self.backlogged: Set[AnalyzerProtocol] = set()
+        self.pending_acks: List[Tuple[asyncio.BaseTransport, bytes]] = []
+        self.sync_handle = None
+        self.syncing = False
+        self.last_sync = 0.0
+        self.spool_closing = False
+        self.sync_executor = ThreadPoolExecutor(1, thread_name_prefix='spool-sync') if spool else None
+        self.server = None
+        self.stopping = None
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.profile_dir = profile_dir
+        self.profile_keep = profile_keep
+        self.host_query = host_query
+
+    def profiled_threads(self) -> Set[int]:
+        """The loop thread (framing, parsing) and the writer thread (ORM)"""
+        return {threading.get_ident(), self.pipeline.thread.ident}
+
+    def save_profile(self, protocol: AnalyzerProtocol):
+        session = protocol.session
+        try:
+            protocol.profile.save(self.profile_dir, session.timings, keep=self.profile_keep,
+                                  bytes=session.bytes_received, samples_parsed=session.samples_completed,
+                                  duplicate_messages=session.stream.duplicates_skipped)
+            logger.info("Saved profile %s of %s", protocol.profile.id, protocol.peer)
+        except OSError as e:
+            protocol.profile.stop()
+            logger.warning("Could not save profile of %s: %s", protocol.peer, e)
+
+    def connections_by_analyzer(self) -> Dict[Tuple[str], int]:
+        """Open connections per analyzer series, from each session's last H record"""
+        counts = Counter()
+        for protocol in self.connections:
+            header = protocol.session.stream.parser.current_message_id
+            counts[(analyzer_label(header.sender_name if header else None),)] += 1
+        return counts
+
+    def register_metrics(self):
+        pipeline = self.pipeline
+        ANALYZER_CONNECTIONS.set_function(self.connections_by_analyzer)
+        INGEST_QUEUE_DEPTH.set_function(lambda: {(): pipeline.depth})
+        INGEST_QUEUE_CAPACITY.set_function(lambda: {(): pipeline.capacity})
+        INGEST_BATCHES.set_function(lambda: {('written',): pipeline.batches_written,
+                                             ('failed',): pipeline.batches_failed})
+
+    def backlog_drained(self, protocol: AnalyzerProtocol):
+        self.backlogged.discard(protocol)
+
+    def acknowledge(self, transport, reply: bytes):
+        """Send reply bytes once everything spooled so far is durable"""
+        if not self.spool:
+            transport.write(reply)
+            return
+        self.pending_acks.append((transport, reply))
+        if not self.syncing and not self.sync_handle:
+            self.schedule_commit()
+
+    def schedule_commit(self):
+        # commit_interval is the least time between fsync starts, so a lone
+        # ACK goes out after one fsync and a busy spool fsyncs less often
+        wait = self.last_sync + self.spool.commit_interval - time.monotonic()
+        if wait > 0:
+            self.sync_handle = asyncio.get_running_loop().call_later(wait, self.group_commit)
+        else:
+            self.group_commit()
+
+    def group_commit(self):
+        """fsync on the sync thread, then send the ACKs waiting for it"""
+        self.sync_handle = None
+        self.syncing = True
+        self.last_sync = time.monotonic()
+        pending, self.pending_acks = self.pending_acks, []
+        future = asyncio.get_running_loop().run_in_executor(self.sync_executor, self.spool.sync)
+        future.add_done_callback(lambda future: self.synced(future, pending))
+
+    def synced(self, future: asyncio.Future, pending: List[Tuple[asyncio.BaseTransport, bytes]]):
+        self.syncing = False
+        error = future.exception()
+        for transport, reply in pending:
+            if transport.is_closing():
+                continue
+            if error is None:
+                transport.write(reply)
+            else:
+                # Durability is unknown: let the analyzer resend after reconnecting
+                transport.close()
+        if error is not None:
+            logger.error("Spool fsync failed, dropped %d connections: %s", len(pending), error)
+        if self.pending_acks and not self.spool_closing:
+            # Arrived during the fsync, which may not cover them
+            self.schedule_commit()
+        self.purge_spool()
+
+    def spool_confirmation(self, segment: Optional[int]) -> Optional[Confirmation]:
+        """Keep segment until the pipeline reports the samples parsed from it stored"""
+        if segment is None:
+            return None
+        self.spool.pin(segment)
+        loop = asyncio.get_running_loop()
+
+        def done(stored: bool):
+            try:
+                loop.call_soon_threadsafe(self.samples_stored, segment, stored)
+            except RuntimeError:
+                pass  # loop closed during shutdown; the segment stays on disk
+
+        return done
+
+    def samples_stored(self, segment: int, stored: bool):
+        if stored:
+            self.spool.unpin(segment)
+            self.purge_spool()
+        else:
+            # Never unpinned, so neither this segment nor later ones are purged
+            logger.warning("Kept spool segment %d for replay_spool --from-offset %d:0", segment, segment)
+
+    def purge_spool(self):
+        spool = self.spool
+        if spool and not self.spool_closing and spool.purge_floor > spool.first_segment:
+            asyncio.get_running_loop().run_in_executor(self.sync_executor, spool.purge,
+                                                       spool.purge_floor)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.pipeline.start()
+        self.server = await loop.create_server(
+            lambda: AnalyzerProtocol(self), self.host, self.port, reuse_address=True)
+        logger.info("Listening on %s:%s", self.host, self.port)
+        self.register_metrics()
+        if self.metrics_port:
+            self.metrics_server = await serve_metrics(self.host, self.metrics_port)
+            logger.info("Metrics on http://%s:%s/metrics", self.host, self.metrics_port)
+
+    def request_stop(self):
+        if self.stopping:
+            self.stopping.set()
+
+    async def stop(self):
+        """Stop accepting, close open sessions and write everything queued"""
+        if self.server:
+            self.server.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        for protocol in list(self.connections):
+            protocol.transport.close()
+        if self.server:
+            await self.server.wait_closed()
+        # connection_lost runs on the next loop iteration and may queue samples
+        await asyncio.sleep(0)
+        while self.backlogged:
+            await asyncio.sleep(self.retry_interval)
+        await asyncio.get_running_loop().run_in_executor(None, self.pipeline.close)
+        if self.spool:
+            if self.sync_handle:
+                self.sync_handle.cancel()
+                self.sync_handle = None
+            # Lets the last confirmations and purges run before the spool closes
+            await asyncio.sleep(0)
+            while self.syncing:
+                await asyncio.sleep(0.01)
+            self.spool_closing = True
+            self.pending_acks.clear()
+            self.sync_executor.shutdown(wait=True)
+            self.spool.close()
+
+    async def serve_forever(self):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # e.g. Windows or not on the main thread
+        try:
+            await self.stopping.wait()
+        finally:
+            logger.info("Shutting down")
+            await self.stop()
+
+
+def run_server(sample_writer: SampleWriter, **kwargs):
+    """Blocking entry point used by the listener script and command"""
+    asyncio.run(AnalyzerServer(sample_writer, **kwargs).serve_forever())
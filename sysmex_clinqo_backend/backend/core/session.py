@@ -0,0 +1,173 @@
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .astm import ASTMFrameReceiver, ASTMFrameSender
+from .parser import SysmexStreamParser, parse_sysmex_file
+from .records import ParsedSample, QueryRecord
+from .recvbuf import READ_SIZE, ReceiveBuffer
+from .spool import RawSpool
+
+
+class AnalyzerSession:
+    """
+    Per-connection protocol state for one analyzer.
+
+    Raw bytes go through the ASTM E1381 frame receiver, records are handed
+    straight to an incremental parser, and every completed sample is passed
+    to sample_handler. The session is transport agnostic: callers write the
+    bytes returned by data_received() back to the analyzer.
+
+    Transports that support it read straight into the session's
+    ReceiveBuffer via get_buffer()/buffer_updated(), so incoming bytes are
+    framed in place instead of being copied per read.
+
+    With a spool, every read is appended to the write-ahead log before it
+    is parsed, so the raw traffic survives parser or database failures.
+    spool_segment is the segment where the session's data not yet turned
+    into samples starts; it stays pinned (RawSpool.pin) until the session
+    is back between messages.
+
+    With a query_handler, Q records are answered: the handler turns the
+    queried specimens into reply records, which the session sends back as
+    a message of its own (ASTMFrameSender) once the analyzer's transfer
+    has ended. The analyzer's ACKs to those frames are not spooled.
+    """
+
+    def __init__(self, sample_handler: Optional[Callable[[List[ParsedSample]], Any]] = None,
+                 read_size: int = READ_SIZE, spool: Optional[RawSpool] = None,
+                 query_handler: Optional[Callable[[List[QueryRecord]], List[str]]] = None):
+        self.sample_handler = sample_handler
+        self.query_handler = query_handler
+        self.buffer = ReceiveBuffer(read_size)
+        self.spool = spool
+        self.spool_session_id = spool.new_session_id() if spool else None
+        self.spool_segment: Optional[int] = None
+        self.stream = SysmexStreamParser(parse_sysmex_file(collect_queries=query_handler is not None))
+        self.sender = ASTMFrameSender()
+        self.outgoing = bytearray()
+        self.receiver = ASTMFrameReceiver(
+            record_handler=self.stream.feed_line,
+            raw_handler=self._raw_received,
+        )
+        self.bytes_received = 0
+        self.samples_completed = 0
+        # Set to a dict to collect 'spool' and 'receive' (framing + parsing)
+        # wall times, e.g. while the session is profiled
+        self.timings: Optional[Dict[str, float]] = None
+
+    def _raw_received(self, data: bytes):
+        self._dispatch(self.stream.feed(data))
+
+    def _dispatch(self, samples: List[ParsedSample]):
+        if not samples:
+            return
+        self.samples_completed += len(samples)
+        if self.sample_handler:
+            self.sample_handler(samples)
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """Free buffer space for the transport to receive into"""
+        return self.buffer.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes: int) -> bytes:
+        """Process nbytes received into get_buffer(), return the ACK/NAK reply"""
+        self.buffer.commit(nbytes)
+        return self._receive(nbytes)
+
+    def data_received(self, data: bytes) -> bytes:
+        """Feed bytes read from the connection, return the ACK/NAK reply"""
+        self.buffer.write(data)
+        return self._receive(len(data))
+
+    def _receive(self, nbytes: int) -> bytes:
+        if self.query_handler is None:
+            return self._process(nbytes)
+
+        if self.sender.active:
+            # Replies to our own frames, not analyzer traffic
+            buffer = self.buffer
+            pos, outgoing = self.sender.feed(buffer.data, buffer.start, buffer.end)
+            self.outgoing += outgoing
+            self.bytes_received += pos - buffer.start
+            nbytes -= pos - buffer.start
+            buffer.consume(pos - buffer.start)
+        reply = self._process(nbytes) if nbytes else b''
+
+        queries = self.stream.drain_queries()
+        if queries:
+            self.sender.send(self.query_handler(queries))
+        if not self.sender.refused:
+            self.outgoing += self.bid()
+        return reply
+
+    def take_outgoing(self) -> bytes:
+        """Bytes of the session's own messages to write now (ENQ, frames, EOT)
+
+        Unlike the ACK/NAK reply these are never held back: the analyzer
+        only answers them once it has every ACK it waited for.
+        """
+        outgoing, self.outgoing = bytes(self.outgoing), bytearray()
+        return outgoing
+
+    def bid(self) -> bytes:
+        """ENQ for replies still waiting, unless the analyzer is mid-transfer"""
+        return b'' if self.receiver.in_transfer else self.sender.bid()
+
+    def sender_timed_out(self) -> bytes:
+        """The analyzer stopped answering our frames; returns the EOT to send"""
+        return self.sender.abort()
+
+    def _process(self, nbytes: int) -> bytes:
+        if self.timings is not None:
+            return self._timed_process(nbytes)
+        self.bytes_received += nbytes
+        buffer = self.buffer
+        if self.spool:
+            self._spool(buffer.pending())
+        reply = self.receiver.feed(buffer.data, buffer.start, buffer.end)
+        # The receiver keeps the frame in flight itself, nothing stays here
+        buffer.consume(len(buffer))
+        self._dispatch(self.stream.drain())
+        self._release_spool()
+        return reply
+
+    def _spool(self, data):
+        segment = self.spool.append(self.spool_session_id, data)[0]
+        if self.spool_segment is None:
+            self.spool_segment = self.spool.pin(segment)
+
+    def _release_spool(self):
+        if self.spool_segment is not None and self.at_boundary:
+            self.spool.unpin(self.spool_segment)
+            self.spool_segment = None
+
+    @property
+    def at_boundary(self) -> bool:
+        """Between messages: everything received so far was handed over as samples"""
+        return not self.receiver.in_transfer and self.stream.idle
+
+    def _timed_process(self, nbytes: int) -> bytes:
+        self.bytes_received += nbytes
+        buffer = self.buffer
+        started = time.perf_counter()
+        if self.spool:
+            self._spool(buffer.pending())
+        spooled = time.perf_counter()
+        reply = self.receiver.feed(buffer.data, buffer.start, buffer.end)
+        buffer.consume(len(buffer))
+        samples = self.stream.drain()
+        received = time.perf_counter()
+        self.timings['spool'] = self.timings.get('spool', 0.0) + spooled - started
+        self.timings['receive'] = self.timings.get('receive', 0.0) + received - spooled
+        self._dispatch(samples)
+        self._release_spool()
+        return reply
+
+    def close(self):
+        """Flush whatever the parser still holds once the peer disconnects"""
+        if self.spool:
+            self.spool.end_session(self.spool_session_id)
+        self._dispatch(self.stream.close())
+        if self.spool_segment is not None:
+            self.spool.unpin(self.spool_segment)
+            self.spool_segment = None
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import patient_cache
+from .models import Patient, Sample
+
+# bulk_update / bulk_create skip these; callers of those invalidate
+# patient_cache themselves (see store_parsed_samples)
+
+
+@receiver([post_save, post_delete], sender=Patient)
+def patient_changed(sender, instance, **kwargs):
+    patient_cache.invalidate([instance.patient_id])
+
+
+@receiver([post_save, post_delete], sender=Sample)
+def sample_changed(sender, instance, **kwargs):
+    if Sample.patient.is_cached(instance):
+        patient_cache.invalidate([instance.patient.patient_id])
+    else:
+        # Only the business key is needed, not a whole Patient
+        patient_cache.invalidate(Patient.objects.filter(pk=instance.patient_id)
+                                 .values_list('patient_id', flat=True))
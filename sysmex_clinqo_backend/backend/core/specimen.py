@@ -0,0 +1,131 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Pattern, Sequence, Tuple, Union
+
+# Fallback for fields that are neither a bare number nor caret separated
+DEFAULT_PATTERNS = (r'(\d{6,})',)
+# Scattergram/histogram attachments, e.g. "2025_07_10_15_49_3616340_WDF.PNG"
+DEFAULT_PNG_PATTERN = r'_(\d{7})_[A-Z_]+\.PNG'
+MIN_LENGTH = 6
+CACHE_SIZE = 4096
+
+Match = Optional[Tuple[str, str]]
+
+
+class SpecimenIdMatcher:
+    """
+    Extracts the sample ID from an O-record specimen field
+
+    Tried in order, in a single pass over the field:
+
+      direct  the field is a bare number ("3616340")
+      caret   the first caret component that is a number of at least
+              min_length digits ("7^10^               3615525^B")
+      regex.N the first of the precompiled patterns that matches; each
+              pattern captures the ID in group 1
+
+    Analyzers repeat the same rack/position prefixes all day, so results
+    are memoized per raw field in an LRU cache of cache_size entries.
+    """
+
+    def __init__(self, patterns: Sequence[Union[str, Pattern]] = DEFAULT_PATTERNS,
+                 min_length: int = MIN_LENGTH, png_pattern: str = DEFAULT_PNG_PATTERN,
+                 cache_size: int = CACHE_SIZE):
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.min_length = min_length
+        self.png_pattern = re.compile(png_pattern, re.IGNORECASE)
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    def _match(self, field: str) -> Match:
+        if not field:
+            return None
+
+        if field.isdigit():
+            return field, 'direct'
+
+        if '^' in field:
+            for part in field.split('^'):
+                cleaned = part.strip()
+                if len(cleaned) >= self.min_length and cleaned.isdigit():
+                    return cleaned, 'caret'
+
+        for i, pattern in enumerate(self.patterns, 1):
+            found = pattern.search(field)
+            if found:
+                return found.group(1), f'regex.{i}'
+
+        return None
+
+    def extract(self, field: str) -> Optional[str]:
+        """The sample ID in field, or None"""
+        found = self.match(field)
+        return found[0] if found else None
+
+    def extract_from_image(self, line: str) -> Optional[str]:
+        """The sample ID embedded in a PNG attachment name of an R record"""
+        found = self.png_pattern.search(line)
+        return found.group(1) if found else None
+
+    def cache_info(self):
+        return self.match.cache_info()
+
+    def cache_clear(self):
+        self.match.cache_clear()
+
+
+default_matcher = SpecimenIdMatcher()
+# Analyzer model prefix (first component of the H-record sender name,
+# e.g. "XN-550") -> matcher; see configure_matchers()
+_matchers: Dict[str, SpecimenIdMatcher] = {}
+
+
+def configure_matchers(formats: Dict[str, dict]):
+    """
+    Register per-analyzer specimen formats, replacing any earlier ones
+
+    formats maps a model prefix to SpecimenIdMatcher keyword arguments,
+    as in settings.SYSMEX_SPECIMEN_FORMATS:
+
+        {'XN': {'patterns': [r'(\\d{6,})']}, 'XS': {'min_length': 8}}
+    """
+    _matchers.clear()
+    for prefix, options in formats.items():
+        _matchers[prefix.upper()] = SpecimenIdMatcher(**options)
+    matcher_for.cache_clear()
+
+
+@lru_cache(maxsize=64)
+def matcher_for(sender_name: Optional[str]) -> SpecimenIdMatcher:
+    """The matcher for the analyzer that sent a message, longest prefix first"""
+    model = (sender_name or '').split('^')[0].strip().upper()
+    for prefix in sorted(_matchers, key=len, reverse=True):
+        if model.startswith(prefix):
+            return _matchers[prefix]
+    return default_matcher
+
+
+def first_specimen_id(lines: Iterable[str], matcher: SpecimenIdMatcher = default_matcher) -> Match:
+    """
+    Sample ID of a fragmented message in one pass over its records
+
+    A PNG attachment name in an R record wins; otherwise the first O
+    record whose specimen (or instrument specimen) field yields an ID.
+    Returns (sample_id, source) or None.
+    """
+    from_order = None
+    for line in lines:
+        if line.startswith('R|'):
+            if '.PNG' in line.upper():
+                sample_id = matcher.extract_from_image(line)
+                if sample_id:
+                    return sample_id, 'png'
+        elif from_order is None and line.startswith('O|'):
+            parts: List[str] = line.split('|')
+            if len(parts) < 3:
+                continue
+            sample_id = matcher.extract(parts[2].strip())
+            if not sample_id and len(parts) > 3:
+                sample_id = matcher.extract(parts[3].strip())
+            if sample_id:
+                from_order = sample_id, 'order'
+    return from_order
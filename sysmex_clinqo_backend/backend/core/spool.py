@@ -0,0 +1,227 @@
+import itertools
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+COMMIT_INTERVAL = 0.0  # least seconds between the starts of two fsyncs
+
+# Entry: payload length, session id, crc32 of payload, then the payload.
+# A zero-length payload marks the end of a session.
+ENTRY_HEADER = struct.Struct('<IQI')
+SEGMENT_PREFIX = 'spool-'
+SEGMENT_SUFFIX = '.log'
+
+SpoolOffset = Tuple[int, int]  # (segment number, byte offset)
+
+
+def segment_name(number: int) -> str:
+    return f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}"
+
+
+def parse_offset(value: str) -> SpoolOffset:
+    """Parse a 'SEGMENT:OFFSET' string as printed by the replay command"""
+    segment, _, offset = value.partition(':')
+    return int(segment), int(offset or 0)
+
+
+class RawSpool:
+    """
+    Append-only, segment-rotated write-ahead log of raw analyzer traffic.
+
+    Bytes are appended exactly as read from each connection, tagged with a
+    session id so interleaved connections can be separated again on replay.
+    append() only writes; sync() fsyncs everything appended before it was
+    called and is meant to run off the event loop, so the caller batches
+    the ACKs of every append made meanwhile (from any number of
+    connections) into one fsync (group commit). A new segment is started
+    on every open and whenever the current one exceeds segment_size, so
+    old segments are immutable; the retired file is fsynced and closed by
+    the next sync().
+
+    Retention: callers pin() the segment holding data that is not stored
+    in the database yet and unpin() it once it is. purge() deletes the
+    segments of this run below the oldest pin; segments of earlier runs
+    are left for replay_spool.
+    """
+
+    def __init__(self, directory, segment_size: int = SEGMENT_SIZE,
+                 commit_interval: float = COMMIT_INTERVAL):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.commit_interval = commit_interval
+
+        segments = list_segments(self.directory)
+        self.segment_number = segments[-1] + 1 if segments else 1
+        self.first_segment = self.segment_number  # oldest segment of this run still on disk
+        self.file = None
+        self.segment_bytes = 0
+        # Appends so far / covered by the last fsync; guarded by lock
+        # together with file and retired, which sync() reads from its thread
+        self.appended = 0
+        self.synced = 0
+        self.retired: List = []
+        self.directory_dirty = False
+        self.lock = threading.Lock()
+        self.pins: Counter = Counter()
+        # Unique across restarts: seconds since epoch in the high bits
+        self.session_ids = itertools.count((int(time.time()) << 20) + 1)
+        self._open_segment()
+        self.sync()
+
+    @property
+    def dirty(self) -> bool:
+        return self.synced < self.appended or self.directory_dirty
+
+    def _open_segment(self):
+        path = self.directory / segment_name(self.segment_number)
+        file = open(path, 'ab', buffering=0)
+        with self.lock:
+            if self.file is not None:
+                self.retired.append(self.file)
+            self.file = file
+            # The new directory entry is made durable by the next sync()
+            self.directory_dirty = True
+        self.segment_bytes = file.tell()
+
+    def new_session_id(self) -> int:
+        return next(self.session_ids)
+
+    def append(self, session_id: int, data) -> SpoolOffset:
+        """Append raw bytes for a session, returns where the entry starts"""
+        if self.segment_bytes >= self.segment_size:
+            self.rotate()
+        offset = (self.segment_number, self.segment_bytes)
+        header = ENTRY_HEADER.pack(len(data), session_id, zlib.crc32(data))
+        self.file.write(header)
+        if len(data):
+            self.file.write(data)
+        self.segment_bytes += ENTRY_HEADER.size + len(data)
+        # Counted after the write, so a sync() that sees it covers the bytes
+        self.appended += 1
+        return offset
+
+    def end_session(self, session_id: int):
+        self.append(session_id, b'')
+
+    def sync(self):
+        """fsync every append made before the call (safe from another thread)"""
+        with self.lock:
+            target = self.appended
+            retired, self.retired = self.retired, []
+            file = self.file
+            sync_directory, self.directory_dirty = self.directory_dirty, False
+        for old in retired:
+            os.fsync(old.fileno())
+            old.close()
+        if self.synced < target and file is not None:
+            os.fsync(file.fileno())
+        if sync_directory:
+            fsync_directory(self.directory)
+        self.synced = max(self.synced, target)
+
+    def rotate(self):
+        self.segment_number += 1
+        self._open_segment()
+
+    def pin(self, segment: int) -> int:
+        self.pins[segment] += 1
+        return segment
+
+    def unpin(self, segment: int):
+        self.pins[segment] -= 1
+        if self.pins[segment] <= 0:
+            del self.pins[segment]
+
+    @property
+    def purge_floor(self) -> int:
+        """Segments below this hold nothing that still needs replaying"""
+        return min(self.pins) if self.pins else self.segment_number
+
+    def purge(self, floor: Optional[int] = None) -> List[int]:
+        """Delete this run's segments below floor (default purge_floor); returns their numbers"""
+        floor = min(self.purge_floor if floor is None else floor, self.segment_number)
+        deleted = []
+        for number in range(self.first_segment, floor):
+            (self.directory / segment_name(number)).unlink(missing_ok=True)
+            deleted.append(number)
+        self.first_segment = max(self.first_segment, floor)
+        return deleted
+
+    def close(self):
+        if self.file:
+            self.sync()
+            with self.lock:
+                file, self.file = self.file, None
+            file.close()
+
+
+def fsync_directory(directory):
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def list_segments(directory) -> List[int]:
+    numbers = []
+    for path in Path(directory).glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"):
+        number = path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+        if number.isdigit():
+            numbers.append(int(number))
+    return sorted(numbers)
+
+
+def read_spool(directory, start: SpoolOffset = (0, 0)) -> Iterator[Tuple[SpoolOffset, int, bytes]]:
+    """
+    Yield (offset after entry, session id, payload) from start onwards
+
+    Reading stops at the first torn or corrupt entry of a segment (e.g. the
+    tail written during a crash) and continues with the next segment.
+    """
+    start_segment, start_offset = start
+    for number in list_segments(directory):
+        if number < start_segment:
+            continue
+        path = Path(directory) / segment_name(number)
+        with open(path, 'rb', buffering=1024 * 1024) as f:
+            position = start_offset if number == start_segment else 0
+            f.seek(position)
+            while True:
+                header = f.read(ENTRY_HEADER.size)
+                if len(header) < ENTRY_HEADER.size:
+                    break
+                length, session_id, checksum = ENTRY_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    logger.warning("Torn spool entry in %s at %d, skipping rest of segment",
+                                   path.name, position)
+                    break
+                position += ENTRY_HEADER.size + length
+                yield (number, position), session_id, payload
+
+
+def load_checkpoint(path) -> Optional[SpoolOffset]:
+    try:
+        return parse_offset(Path(path).read_text().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_checkpoint(path, offset: SpoolOffset):
+    path = Path(path)
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    tmp.write_text(f"{offset[0]}:{offset[1]}\n")
+    os.replace(tmp, path)
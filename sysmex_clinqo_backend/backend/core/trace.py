@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from typing import Any, Dict
+
+logger = logging.getLogger('core.trace')
+
+
+class Tracer:
+    """
+    Structured trace surface for the ingest hot path.
+
+    Call sites guard every event with ``if tracer.enabled:`` so a disabled
+    tracer costs a single attribute check per record. When enabled, each
+    event bumps a counter and, subject to sample_rate, is logged to the
+    'core.trace' logger as one JSON object per line for the log pipeline.
+
+    Configured from SYSMEX_TRACE (1/true) and SYSMEX_TRACE_SAMPLE (0..1)
+    at import, or at runtime with configure().
+    """
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 1.0):
+        self.counters = Counter()
+        self.configure(enabled, sample_rate)
+
+    def configure(self, enabled: bool = True, sample_rate: float = 1.0):
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.enabled = enabled
+
+    def event(self, name: str, **fields: Any):
+        self.counters[name] += 1
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        fields['event'] = name
+        fields['ts'] = round(time.time(), 6)
+        logger.info(json.dumps(fields, default=str, ensure_ascii=False))
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.counters)
+
+    def reset(self):
+        self.counters.clear()
+
+
+tracer = Tracer(
+    enabled=os.environ.get('SYSMEX_TRACE', '').lower() in ('1', 'true', 'yes'),
+    sample_rate=float(os.environ.get('SYSMEX_TRACE_SAMPLE', '1')),
+)
@@ -0,0 +1,284 @@
+import logging
+import re
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .ingest import store_parsed_samples
+from .parallel import parse_in_pool, parse_pool
+from .parser import SysmexStreamParser
+from .records import ParsedSample
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_KEY = 'sysmex-upload:{}'
+PROGRESS_TTL = 3600  # seconds a finished upload's progress stays readable
+PROGRESS_INTERVAL = 0.5  # minimum seconds between progress writes
+UPLOAD_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+EXPORT_SUFFIXES = ('.txt', '.log', '.astm')
+
+
+def new_upload_id() -> str:
+    return uuid.uuid4().hex
+
+
+def valid_upload_id(upload_id: Optional[str]) -> bool:
+    return bool(upload_id and UPLOAD_ID.match(upload_id))
+
+
+def get_progress(upload_id: str) -> Optional[Dict[str, Any]]:
+    return cache.get(PROGRESS_KEY.format(upload_id))
+
+
+def save_progress(progress: Dict[str, Any]):
+    cache.set(PROGRESS_KEY.format(progress['upload_id']), progress, PROGRESS_TTL)
+
+
+def ingest_chunks(chunks: Iterable[bytes], upload_id: Optional[str] = None,
+                  total_bytes: Optional[int] = None, flush_size: Optional[int] = None,
+                  timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    Parse an instrument export chunk by chunk and store samples as they complete
+
+    Completed samples are written every flush_size samples, so memory is
+    bounded by one chunk plus one batch whatever the size of the export.
+    Each batch is its own transaction: when a later batch fails, earlier
+    ones stay written. Progress is published to the cache under upload_id
+    for get_progress() (and the upload progress endpoint) to read.
+
+    Args:
+        chunks: Raw byte chunks, e.g. UploadedFile.chunks()
+        upload_id: Key to publish progress under, generated when omitted
+        total_bytes: Size of the export if known, for a percentage
+        flush_size: Samples per database write (SYSMEX_UPLOAD_FLUSH_SIZE)
+        timings: Optional dict that receives 'parse', 'lookup' and 'write' seconds
+
+    Returns:
+        The final progress dict, with the updated / not found sample IDs
+    """
+    flush_size = flush_size or getattr(settings, 'SYSMEX_UPLOAD_FLUSH_SIZE', 500)
+    progress = {
+        'upload_id': upload_id or new_upload_id(),
+        'state': 'running',
+        'bytes_read': 0,
+        'total_bytes': total_bytes,
+        'samples_parsed': 0,
+        'samples_updated': 0,
+        'samples_not_found': 0,
+        'duplicate_messages': 0,
+        'duplicate_samples': 0,
+        'error': None,
+    }
+    totals = {'parse': 0.0, 'lookup': 0.0, 'write': 0.0}
+    updated: List[str] = []
+    not_found: List[str] = []
+    pending: List[ParsedSample] = []
+    last_published = 0.0
+
+    def flush():
+        batch_timings = {}
+        batch_updated, batch_not_found = store_parsed_samples(pending, batch_timings, progress)
+        for phase, seconds in batch_timings.items():
+            totals[phase] += seconds
+        updated.extend(batch_updated)
+        not_found.extend(batch_not_found)
+        progress['samples_updated'] = len(updated)
+        progress['samples_not_found'] = len(not_found)
+        pending.clear()
+
+    stream = SysmexStreamParser()
+    save_progress(progress)
+    try:
+        for chunk in chunks:
+            started = time.perf_counter()
+            completed = stream.feed(chunk)
+            totals['parse'] += time.perf_counter() - started
+
+            progress['bytes_read'] += len(chunk)
+            progress['samples_parsed'] += len(completed)
+            progress['duplicate_messages'] = stream.duplicates_skipped
+            pending.extend(completed)
+            if len(pending) >= flush_size:
+                flush()
+
+            now = time.monotonic()
+            if now - last_published >= PROGRESS_INTERVAL:
+                save_progress(progress)
+                last_published = now
+
+        started = time.perf_counter()
+        completed = stream.close()
+        totals['parse'] += time.perf_counter() - started
+        progress['samples_parsed'] += len(completed)
+        progress['duplicate_messages'] = stream.duplicates_skipped
+        pending.extend(completed)
+        if pending:
+            flush()
+    except Exception as e:
+        progress['state'] = 'failed'
+        progress['error'] = str(e)
+        save_progress(progress)
+        raise
+
+    progress['state'] = 'done'
+    save_progress(progress)
+    if timings is not None:
+        timings.update(totals)
+    return dict(progress, updated=updated, not_found=not_found)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """The process pool shared by batch uploads, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = parse_pool(getattr(settings, 'SYSMEX_PARSE_WORKERS', None),
+                               getattr(settings, 'SYSMEX_SPECIMEN_FORMATS', {}),
+                               getattr(settings, 'SYSMEX_DEDUP', True))
+        return _pool
+
+
+def discard_parse_pool(pool: ProcessPoolExecutor):
+    """Shut down a broken pool; the next get_parse_pool() starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_exports(uploaded_files, skipped: List[Dict[str, Any]],
+                 max_bytes: Optional[int] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    (name, data) for every export in uploaded_files, expanding zip archives
+
+    Archive members that are not exports (directories, macOS metadata,
+    other suffixes) and anything past max_bytes of uncompressed data are
+    recorded in skipped instead.
+    """
+    max_bytes = max_bytes or getattr(settings, 'SYSMEX_BATCH_MAX_BYTES', 1 << 30)
+    total = 0
+
+    def admit(name: str, size: int) -> bool:
+        nonlocal total
+        if total + size > max_bytes:
+            skipped.append({'name': name, 'status': 'skipped', 'error': 'batch size limit reached'})
+            return False
+        total += size
+        return True
+
+    for uploaded_file in uploaded_files:
+        if not zipfile.is_zipfile(uploaded_file):
+            if admit(uploaded_file.name, uploaded_file.size):
+                uploaded_file.seek(0)
+                yield uploaded_file.name, uploaded_file.read()
+            continue
+
+        with zipfile.ZipFile(uploaded_file) as archive:
+            for member in archive.infolist():
+                name = f"{uploaded_file.name}/{member.filename}"
+                if member.is_dir() or member.filename.startswith('__MACOSX/'):
+                    continue
+                if not member.filename.lower().endswith(EXPORT_SUFFIXES):
+                    skipped.append({'name': name, 'status': 'skipped', 'error': 'not an export'})
+                    continue
+                if admit(name, member.file_size):
+                    yield name, archive.read(member)
+
+
+def parse_uploaded(uploaded_files, skipped: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    parse_in_pool over the exports in uploaded_files, on the shared pool
+
+    A pool whose worker died (e.g. killed for memory) stays broken: it is
+    shut down and replaced, and when no result was handed out yet the batch
+    is retried once on the new pool.
+    """
+    for attempt in range(2):
+        pool = get_parse_pool()
+        skipped.clear()
+        handed_out = False
+        try:
+            for result in parse_in_pool(pool, iter_exports(uploaded_files, skipped)):
+                handed_out = True
+                yield result
+            return
+        except BrokenProcessPool:
+            discard_parse_pool(pool)
+            if handed_out or attempt:
+                raise
+            logger.warning("Parse pool was broken, retrying the batch on a new one")
+
+
+def ingest_batch(uploaded_files, timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    Parse many exports (or zips of them) in parallel and store them file by file
+
+    Files are parsed by parse_sysmex_file instances in the shared process
+    pool and written in upload order as their results come in, each with
+    its own store_parsed_samples call, so only the files in flight are held
+    in memory. When a sample ID occurs in several files the last one wins.
+    A file whose write fails is reported as failed; earlier files stay
+    written.
+
+    Returns:
+        {'files': per-file status and timing, 'updated': [...], 'not_found': [...],
+         'duplicate_samples': samples skipped as already stored}
+    """
+    files: List[Dict[str, Any]] = []
+    skipped: List[Dict[str, Any]] = []
+    updated: Dict[str, None] = {}
+    not_found: Dict[str, None] = {}
+    stats = {'duplicate_samples': 0}
+    totals = {'lookup': 0.0, 'write': 0.0}
+
+    started = time.perf_counter()
+    for result in parse_uploaded(uploaded_files, skipped):
+        file_status = {
+            'name': result['name'],
+            'status': 'failed' if result['error'] else 'parsed',
+            'bytes': result['bytes'],
+            'samples': len(result['samples']),
+            'updated': 0,
+            'parse_ms': round(result['seconds'] * 1000, 2),
+            'error': result['error'],
+        }
+        files.append(file_status)
+        if not result['samples']:
+            continue
+
+        file_timings = {}
+        try:
+            file_updated, file_not_found = store_parsed_samples(result['samples'], file_timings, stats)
+        except Exception as e:
+            logger.exception("Failed to store batch upload file %s", result['name'])
+            file_status.update(status='failed', error=f"{type(e).__name__}: {e}")
+            continue
+        for phase, seconds in file_timings.items():
+            totals[phase] += seconds
+        file_status['updated'] = len(file_updated)
+        for sample_id in file_updated:
+            updated[sample_id] = None
+            not_found.pop(sample_id, None)
+        for sample_id in file_not_found:
+            if sample_id not in updated:
+                not_found[sample_id] = None
+
+    if timings is not None:
+        timings.update(totals)
+        # Writes overlap with the workers parsing the next files, so this
+        # is the time spent waiting for parse results
+        timings['parse'] = time.perf_counter() - started - totals['lookup'] - totals['write']
+    return {'files': files + skipped, 'updated': list(updated), 'not_found': list(not_found),
+            'duplicate_samples': stats['duplicate_samples']}
@@ -1,13 +1,21 @@
 from django.urls import path
-from .views import PatientWithSampleCreateView,PatientDetailView,HealthCheck,FileUploadView,AllPatientsView,AddSampleToPatientView
+from .views import PatientWithSampleCreateView,PatientDetailView,HealthCheck,FileUploadView,AllPatientsView,AddSampleToPatientView,PatientSearchView,UploadProgressView,BatchUploadView,live_results,metrics,ProfileListView,ProfileDownloadView,PatientBulkRegistrationView
 
 urlpatterns = [
     path('',HealthCheck.as_view(),name='health-check'),
     path('patients/', PatientWithSampleCreateView.as_view(), name='create-patient-with-sample'),
     path('patients/', PatientWithSampleCreateView.as_view(), name='create-patient-with-sample'),
+    path('patients/bulk/', PatientBulkRegistrationView.as_view(), name='bulk-register'),
     path('patients/<str:patient_id>/', PatientDetailView.as_view(), name='get-patient'),
     path('upload/', FileUploadView.as_view(), name='upload-txt'),
+    path('upload/batch/', BatchUploadView.as_view(), name='upload-batch'),
+    path('upload/<str:upload_id>/progress/', UploadProgressView.as_view(), name='upload-progress'),
+    path('live/', live_results, name='live-results'),
+    path('metrics/', metrics, name='metrics'),
+    path('profiles/', ProfileListView.as_view(), name='profiles'),
+    path('profiles/<str:profile_id>/<str:artifact>/', ProfileDownloadView.as_view(), name='profile-download'),
     path('all-patients/', AllPatientsView.as_view(), name='all-patients'),
+    path('search/', PatientSearchView.as_view(), name='patient-search'),
     path('add_sample/<str:patient_id>/', AddSampleToPatientView.as_view(), name='add-sample-to-patient'),
     
 ]
@@ -1,14 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 
 # Create your views here.
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status,generics
-from rest_framework.parsers import MultiPartParser
-from .serializers import PatientCreateSerializer,PatientDetailSerializer,Sample,SampleSerializer
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.parsers import BaseParser, JSONParser, MultiPartParser
+from .serializers import PatientCreateSerializer,PatientDetailSerializer,PatientListSerializer,Sample,SampleSerializer
 from rest_framework.generics import RetrieveAPIView,ListAPIView
 from .models import Patient,Sample
-from .parser import parse_sysmex_file
+from . import patient_cache
+from .live import live_broker
+from .metrics import CONTENT_TYPE, registry
+from .profiling import Profile, list_profiles, profile_path
+from .registration import register_rows, rows_from_csv
+from .uploads import get_progress, ingest_batch, ingest_chunks, valid_upload_id
+from .pagination import PatientCursorPagination
+from .search import DEFAULT_LIMIT, filter_patients, search_patient_ids
 from rest_framework import status
 
 class PatientWithSampleCreateView(APIView):
@@ -19,13 +33,100 @@ class PatientWithSampleCreateView(APIView):
             return Response({'message': 'Patient and Sample saved'}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+class CSVTextParser(BaseParser):
+    """A text/csv request body, as a string"""
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return stream.read().decode('utf-8-sig')
+        except UnicodeDecodeError as e:
+            raise ParseError(f"CSV must be UTF-8: {e}")
+
+
+class PatientBulkRegistrationView(APIView):
+    """
+    Register many patients and samples at once (see core/registration.py)
+
+    Takes a JSON array of PatientCreateSerializer rows (or {"rows": [...]}),
+    a text/csv body or a CSV file in the 'file' field. Rows that fail are
+    listed with their index and errors while the others are saved: 201
+    when every row was saved, 207 when some were, 400 when none were.
+    """
+    parser_classes = [JSONParser, CSVTextParser, MultiPartParser]
+
+    def post(self, request):
+        data = request.data
+        if isinstance(data, str):
+            rows = rows_from_csv(data)
+        elif 'file' in request.FILES:
+            try:
+                rows = rows_from_csv(request.FILES['file'].read().decode('utf-8-sig'))
+            except UnicodeDecodeError as e:
+                return Response({"error": f"CSV must be UTF-8: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            rows = data if isinstance(data, list) else data.get('rows')
+
+        if not isinstance(rows, list) or not rows:
+            return Response({"error": "No rows provided."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > settings.SYSMEX_REGISTRATION_MAX_ROWS:
+            return Response({"error": f"At most {settings.SYSMEX_REGISTRATION_MAX_ROWS} rows per request."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        result = register_rows(rows)
+        if not result['errors']:
+            code = status.HTTP_201_CREATED
+        elif result['created_samples']:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response(result, status=code)
+
+
 class PatientDetailView(RetrieveAPIView):
+    """
+    A patient with its samples, cached per patient version (see core/patient_cache.py)
+
+    The version is the ETag, so a client revalidating with If-None-Match
+    gets a 304 from one cache read; a changed patient is serialized once
+    and then served from the cache until it changes again.
+    """
     queryset = Patient.objects.all()
     serializer_class = PatientDetailSerializer
     lookup_field = 'patient_id'
+
+    def retrieve(self, request, *args, **kwargs):
+        patient_id = kwargs[self.lookup_field]
+        # Read the version before the data: a write racing this request
+        # bumps it afterwards, so a stale payload is never cached as current
+        version = patient_cache.current_version(patient_id, create=False)
+        if version is None:
+            # No token for IDs that do not exist, or every miss would leave one
+            if not self.get_queryset().filter(patient_id=patient_id).exists():
+                raise NotFound()
+            version = patient_cache.current_version(patient_id)
+        etag = patient_cache.etag_for(version)
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        if patient_cache.etag_matches(if_none_match, etag) and (
+                # '*' matches any current version, so only one that exists
+                if_none_match.strip() != '*' or self.get_queryset().filter(patient_id=patient_id).exists()):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            payload = patient_cache.get_payload(patient_id, version)
+            if payload is None:
+                payload = super().retrieve(request, *args, **kwargs).data
+                patient_cache.set_payload(patient_id, version, payload)
+            response = Response(payload)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
 class HealthCheck(APIView):
     def get(self, request):
-        return Response({"status": "OK"}, status=status.HTTP_200_OK)
+        # live_updates tells the frontend whether to open /api/live/ or poll
+        return Response({"status": "OK", "live_updates": settings.SYSMEX_LIVE_UPDATES},
+                        status=status.HTTP_200_OK)
 
 
 
@@ -34,57 +135,162 @@ class FileUploadView(APIView):
     parser_classes = [MultiPartParser]
 
     def post(self, request):
+        # X-Profile: 1 samples this request (multipart parsing included) and
+        # saves the profile, unless another one is already running
+        profile = None
+        if settings.SYSMEX_PROFILING and request.headers.get('X-Profile') in ('1', 'true'):
+            profile = Profile.try_start('upload')
+        try:
+            return self.upload(request, profile)
+        finally:
+            if profile:
+                profile.stop()
+
+    def upload(self, request, profile):
+        started = time.perf_counter()
         uploaded_file = request.FILES.get('file')
         if not uploaded_file:
             return Response({"error": "No file provided."}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Clients that want to poll progress pick the ID before posting
+        upload_id = request.query_params.get('upload_id') or request.headers.get('X-Upload-Id')
+        if upload_id and not valid_upload_id(upload_id):
+            return Response({"error": "Invalid upload_id."}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            file_bytes = uploaded_file.read()
-            parser = parse_sysmex_file()
-            parsed_samples = parser.parse_data(file_bytes)
+            timings = {'receive': time.perf_counter() - started}
+            result = ingest_chunks(uploaded_file.chunks(), upload_id=upload_id,
+                                   total_bytes=uploaded_file.size, timings=timings)
+            updated_samples, not_found_samples = result['updated'], result['not_found']
 
-            updated_samples = []
-            not_found_samples = []
+            message = f"Updated {len(updated_samples)} samples. "
+            if not_found_samples:
+                message += f"Sample IDs not found: {', '.join(not_found_samples)}"
 
-            for sample_data in parsed_samples:
-                sample_id = sample_data['sample_info'].get('sample_id')
-                test_results = sample_data['test_results']
+            body = {
+                "message": message,
+                "upload_id": result['upload_id'],
+                "duplicates": {"messages": result['duplicate_messages'],
+                               "samples": result['duplicate_samples']},
+                "timings_ms": {phase: round(seconds * 1000, 2) for phase, seconds in timings.items()},
+            }
+            if profile:
+                try:
+                    summary = profile.save(settings.SYSMEX_PROFILE_DIR, timings,
+                                           keep=settings.SYSMEX_PROFILE_KEEP, label=uploaded_file.name,
+                                           bytes=uploaded_file.size,
+                                           samples_parsed=result['samples_parsed'])
+                    body["profile"] = {"id": summary['id'], "stages": summary['stages']}
+                except OSError as e:
+                    body["profile"] = {"error": str(e)}
+            return Response(body, status=status.HTTP_200_OK)
 
-                if not sample_id:
-                    continue
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-                try:
-                    sample = Sample.objects.get(sample_id=sample_id)
-                    sample.test_details = test_results
-                    sample.save()
-                    updated_samples.append(sample_id)
-                except Sample.DoesNotExist:
-                    not_found_samples.append(sample_id)
 
-            message = f"Updated {len(updated_samples)} samples. "
-            if not_found_samples:
-                message += f"Sample IDs not found: {', '.join(not_found_samples)}"
+class BatchUploadView(APIView):
+    """Many exports at once: repeated 'files' fields and/or zip archives"""
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        uploaded_files = request.FILES.getlist('files') + request.FILES.getlist('file')
+        if not uploaded_files:
+            return Response({"error": "No files provided."}, status=status.HTTP_400_BAD_REQUEST)
 
-            return Response({"message": message}, status=status.HTTP_200_OK)
+        try:
+            timings = {}
+            result = ingest_batch(uploaded_files, timings)
+            return Response({
+                "message": f"Updated {len(result['updated'])} samples from {len(result['files'])} files.",
+                "files": result['files'],
+                "not_found": result['not_found'],
+                "duplicate_samples": result['duplicate_samples'],
+                "timings_ms": {phase: round(seconds * 1000, 2) for phase, seconds in timings.items()},
+            }, status=status.HTTP_200_OK)
 
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+class ProfileListView(APIView):
+    """Saved upload / listener profiles, newest first (see core/profiling.py)"""
+
+    def get(self, request):
+        return Response(list_profiles(settings.SYSMEX_PROFILE_DIR), status=status.HTTP_200_OK)
+
+
+class ProfileDownloadView(APIView):
+    """One profile's summary (.json) or collapsed stacks (.folded) as a download"""
+
+    def get(self, request, profile_id, artifact):
+        path = None
+        if artifact in ('json', 'folded'):
+            path = profile_path(settings.SYSMEX_PROFILE_DIR, profile_id, f'.{artifact}')
+        if path is None:
+            return Response({"error": "Unknown profile."}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(path.open('rb'), as_attachment=True, filename=path.name,
+                            content_type='application/json' if artifact == 'json' else 'text/plain')
+
+
+class UploadProgressView(APIView):
+    def get(self, request, upload_id):
+        progress = get_progress(upload_id) if valid_upload_id(upload_id) else None
+        if progress is None:
+            return Response({"error": "Unknown upload."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progress, status=status.HTTP_200_OK)
+
 class AllPatientsView(ListAPIView):
-    queryset = Patient.objects.all()
-    serializer_class = PatientDetailSerializer
+    serializer_class = PatientListSerializer
+    pagination_class = PatientCursorPagination
+    max_recent_samples = 20
 
     def get_queryset(self):
         queryset = Patient.objects.all()
         name = self.request.query_params.get('name')
         patient_id = self.request.query_params.get('patient_id')
 
+        # Served by the trigram / FTS5 indexes rather than a table scan
         if name:
-            queryset = queryset.filter(name__icontains=name)
+            queryset = filter_patients(queryset, 'name', name)
         if patient_id:
-            queryset = queryset.filter(patient_id__icontains=patient_id)
+            queryset = filter_patients(queryset, 'patient_id', patient_id)
+
+        # ?recent_samples=N adds each patient's N newest samples with one extra query
+        try:
+            recent = int(self.request.query_params.get('recent_samples', 0))
+        except ValueError:
+            recent = 0
+        recent = min(max(recent, 0), self.max_recent_samples)
+        if recent:
+            queryset = queryset.prefetch_related(Prefetch(
+                'samples',
+                queryset=Sample.objects.only('id', 'sample_id', 'created_at', 'patient_id')
+                                       .order_by('-created_at')[:recent],
+                to_attr='recent_samples',
+            ))
 
-        return queryset
+        return queryset.only(*PatientListSerializer.Meta.fields)
+
+
+class PatientSearchView(APIView):
+    """Ranked prefix/substring/fuzzy search over patient name and ID: ?q=&limit=&fuzzy="""
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            limit = DEFAULT_LIMIT
+        fuzzy = request.query_params.get('fuzzy', '1') not in ('0', 'false')
+
+        ids = search_patient_ids(query, limit=limit, fuzzy=fuzzy)
+        patients = Patient.objects.only(*PatientListSerializer.Meta.fields).in_bulk(ids)
+        ranked = [patients[pk] for pk in ids if pk in patients]
+        return Response({
+            'query': query,
+            'results': PatientListSerializer(ranked, many=True).data,
+        }, status=status.HTTP_200_OK)
 
 
 class AddSampleView(generics.CreateAPIView):
@@ -107,5 +313,26 @@ class AddSampleToPatientView(APIView):
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
-            print("❌ Sample creation error:", serializer.errors)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+async def live_results(request):
+    """
+    Server-Sent Events stream of "results arrived" deltas (see core/live.py)
+
+    ?patient=<patient_id> and ?analyzer=<model> (both repeatable) narrow
+    the stream; with neither, every stored sample is pushed. Needs an
+    ASGI server (uvicorn / daphne), since the response never ends; it is
+    404 unless SYSMEX_LIVE_UPDATES is on and the request came in over ASGI.
+    """
+    if not settings.SYSMEX_LIVE_UPDATES or not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Live updates are disabled"}, status=status.HTTP_404_NOT_FOUND)
+    subscription = live_broker.subscribe(request.GET.getlist('patient'),
+                                         request.GET.getlist('analyzer'))
+    return StreamingHttpResponse(live_broker.stream(subscription), content_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def metrics(request):
+    """Prometheus metrics of this process (see core/metrics.py)"""
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -1,5 +1,8 @@
 import socket
 
+from core.astm import ASTMFrameReceiver
+from core.recvbuf import ReceiveBuffer
+
 HOST = '0.0.0.0'
 PORT = 6000  # Match the Sysmex host port
 
@@ -10,10 +13,15 @@ with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
     conn, addr = s.accept()
     print(f"Connected by {addr}")
 
+    # ACK every frame so the analyzer keeps sending instead of timing out
+    receiver = ASTMFrameReceiver(record_handler=print)
+    buffer = ReceiveBuffer()
+
     with conn, open("sysmex_data.txt", "wb") as f:
-        while True:
-            data = conn.recv(1024)
-            if not data:
-                break
-            print(data)
-        f.write(data)
\ No newline at end of file
+        while buffer.recv_into(conn):
+            # Capture every read, not just the last one
+            f.write(buffer.pending())
+            reply = receiver.feed(buffer.data, buffer.start, buffer.end)
+            if reply:
+                conn.sendall(reply)
+            buffer.consume(len(buffer))
@@ -5,6 +5,14 @@ import type React from "react"
 import { useState, useEffect } from "react"
 import Link from "next/link"
 
+interface UploadProgress {
+  state: string
+  bytes_read: number
+  total_bytes: number | null
+  samples_parsed: number
+  samples_updated: number
+}
+
 interface Patient {
   patient_id: string
   name: string
@@ -19,15 +27,19 @@ interface Patient {
 
 export default function AdminDashboard() {
   const [patients, setPatients] = useState<Patient[]>([])
+  const [nextPage, setNextPage] = useState<string | null>(null)
   const [file, setFile] = useState<File | null>(null)
+  const [progress, setProgress] = useState<UploadProgress | null>(null)
   const [search, setSearch] = useState({ name: "", patient_id: "" })
 
-  const fetchPatients = async () => {
+  const fetchPatients = async (pageUrl?: string) => {
     try {
       const query = new URLSearchParams(search).toString()
-      const res = await fetch(`http://localhost:8000/api/all-patients/?${query}`)
+      const res = await fetch(pageUrl ?? `http://localhost:8000/api/all-patients/?${query}`)
       const data = await res.json()
-      setPatients(data)
+      // all-patients/ is cursor paginated: { next, previous, results }
+      setPatients(pageUrl ? (prev) => [...prev, ...data.results] : data.results)
+      setNextPage(data.next)
     } catch (err) {
       console.error("Error fetching patients", err)
     }
@@ -47,8 +59,18 @@ export default function AdminDashboard() {
     if (!file) return alert("Please select a file")
     const formData = new FormData()
     formData.append("file", file)
+    // Large exports take a while; poll the server-side progress meanwhile
+    const uploadId = crypto.randomUUID().replace(/-/g, "")
+    const poll = setInterval(async () => {
+      try {
+        const res = await fetch(`http://localhost:8000/api/upload/${uploadId}/progress/`)
+        if (res.ok) setProgress(await res.json())
+      } catch (err) {
+        console.error("Error fetching upload progress", err)
+      }
+    }, 1000)
     try {
-      const res = await fetch("http://localhost:8000/api/upload/", {
+      const res = await fetch(`http://localhost:8000/api/upload/?upload_id=${uploadId}`, {
         method: "POST",
         body: formData,
       })
@@ -58,6 +80,9 @@ export default function AdminDashboard() {
     } catch (err) {
       console.error(err)
       alert("Upload error")
+    } finally {
+      clearInterval(poll)
+      setProgress(null)
     }
   }
 
@@ -103,6 +128,12 @@ export default function AdminDashboard() {
               Upload & Parse
             </button>
           </div>
+          {progress && (
+            <p className="mt-4 text-sm text-green-700">
+              Parsed {progress.samples_parsed} samples, updated {progress.samples_updated}
+              {progress.total_bytes ? ` (${Math.round((100 * progress.bytes_read) / progress.total_bytes)}%)` : ""}
+            </p>
+          )}
         </div>
 
         {/* Add Patient Section */}
@@ -225,6 +256,16 @@ export default function AdminDashboard() {
                   ))}
                 </tbody>
               </table>
+              {nextPage && (
+                <div className="p-4 text-center border-t border-green-100">
+                  <button
+                    onClick={() => fetchPatients(nextPage)}
+                    className="px-6 py-2 bg-green-100 text-green-800 text-sm font-medium rounded-lg hover:bg-green-200 transition-colors duration-200"
+                  >
+                    Load more
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
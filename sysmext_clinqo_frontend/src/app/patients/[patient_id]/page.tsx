@@ -29,6 +29,9 @@ interface Patient {
   samples?: Sample[]
 }
 
+// Refresh interval when the backend does not push live updates
+const POLL_INTERVAL_MS = 15000
+
 export default function PatientPage() {
   const params = useParams()
   const patient_id = typeof params?.patient_id === "string" ? params.patient_id : ""
@@ -37,7 +40,9 @@ export default function PatientPage() {
   const [newSampleId, setNewSampleId] = useState("")
   const [submitting, setSubmitting] = useState(false)
 
-  // Fetch patient data
+  // Fetch patient data, and again whenever new results may have arrived:
+  // pushed over /api/live/ when the backend has live updates on (ASGI only),
+  // polled otherwise. Refetches are revalidated with the detail page's ETag.
   useEffect(() => {
     const fetchPatient = async () => {
       try {
@@ -51,7 +56,31 @@ export default function PatientPage() {
         setLoading(false)
       }
     }
-    if (patient_id) fetchPatient()
+    if (!patient_id) return
+    fetchPatient()
+
+    let events: EventSource | null = null
+    let poller: ReturnType<typeof setInterval> | null = null
+    let cancelled = false
+    fetch("http://localhost:8000/api/")
+      .then((res) => res.json())
+      .catch(() => ({ live_updates: false }))
+      .then((config) => {
+        if (cancelled) return
+        if (config.live_updates) {
+          events = new EventSource(
+            `http://localhost:8000/api/live/?patient=${encodeURIComponent(patient_id)}`
+          )
+          events.addEventListener("result", fetchPatient)
+        } else {
+          poller = setInterval(fetchPatient, POLL_INTERVAL_MS)
+        }
+      })
+    return () => {
+      cancelled = true
+      events?.close()
+      if (poller) clearInterval(poller)
+    }
   }, [patient_id])
 
   const handleAddSample = async () => {